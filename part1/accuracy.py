@@ -0,0 +1,73 @@
+import numpy as np
+
+
+def box_iou(boxes_a, boxes_b):
+    """
+    Pairwise IoU of two (N, 4) and (M, 4) arrays of x1, y1, x2, y2 boxes
+    """
+    boxes_a = np.asarray(boxes_a, dtype=np.float64).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float64).reshape(-1, 4)
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.clip(bottom_right - top_left, 0, None).prod(axis=2)
+    area_a = (boxes_a[:, 2:] - boxes_a[:, :2]).prod(axis=1)
+    area_b = (boxes_b[:, 2:] - boxes_b[:, :2]).prod(axis=1)
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.divide(intersection, union, out=np.zeros_like(intersection), where=union > 0)
+
+
+def match_detections(reference, candidate, iou_thresh=0.5):
+    """
+    Greedily match the detections of one image, highest scoring candidates first.
+    A candidate matches the unmatched reference detection of the same label with the highest IoU.
+    Returns a list of (reference index, candidate index, IoU).
+    """
+    if not reference or not candidate:
+        return []
+    ious = box_iou([d["bbox"] for d in reference], [d["bbox"] for d in candidate])
+    same_label = np.array([[r["label"] == c["label"] for c in candidate] for r in reference])
+    ious = np.where(same_label, ious, 0.0)
+
+    matches = []
+    unmatched = np.ones(len(reference), dtype=bool)
+    for j in sorted(range(len(candidate)), key=lambda j: -candidate[j]["score"]):
+        column = np.where(unmatched, ious[:, j], 0.0)
+        i = int(column.argmax())
+        if column[i] >= iou_thresh:
+            unmatched[i] = False
+            matches.append((i, j, float(column[i])))
+    return matches
+
+
+def compare_detections(reference_predictions, candidate_predictions, iou_thresh=0.5):
+    """
+    Summarize how closely candidate detections follow reference detections over a set of images
+    """
+    reference_count = candidate_count = 0
+    ious, score_diffs = [], []
+    for reference, candidate in zip(reference_predictions, candidate_predictions):
+        reference_count += len(reference)
+        candidate_count += len(candidate)
+        for i, j, iou in match_detections(reference, candidate, iou_thresh):
+            ious.append(iou)
+            score_diffs.append(abs(reference[i]["score"] - candidate[j]["score"]))
+    matched = len(ious)
+    return {
+        "images": len(reference_predictions),
+        "reference_detections": reference_count,
+        "candidate_detections": candidate_count,
+        "matched": matched,
+        "recall": matched / reference_count if reference_count else 1.0,
+        "precision": matched / candidate_count if candidate_count else 1.0,
+        "mean_iou": float(np.mean(ious)) if ious else 0.0,
+        "mean_score_diff": float(np.mean(score_diffs)) if score_diffs else 0.0,
+    }
+
+
+def check_backend_accuracy(detector, reference_detector, images, iou_thresh=0.5):
+    """
+    Compare detections of an optimized detector against a reference (eager) detector on sample images
+    """
+    reference_predictions = [reference_detector.predict([image])[0] for image in images]
+    candidate_predictions = [detector.predict([image])[0] for image in images]
+    return compare_detections(reference_predictions, candidate_predictions, iou_thresh)
@@ -0,0 +1,85 @@
+import time
+import queue
+import threading
+from concurrent.futures import Future
+
+
+class QueueFullError(Exception):
+    pass
+
+
+class BatchingDetector:
+    """
+    Coalesce predict requests of many callers into batched calls on one shared detector.
+    Requests arriving within max_wait of each other run in the same batch of up to
+    max_batch images, and each caller receives the predictions of its own images.
+    Requests whose future was cancelled while queued, e.g. after the caller timed out,
+    are dropped instead of running on the detector.
+    Serves the clients of the part1 daemon and the part2 detection endpoint.
+    """
+
+    def __init__(self, detector, max_batch=8, max_wait=0.01, queue_size=0):
+        """
+        Args:
+            detector (RCNNDetector): Detector running the batches.
+            max_batch (int): Most images run in one predict call.
+            max_wait (float): Seconds a request waits for others to join its batch.
+            queue_size (int): Requests waiting for the detector before submit fails, 0 for no limit.
+        """
+        self.detector = detector
+        self.max_batch = max_batch
+        self.max_wait = max_wait
+        self.requests = queue.Queue(maxsize=queue_size)
+
+    def start(self):
+        threading.Thread(target=self._run, name="detection-batcher", daemon=True).start()
+
+    def submit(self, images):
+        """
+        Queue images for detection and return a Future of their predictions.
+        Raises QueueFullError when too many requests are already waiting.
+        """
+        future = Future()
+        try:
+            self.requests.put_nowait((images, future))
+        except queue.Full:
+            raise QueueFullError("Detection queue is full")
+        return future
+
+    def _run(self):
+        while True:
+            batch = [self.requests.get()]
+            if batch[0][1].cancelled():
+                continue
+            size = len(batch[0][0])
+            deadline = time.monotonic() + self.max_wait
+            while size < self.max_batch:
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    break
+                try:
+                    request = self.requests.get(timeout=remaining)
+                except queue.Empty:
+                    break
+                if request[1].cancelled():
+                    continue
+                batch.append(request)
+                size += len(request[0])
+            self._predict(batch)
+
+    def _predict(self, batch):
+        # Marks the futures as running, so they can no longer be cancelled, and skips cancelled ones
+        batch = [(request_images, future) for request_images, future in batch if future.set_running_or_notify_cancel()]
+        if not batch:
+            return
+        images = [image for request_images, _ in batch for image in request_images]
+        try:
+            predictions = self.detector.predict(images)
+        except Exception as e:
+            for _, future in batch:
+                future.set_exception(e)
+            return
+        offset = 0
+        for request_images, future in batch:
+            future.set_result(predictions[offset:offset + len(request_images)])
+            offset += len(request_images)
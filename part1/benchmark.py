@@ -0,0 +1,190 @@
+import os
+import cv2
+import json
+import time
+import argparse
+import platform
+from contextlib import contextmanager
+import numpy as np
+import torch
+import torchvision
+
+from rcnn import BACKENDS, DEFAULT_ARTIFACT_DIR, RCNNDetector
+from utils import setup_logger
+from visualize import draw_bounding_boxes
+
+
+logger = setup_logger("part1_benchmark")
+
+STAGES = ["decode", "preprocess", "forward", "postprocess", "draw", "encode"]
+
+
+def main():
+    # Parse Arguments
+    parser = argparse.ArgumentParser(description="Part 1: offline benchmark of the detection path")
+    parser.add_argument('--sizes', nargs='+', default=["640x480", "1280x720"], help="Synthetic image sizes as WIDTHxHEIGHT")
+    parser.add_argument('--batch-sizes', nargs='+', type=int, default=[1, 4], help="Batch sizes to benchmark")
+    parser.add_argument('--threads', nargs='+', type=int, default=[torch.get_num_threads()], help="Torch thread counts")
+    parser.add_argument('--devices', nargs='+', choices=['cpu', 'cuda'], default=['cpu'], help="Devices for PyTorch")
+    parser.add_argument('--backends', nargs='+', choices=BACKENDS, default=['eager'], help="Detector backends")
+    parser.add_argument('--artifact-dir', default=DEFAULT_ARTIFACT_DIR, help="Folder caching converted models")
+    parser.add_argument('--min-size', type=int, default=800, help="Shorter image side used for inference")
+    parser.add_argument('--max-size', type=int, default=1333, help="Upper bound of the longer image side for inference")
+    parser.add_argument('--conf-thresh', '-c', type=float, default=0.5, help="Confidence threshold for R-CNN")
+    parser.add_argument('--iterations', type=int, default=10, help="Measured batches per configuration")
+    parser.add_argument('--warmup', type=int, default=2, help="Unmeasured batches per configuration")
+    parser.add_argument('--random-weights', action='store_true', help="Use random weights, no download needed")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic images")
+    parser.add_argument('--output', '-o', default="benchmark.json", help="JSON file for the results")
+    args = parser.parse_args()
+
+    results = []
+    for device in args.devices:
+        for backend in args.backends:
+            detector = RCNNDetector(device=device, conf_thresh=args.conf_thresh, min_size=args.min_size,
+                                    max_size=args.max_size, backend=backend, artifact_dir=args.artifact_dir,
+                                    pretrained=not args.random_weights)
+            for num_threads in args.threads:
+                torch.set_num_threads(num_threads)
+                for size in args.sizes:
+                    width, height = parse_size(size)
+                    for batch_size in args.batch_sizes:
+                        encoded = make_synthetic_images(width, height, batch_size, args.seed)
+                        result = benchmark_detector(detector, encoded, args.iterations, args.warmup)
+                        result.update({"device": device, "backend": backend, "threads": num_threads,
+                                       "width": width, "height": height, "batch_size": batch_size})
+                        logger.info(format_result(result))
+                        results.append(result)
+
+    report = {"environment": describe_environment(args.random_weights), "results": results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=4)
+    logger.info(f"Benchmark results saved to {args.output}")
+
+
+def parse_size(size):
+    """
+    Parse a WIDTHxHEIGHT string
+    """
+    width, height = size.lower().split("x")
+    return int(width), int(height)
+
+
+def make_synthetic_images(width, height, count, seed=0):
+    """
+    Create JPEG encoded images with noise and a few filled shapes
+    """
+    rng = np.random.default_rng(seed)
+    encoded = []
+    for _ in range(count):
+        image = rng.integers(0, 256, (height, width, 3), dtype=np.uint8)
+        for _ in range(5):
+            x1, x2 = sorted(rng.integers(0, width, 2))
+            y1, y2 = sorted(rng.integers(0, height, 2))
+            color = tuple(int(c) for c in rng.integers(0, 256, 3))
+            cv2.rectangle(image, (int(x1), int(y1)), (int(x2), int(y2)), color, -1)
+        encoded.append(cv2.imencode(".jpg", image)[1].tobytes())
+    return encoded
+
+
+def benchmark_detector(detector, encoded_images, iterations, warmup):
+    """
+    Time every stage of the detection path on one batch of encoded images.
+    Returns throughput and per-stage latency percentiles of a batch.
+    """
+    timings = {stage: [] for stage in STAGES}
+    total = 0.0
+    for iteration in range(warmup + iterations):
+        batch_timings, elapsed = time_batch(detector, encoded_images)
+        if iteration < warmup:
+            continue
+        total += elapsed
+        for stage, seconds in batch_timings.items():
+            timings[stage].append(seconds)
+
+    return {
+        "images_per_sec": len(encoded_images) * iterations / total if total else 0.0,
+        "batch_latency_ms": summarize([sum(stage_times) for stage_times in zip(*timings.values())]),
+        "stages": {stage: summarize(stage_times) for stage, stage_times in timings.items()},
+    }
+
+
+def time_batch(detector, encoded_images):
+    """
+    Run one batch through decode, preprocess, forward, postprocess, draw and encode
+    """
+    batch_timings = {}
+    start = time.perf_counter()
+
+    with stage_timer(batch_timings, "decode", detector.device):
+        images = [cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR) for data in encoded_images]
+    with stage_timer(batch_timings, "preprocess", detector.device):
+        tensors = [detector.preprocess(image) for image in images]
+    with stage_timer(batch_timings, "forward", detector.device):
+        outputs = detector.forward(tensors)
+    with stage_timer(batch_timings, "postprocess", detector.device):
+        predictions = detector.postprocess(outputs)
+    with stage_timer(batch_timings, "draw", detector.device):
+        annotated = [draw_bounding_boxes(image, prediction) for image, prediction in zip(images, predictions)]
+    with stage_timer(batch_timings, "encode", detector.device):
+        for image in annotated:
+            cv2.imencode(".png", image)
+
+    return batch_timings, time.perf_counter() - start
+
+
+@contextmanager
+def stage_timer(timings, stage, device):
+    """
+    Store the wall time of a block in timings[stage].
+    CUDA work is synchronized so it is charged to the stage that queued it.
+    """
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    start = time.perf_counter()
+    yield
+    if device.type == 'cuda':
+        torch.cuda.synchronize(device)
+    timings[stage] = time.perf_counter() - start
+
+
+def summarize(seconds):
+    """
+    Mean, p50 and p95 of a list of durations in milliseconds
+    """
+    if not seconds:
+        return {"mean_ms": 0.0, "p50_ms": 0.0, "p95_ms": 0.0}
+    milliseconds = np.asarray(seconds) * 1000
+    return {
+        "mean_ms": float(milliseconds.mean()),
+        "p50_ms": float(np.percentile(milliseconds, 50)),
+        "p95_ms": float(np.percentile(milliseconds, 95)),
+    }
+
+
+def format_result(result):
+    stages = ", ".join(f"{stage} {result['stages'][stage]['p50_ms']:.1f}ms" for stage in STAGES)
+    return (f"{result['device']}/{result['backend']} threads={result['threads']} "
+            f"{result['width']}x{result['height']} batch={result['batch_size']}: "
+            f"{result['images_per_sec']:.2f} img/s, p50 {stages}")
+
+
+def describe_environment(random_weights):
+    """
+    Versions and hardware the benchmark ran on, stored with the results for comparisons
+    """
+    return {
+        "python": platform.python_version(),
+        "torch": torch.__version__,
+        "torchvision": torchvision.__version__,
+        "opencv": cv2.__version__,
+        "platform": platform.platform(),
+        "processor": platform.processor(),
+        "cpu_count": os.cpu_count(),
+        "cuda": torch.cuda.get_device_name(0) if torch.cuda.is_available() else None,
+        "random_weights": random_weights,
+    }
+
+
+if __name__ == "__main__":
+    main()
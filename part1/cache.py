@@ -0,0 +1,139 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+
+
+logger = logging.getLogger("part1")
+
+
+class DetectionCache:
+    """
+    On-disk cache of detection results keyed by image content and detector configuration.
+    Entries are small JSON files sharded by hash prefix. When the cache grows past
+    max_bytes the least recently used entries are evicted.
+    """
+
+    def __init__(self, cache_dir, config, max_bytes=1024 * 1024 * 1024):
+        """
+        Args:
+            cache_dir (str): Directory holding cache entries.
+            config (dict): Detector configuration, part of every key.
+            max_bytes (int): Size limit of the cache directory.
+        """
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.config_hash = hashlib.sha256(json.dumps(config, sort_keys=True).encode()).hexdigest()
+        self.hits = 0
+        self.misses = 0
+        self._lock = threading.Lock()
+        os.makedirs(cache_dir, exist_ok=True)
+        self._size = sum(size for _, size, _ in self._entries())
+
+    def key(self, image_bytes):
+        """
+        Build the cache key of an encoded image
+        """
+        digest = hashlib.sha256(self.config_hash.encode())
+        digest.update(image_bytes)
+        return digest.hexdigest()
+
+    def get(self, key):
+        """
+        Return cached detections for a key, or None on a miss
+        """
+        path = self._path(key)
+        try:
+            with open(path) as f:
+                detections = json.load(f)
+            os.utime(path)  # Keep recently used entries away from eviction
+        except (OSError, ValueError):
+            detections = None
+        with self._lock:
+            if detections is None:
+                self.misses += 1
+            else:
+                self.hits += 1
+        return detections
+
+    def put(self, key, detections):
+        """
+        Store detections for a key
+        """
+        path = self._path(key)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        data = json.dumps(detections, separators=(',', ':')).encode()
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'wb') as f:
+            f.write(data)
+        os.replace(tmp_path, path)  # Readers never see a partially written entry
+        with self._lock:
+            self._size += len(data)
+            over_limit = self._size > self.max_bytes
+        if over_limit:
+            self.evict()
+
+    def evict(self):
+        """
+        Delete least recently used entries until the cache is below 90% of its limit
+        """
+        with self._lock:
+            entries = sorted(self._entries(), key=lambda entry: entry[2])
+            size = sum(entry_size for _, entry_size, _ in entries)
+            target = self.max_bytes * 0.9
+            removed = 0
+            for path, entry_size, _ in entries:
+                if size <= target:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    continue
+                size -= entry_size
+                removed += 1
+            self._size = size
+        if removed:
+            logger.info(f"Evicted {removed} cache entries from {self.cache_dir}")
+
+    @property
+    def hit_rate(self):
+        return cache_hit_rate(self.hits, self.misses)
+
+    def summary(self):
+        """
+        Describe cache usage of the current run
+        """
+        return format_cache_summary(self.hits, self.misses)
+
+    def _path(self, key):
+        return os.path.join(self.cache_dir, key[:2], f"{key}.json")
+
+    def _entries(self):
+        """
+        Yield (path, size, mtime) of every cache entry
+        """
+        for shard in os.scandir(self.cache_dir):
+            if not shard.is_dir():
+                continue
+            for entry in os.scandir(shard.path):
+                if not entry.name.endswith(".json"):
+                    continue
+                try:
+                    stat = entry.stat()
+                except OSError:  # Removed by a concurrent eviction
+                    continue
+                yield entry.path, stat.st_size, stat.st_mtime
+
+
+def cache_hit_rate(hits, misses):
+    lookups = hits + misses
+    return hits / lookups if lookups else 0.0
+
+
+def format_cache_summary(hits, misses):
+    """
+    Describe cache usage of a run
+    """
+    return (f"Detection cache: {hits} hit(s), {misses} miss(es), "
+            f"hit rate {cache_hit_rate(hits, misses):.1%}, {hits} inference(s) skipped")
@@ -1,10 +1,17 @@
 import os
 import cv2
 import argparse
+from itertools import chain, islice
 
-from rcnn import RCNNDetector
-from utils import save_to_json, setup_logger
-from visualize import draw_bounding_boxes
+from accuracy import check_backend_accuracy
+from cache import DetectionCache
+from discovery import iter_image_files, iter_manifest
+from remote import DEFAULT_SOCKET_PATH, RemoteDetector
+from settings import BACKENDS, DEFAULT_ARTIFACT_DIR
+from utils import ColumnarResultWriter, JsonlResultWriter, JsonResultWriter, setup_logger
+from pipeline import (detect_images, finish_image, get_bucket_batch_size, get_output_path, get_read_size,
+                      iter_batches, process_images_pipelined, read_image)
+from workers import process_images_parallel
 
 
 logger = setup_logger("part1")
@@ -13,80 +20,201 @@ logger = setup_logger("part1")
 def main():
     # Parse Arguments
     parser = argparse.ArgumentParser(description="Part 1: object detection using R-CNN")
-    parser.add_argument('-i', '--input', required=True, nargs='+', help="Input file(s) or folder(s) with images")
+    parser.add_argument('-i', '--input', nargs='+', default=[], help="Input file(s) or folder(s) with images")
+    parser.add_argument('--manifest', help="File listing image paths one per line, or - for stdin")
+    parser.add_argument('--scan-threads', type=int, default=0, help="Threads listing input folders in parallel")
     parser.add_argument('-o', '--output', default="data/output", help="Output folder for images with bounding boxes")
 
     parser.add_argument('--conf-thresh', '-c', type=float, default=0.5, help="Confidence threshold for R-CNN")
     parser.add_argument('--batch-size', '-b', type=int, default=1, help="Batch size for processing images")
+    parser.add_argument('--bucket-window', type=int, default=1,
+                        help="Regroup this many batches by image aspect ratio to reduce padding")
+    parser.add_argument('--min-size', type=int, default=800, help="Shorter image side used for inference")
+    parser.add_argument('--max-size', type=int, default=1333, help="Upper bound of the longer image side for inference")
     parser.add_argument('--save-json', action='store_true', help="Save results to JSON")
+    parser.add_argument('--json-format', choices=['json', 'jsonl'],
+                        help="Single results.json, or results.jsonl streamed one record per image; implies --save-json")
+    parser.add_argument('--save-columns', action='store_true', help="Save boxes, scores and labels as binary columns")
+    parser.add_argument('--flush-every', type=int, default=100, help="Flush streamed results every N images")
     parser.add_argument('--device', '-d', choices=['cpu', 'cuda'], default='cpu', help="Device for PyTorch")
+    parser.add_argument('--backend', choices=BACKENDS, default='eager', help="Inference backend of the detector")
+    parser.add_argument('--artifact-dir', default=DEFAULT_ARTIFACT_DIR, help="Folder caching converted models")
+    parser.add_argument('--check-accuracy', type=int, default=0, metavar='N',
+                        help="Compare the backend against eager on the first N images before processing")
+    parser.add_argument('--classes', nargs='+', help="Only keep detections with these labels")
+    parser.add_argument('--pipeline', action='store_true', help="Overlap decoding, inference and writing")
+    parser.add_argument('--queue-depth', type=int, default=2, help="Batches decoded ahead of the model in pipeline mode")
+    parser.add_argument('--readers', type=int, default=2, help="Decoding threads in pipeline mode")
+    parser.add_argument('--writers', type=int, default=2, help="Annotating/writing threads in pipeline mode")
+    parser.add_argument('--workers', type=int, default=1, help="Worker processes, each running its own detector")
+    parser.add_argument('--threads-per-worker', type=int, help="Torch threads per worker process, cores / workers by default")
+    parser.add_argument('--daemon-socket', default=DEFAULT_SOCKET_PATH, help="Socket of a running detector daemon")
+    parser.add_argument('--no-daemon', action='store_true', help="Always run the detector in this process")
+    parser.add_argument('--cache-dir', help="Cache detection results in this folder and skip already processed images")
+    parser.add_argument('--cache-size', type=int, default=1024, help="Size limit of the detection cache in MB")
     args = parser.parse_args()
-
-    # Get a list of files to be processed
-    image_files = collect_image_files(args.input)
-    if not image_files:
+    if not args.input and not args.manifest:
+        parser.error("at least one of --input or --manifest is required")
+    if args.json_format:
+        args.save_json = True
+    if args.workers > 1:
+        # Worker processes each run their own sequential loop and detector
+        ignored = [flag for flag, dest in (('--pipeline', 'pipeline'), ('--queue-depth', 'queue_depth'),
+                                           ('--readers', 'readers'), ('--writers', 'writers'),
+                                           ('--daemon-socket', 'daemon_socket'))
+                   if getattr(args, dest) != parser.get_default(dest)]
+        if ignored:
+            parser.error(f"{', '.join(ignored)} cannot be combined with --workers > 1")
+
+    # Files are discovered lazily while earlier ones are already being processed
+    image_files = iter_image_files(args.input, num_threads=args.scan_threads)
+    if args.manifest:
+        image_files = chain(iter_manifest(args.manifest), image_files)
+    first_files = list(islice(image_files, max(1, args.check_accuracy)))
+    if not first_files:
         logger.error("No valid image files found. Exiting.")
         exit(1)
-
-    logger.info(f"Collected {len(image_files)} image file(s) for processing.")
+    image_files = CountingIterator(chain(first_files, image_files))
     
     # Create output Dir if it doesn't exist
     output_dir = args.output
     os.makedirs(output_dir, exist_ok=True)
     
+    detector_kwargs = {"device": args.device, "conf_thresh": args.conf_thresh, "classes": args.classes,
+                       "min_size": args.min_size, "max_size": args.max_size,
+                       "backend": args.backend, "artifact_dir": args.artifact_dir}
+    cache_size = args.cache_size * 1024 * 1024
+    result_writers = create_result_writers(args, output_dir)
+
+    if args.check_accuracy:
+        report_backend_accuracy(first_files[:args.check_accuracy], detector_kwargs)
+
+    if args.workers > 1:
+        # Every worker process loads its own detector and cache
+        process_images_parallel(image_files, output_dir, detector_kwargs, result_writers, args.batch_size,
+                                args.workers, threads_per_worker=args.threads_per_worker,
+                                cache_dir=args.cache_dir, cache_size=cache_size, bucket_window=args.bucket_window)
+        close_result_writers(result_writers)
+        logger.info(f"Processed {image_files.count} image file(s).")
+        return
+
     # Initialize R-CNN detector
-    detector = RCNNDetector(device=args.device, conf_thresh=args.conf_thresh)
+    detector = load_detector(detector_kwargs, None if args.no_daemon else args.daemon_socket)
+
+    cache = None
+    if args.cache_dir:
+        cache = DetectionCache(args.cache_dir, detector.config(), max_bytes=cache_size)
 
     # Process images
-    process_images(image_files, output_dir, detector, args.save_json, args.batch_size)
+    if args.pipeline:
+        process_images_pipelined(image_files, output_dir, detector, result_writers, args.batch_size,
+                                 queue_depth=args.queue_depth, num_readers=args.readers, num_writers=args.writers,
+                                 cache=cache, bucket_window=args.bucket_window)
+    else:
+        process_images(image_files, output_dir, detector, result_writers, args.batch_size, cache=cache,
+                       bucket_window=args.bucket_window)
+
+    close_result_writers(result_writers)
+    logger.info(f"Processed {image_files.count} image file(s).")
+    if cache is not None:
+        logger.info(cache.summary())
+
+
+class CountingIterator:
+    """
+    Iterator counting the items passed through it
+    """
+    def __init__(self, iterable):
+        self.iterator = iter(iterable)
+        self.count = 0
+
+    def __iter__(self):
+        return self
+
+    def __next__(self):
+        item = next(self.iterator)
+        self.count += 1
+        return item
+
 
+def load_detector(detector_kwargs, daemon_socket=None):
+    """
+    Use the detector daemon when it runs with matching settings, otherwise load the model here.
+    torch is only imported in the second case, which keeps delegating invocations fast.
+    """
+    if daemon_socket:
+        detector = RemoteDetector.connect(daemon_socket, detector_kwargs)
+        if detector is not None:
+            logger.info(f"Using detector daemon at {daemon_socket}")
+            return detector
+    from rcnn import RCNNDetector
+    return RCNNDetector(**detector_kwargs)
 
-def process_images(image_files, output_dir, detector, save_json, batch_size):
+
+def report_backend_accuracy(image_files, detector_kwargs):
+    """
+    Log how far detections of the selected backend are from the eager model
+    """
+    from rcnn import RCNNDetector
+    images = [image for image in map(cv2.imread, image_files) if image is not None]
+    detector = RCNNDetector(**detector_kwargs)
+    reference_detector = RCNNDetector(**{**detector_kwargs, "backend": "eager"})
+    report = check_backend_accuracy(detector, reference_detector, images)
+    logger.info(f"Accuracy of the {detector.backend} backend against eager on {report['images']} image(s): "
+                f"recall {report['recall']:.3f}, precision {report['precision']:.3f}, "
+                f"mean IoU {report['mean_iou']:.3f}, mean score difference {report['mean_score_diff']:.4f}")
+
+
+def create_result_writers(args, output_dir):
+    """
+    Create the writers for detection results requested on the command line
+    """
+    result_writers = []
+    if args.save_json and args.json_format == 'jsonl':
+        result_writers.append(JsonlResultWriter(os.path.join(output_dir, "results.jsonl"), flush_every=args.flush_every))
+    elif args.save_json:
+        result_writers.append(JsonResultWriter(os.path.join(output_dir, "results.json")))
+    if args.save_columns:
+        result_writers.append(ColumnarResultWriter(os.path.join(output_dir, "detections"), flush_every=args.flush_every))
+    return result_writers
+
+
+def close_result_writers(result_writers):
+    """
+    Close result writers and report where the results went
+    """
+    for writer in result_writers:
+        writer.close()
+        logger.info(f"Results saved to {writer.filepath}")
+
+
+def process_images(image_files, output_dir, detector, result_writers, batch_size, cache=None, bucket_window=1):
     """
     Process a list of images using the R-CNN detector.
     Args:
-        image_files (list[str]): List of image file paths.
+        image_files (Iterable[str]): Image file paths, consumed lazily.
         output_dir (str): Directory to save outputs.
         detector (RCNNDetector): Initialized R-CNN detector.
-        save_json (bool): Whether to save results to JSON.
+        result_writers (list): Writers receiving the detections of each image in order.
         batch_size (int): Batch size for processing images.
+        cache (DetectionCache, optional): Cache of detection results.
+        bucket_window (int): Number of batches regrouped by image shape before inference.
     """
-    all_detections = []
-    for i in range(0, len(image_files), batch_size):
-        batch_files = image_files[i:i+batch_size]
-        batch_images = [cv2.imread(file) for file in batch_files]
-        predictions = detector.predict(batch_images)
-
-        for image_path, image, prediction in zip(batch_files, batch_images, predictions):
+    read_size = get_read_size(batch_size, bucket_window)
+    bucket_batch_size = get_bucket_batch_size(batch_size, bucket_window)
+    for batch_files in iter_batches(image_files, read_size):
+        batch_images, cache_keys, cached_detections = zip(*[read_image(file, output_dir, cache) for file in batch_files])
+        predictions = detect_images(detector, batch_images, cached_detections, bucket_batch_size)
+
+        for image_path, image, prediction, cache_key, cached in zip(
+                batch_files, batch_images, predictions, cache_keys, cached_detections):
+            if prediction is None:
+                continue
             logger.info(f"Processing {image_path}...")
             # Save results
-            output_path = os.path.join(output_dir, os.path.basename(image_path))
-            annotated_image = draw_bounding_boxes(image, prediction)
-            cv2.imwrite(output_path, annotated_image)
-            if save_json:
-                all_detections.append({"image": image_path, "detections": prediction})
-    if save_json:
-        json_path = os.path.join(output_dir, "results.json")
-        save_to_json(all_detections, json_path)
-        logger.info(f"Results saved to {json_path}")
-
-
-def collect_image_files(input_paths):
-    """
-    This function gets a list of all *.jpg and *.png images in provided folders
-    """
-    valid_extensions = ('.jpg', '.jpeg', '.png')
-    image_files = []
-    for path in input_paths:
-        if os.path.isfile(path) and path.endswith(valid_extensions):
-            image_files.append(path)
-        elif os.path.isdir(path):
-            for root, _, files in os.walk(path):
-                image_files.extend([os.path.join(root, f) for f in files if f.endswith(valid_extensions)])
-        else:
-            logger.warning(f"Invalid path or unsupported file type: {path}")
-    return image_files
-
+            finish_image(image, prediction, get_output_path(image_path, output_dir), cache, cache_key, cached is not None)
+            for writer in result_writers:
+                writer.write(image_path, prediction)
 
 
 if __name__ == "__main__":
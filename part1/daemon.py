@@ -0,0 +1,91 @@
+import os
+import argparse
+import socketserver
+
+from batching import BatchingDetector
+from rcnn import RCNNDetector
+from remote import DEFAULT_SOCKET_PATH, decode_images, recv_message, send_message
+from settings import BACKENDS, DEFAULT_ARTIFACT_DIR
+from utils import setup_logger
+
+
+logger = setup_logger("part1_daemon")
+
+
+def main():
+    # Parse Arguments
+    parser = argparse.ArgumentParser(description="Part 1: resident R-CNN detector serving cli.py over a Unix socket")
+    parser.add_argument('--socket', default=DEFAULT_SOCKET_PATH, help="Path of the Unix socket")
+    parser.add_argument('--conf-thresh', '-c', type=float, default=0.5, help="Lowest confidence threshold served")
+    parser.add_argument('--device', '-d', choices=['cpu', 'cuda'], default='cpu', help="Device for PyTorch")
+    parser.add_argument('--classes', nargs='+', help="Only keep detections with these labels")
+    parser.add_argument('--min-size', type=int, default=800, help="Shorter image side used for inference")
+    parser.add_argument('--max-size', type=int, default=1333, help="Upper bound of the longer image side for inference")
+    parser.add_argument('--backend', choices=BACKENDS, default='eager', help="Inference backend of the detector")
+    parser.add_argument('--artifact-dir', default=DEFAULT_ARTIFACT_DIR, help="Folder caching converted models")
+    parser.add_argument('--max-batch', type=int, default=8, help="Most images run in one batch across clients")
+    parser.add_argument('--max-wait-ms', type=float, default=10, help="Time to wait for more requests to batch")
+    args = parser.parse_args()
+
+    detector = RCNNDetector(device=args.device, conf_thresh=args.conf_thresh, classes=args.classes,
+                            min_size=args.min_size, max_size=args.max_size,
+                            backend=args.backend, artifact_dir=args.artifact_dir)
+    batcher = BatchingDetector(detector, max_batch=args.max_batch, max_wait=args.max_wait_ms / 1000)
+    batcher.start()
+
+    if os.path.exists(args.socket):
+        os.remove(args.socket)
+    server = DetectorServer(args.socket, batcher)
+    logger.info(f"Detector daemon listening on {args.socket}")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+    finally:
+        server.server_close()
+        os.remove(args.socket)
+
+
+class DetectorRequestHandler(socketserver.BaseRequestHandler):
+    """
+    Serve config and predict requests of one client connection
+    """
+
+    def handle(self):
+        batcher = self.server.batcher
+        while True:
+            header, payload = recv_message(self.request)
+            if header is None:
+                return
+            if header["op"] == "config":
+                send_message(self.request, {"config": batcher.detector.config()})
+                continue
+            try:
+                images = decode_images(header["images"], payload)
+                predictions = batcher.submit(images).result()
+                predictions = [filter_detections(prediction, header["conf_thresh"], header["classes"])
+                               for prediction in predictions]
+                send_message(self.request, {"predictions": predictions})
+            except Exception as e:
+                logger.error(f"Prediction failed: {str(e)}", exc_info=True)
+                send_message(self.request, {"error": str(e)})
+
+
+def filter_detections(detections, conf_thresh, classes):
+    """
+    Apply the stricter threshold and class list of a client to the daemon's detections
+    """
+    return [detection for detection in detections
+            if detection["score"] >= conf_thresh and (classes is None or detection["label"] in classes)]
+
+
+class DetectorServer(socketserver.ThreadingMixIn, socketserver.UnixStreamServer):
+    daemon_threads = True
+
+    def __init__(self, socket_path, batcher):
+        super().__init__(socket_path, DetectorRequestHandler)
+        self.batcher = batcher
+
+
+if __name__ == "__main__":
+    main()
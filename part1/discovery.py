@@ -0,0 +1,126 @@
+import os
+import sys
+import queue
+import logging
+import threading
+
+
+logger = logging.getLogger("part1")
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png')
+
+
+def is_image_file(name):
+    """
+    Check the extension of a file name, ignoring case
+    """
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def iter_image_files(input_paths, num_threads=0):
+    """
+    Lazily yield image files from input files and folders.
+    Folders are searched recursively with os.scandir and files are yielded as soon as
+    they are found, so processing can start before the whole tree has been listed.
+    With num_threads > 0, folders are listed by that many threads in parallel, which
+    helps on network file systems; files are then yielded in no particular order.
+    """
+    for path in input_paths:
+        if os.path.isfile(path) and is_image_file(path):
+            yield path
+        elif os.path.isdir(path):
+            if num_threads > 0:
+                yield from _walk_parallel(path, num_threads)
+            else:
+                yield from _walk(path)
+        else:
+            logger.warning(f"Invalid path or unsupported file type: {path}")
+
+
+def iter_manifest(manifest):
+    """
+    Yield image paths listed one per line in a manifest file, or stdin for "-".
+    Blank lines and lines starting with # are skipped, and so are missing files, with a warning.
+    """
+    f = sys.stdin if manifest == "-" else open(manifest)
+    try:
+        for line in f:
+            path = line.strip()
+            if not path or path.startswith("#"):
+                continue
+            if os.path.isfile(path):
+                yield path
+            else:
+                logger.warning(f"Skipping missing manifest entry: {path}")
+    finally:
+        if f is not sys.stdin:
+            f.close()
+
+
+def _walk(directory):
+    """
+    Depth-first walk yielding the images of a folder before descending, like os.walk
+    """
+    subdirectories = []
+    for entry in _scandir(directory):
+        if entry.is_dir(follow_symlinks=False):
+            subdirectories.append(entry.path)
+        elif is_image_file(entry.name) and entry.is_file():
+            yield entry.path
+    for subdirectory in subdirectories:
+        yield from _walk(subdirectory)
+
+
+def _walk_parallel(directory, num_threads):
+    """
+    Walk a folder tree with several threads listing folders concurrently
+    """
+    directories = queue.Queue()
+    found = queue.Queue(maxsize=10000)
+    pending = [1]  # Folders queued or being listed
+    lock = threading.Lock()
+    done = object()
+
+    def work():
+        while True:
+            current = directories.get()
+            if current is done:
+                return
+            for entry in _scandir(current):
+                if entry.is_dir(follow_symlinks=False):
+                    with lock:
+                        pending[0] += 1
+                    directories.put(entry.path)
+                elif is_image_file(entry.name) and entry.is_file():
+                    found.put(entry.path)
+            with lock:
+                pending[0] -= 1
+                finished = pending[0] == 0
+            if finished:
+                found.put(done)
+
+    directories.put(directory)
+    threads = [threading.Thread(target=work, daemon=True) for _ in range(num_threads)]
+    for thread in threads:
+        thread.start()
+    try:
+        while True:
+            path = found.get()
+            if path is done:
+                return
+            yield path
+    finally:
+        for _ in threads:
+            directories.put(done)
+
+
+def _scandir(directory):
+    """
+    List a folder, logging instead of failing on unreadable folders
+    """
+    try:
+        with os.scandir(directory) as entries:
+            return list(entries)
+    except OSError as e:
+        logger.warning(f"Cannot list {directory}: {e}")
+        return []
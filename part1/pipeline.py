@@ -0,0 +1,192 @@
+import os
+import cv2
+import logging
+import numpy as np
+from itertools import islice
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+
+from visualize import draw_bounding_boxes
+
+
+logger = logging.getLogger("part1")
+
+
+def get_output_path(image_path, output_dir):
+    """
+    Build the path of the annotated copy of an image
+    """
+    return os.path.join(output_dir, os.path.basename(image_path))
+
+
+def read_image(image_path, output_dir, cache=None):
+    """
+    Decode an image and look up its cached detections.
+    Returns (image, cache_key, detections). Detections are None unless cached, and
+    image is None when the cached image already has its annotated output on disk.
+    Both are None when the file cannot be read or decoded, which is logged and skipped.
+    """
+    if cache is None:
+        image = cv2.imread(image_path)
+        if image is None:
+            logger.warning(f"Skipping {image_path}: cannot read or decode the image")
+        return image, None, None
+
+    try:
+        with open(image_path, 'rb') as f:
+            data = f.read()
+    except OSError as e:
+        logger.warning(f"Skipping {image_path}: {e}")
+        return None, None, None
+    key = cache.key(data)
+    detections = cache.get(key)
+    if detections is not None and os.path.exists(get_output_path(image_path, output_dir)):
+        return None, key, detections
+    image = cv2.imdecode(np.frombuffer(data, np.uint8), cv2.IMREAD_COLOR)
+    if image is None:
+        logger.warning(f"Skipping {image_path}: cannot decode the image")
+        return None, None, None
+    return image, key, detections
+
+
+def detect_images(detector, images, cached_detections, bucket_batch_size=None):
+    """
+    Run the detector only on images without cached detections.
+    With bucket_batch_size, the images are regrouped into batches of that size with
+    similar aspect ratios. The model resizes every image by its shorter side, so images
+    with the same aspect ratio end up the same size and the batch needs little padding.
+    Predictions are returned in the order of images, None for images that could not be read.
+    """
+    predictions = list(cached_detections)
+    missing = [i for i, detections in enumerate(cached_detections) if detections is None and images[i] is not None]
+    if bucket_batch_size:
+        missing.sort(key=lambda i: images[i].shape[1] / images[i].shape[0])
+        batches = [missing[i:i+bucket_batch_size] for i in range(0, len(missing), bucket_batch_size)]
+    else:
+        batches = [missing] if missing else []
+    for batch in batches:
+        for i, prediction in zip(batch, detector.predict([images[i] for i in batch])):
+            predictions[i] = prediction
+    return predictions
+
+
+def iter_batches(image_files, size):
+    """
+    Split an iterable of image files into lists of at most size files, consuming it lazily
+    """
+    image_files = iter(image_files)
+    while True:
+        batch = list(islice(image_files, size))
+        if not batch:
+            return
+        yield batch
+
+
+def get_read_size(batch_size, bucket_window):
+    """
+    Number of images read at once, bucket_window batches when regrouping by shape
+    """
+    return batch_size * bucket_window if bucket_window > 1 else batch_size
+
+
+def get_bucket_batch_size(batch_size, bucket_window):
+    return batch_size if bucket_window > 1 else None
+
+
+def finish_image(image, prediction, output_path, cache=None, cache_key=None, cached=False):
+    """
+    Write the annotated image, then record its detections in the cache.
+    The cache entry is only stored once the output exists, so an interrupted job
+    redoes any image whose output might be incomplete.
+    """
+    if image is not None:
+        save_annotated_image(image, prediction, output_path)
+    if cache is not None and not cached:
+        cache.put(cache_key, prediction)
+
+
+def save_annotated_image(image, prediction, output_path):
+    """
+    Draw detections on an image and write it to disk
+    """
+    annotated_image = draw_bounding_boxes(image, prediction)
+    cv2.imwrite(output_path, annotated_image)
+
+
+def process_images_pipelined(image_files, output_dir, detector, result_writers, batch_size,
+                             queue_depth=2, num_readers=2, num_writers=2, cache=None, bucket_window=1):
+    """
+    Process a list of images with decoding, inference and writing overlapped.
+    Reader threads decode the next batches while the model runs on the current one,
+    and writer threads annotate and encode finished images. Both sides are bounded
+    by queue_depth so memory use does not grow with the job size.
+    Args:
+        image_files (Iterable[str]): Image file paths, consumed lazily.
+        output_dir (str): Directory to save outputs.
+        detector (RCNNDetector): Initialized R-CNN detector.
+        result_writers (list): Writers receiving the detections of each image in order.
+        batch_size (int): Batch size for processing images.
+        queue_depth (int): Number of batches decoded ahead of the model.
+        num_readers (int): Number of threads decoding images.
+        num_writers (int): Number of threads annotating and writing images.
+        cache (DetectionCache, optional): Cache of detection results.
+        bucket_window (int): Number of batches regrouped by image shape before inference.
+    """
+    read_size = get_read_size(batch_size, bucket_window)
+    bucket_batch_size = get_bucket_batch_size(batch_size, bucket_window)
+    batches = iter_batches(image_files, read_size)
+    max_pending_writes = max(1, queue_depth) * read_size
+
+    with ThreadPoolExecutor(num_readers, thread_name_prefix="reader") as readers, \
+            ThreadPoolExecutor(num_writers, thread_name_prefix="writer") as writers:
+        pending_reads = deque()
+        pending_writes = deque()
+        writes_by_path = {}
+
+        def prefetch():
+            batch_files = next(batches, None)
+            if batch_files is not None:
+                futures = [readers.submit(read_image, file, output_dir, cache) for file in batch_files]
+                pending_reads.append((batch_files, futures))
+
+        for _ in range(max(1, queue_depth)):
+            prefetch()
+
+        while pending_reads:
+            batch_files, futures = pending_reads.popleft()
+            prefetch()
+            batch_images, cache_keys, cached_detections = zip(*[future.result() for future in futures])
+            predictions = detect_images(detector, batch_images, cached_detections, bucket_batch_size)
+
+            for image_path, image, prediction, cache_key, cached in zip(
+                    batch_files, batch_images, predictions, cache_keys, cached_detections):
+                if prediction is None:
+                    continue
+                logger.info(f"Processing {image_path}...")
+                output_path = get_output_path(image_path, output_dir)
+                # Inputs sharing a basename must still be written in order, the last one wins
+                previous = writes_by_path.get(output_path)
+                if previous is not None:
+                    previous.result()
+                future = writers.submit(finish_image, image, prediction, output_path,
+                                        cache, cache_key, cached is not None)
+                writes_by_path[output_path] = future
+                pending_writes.append((output_path, future))
+                for writer in result_writers:
+                    writer.write(image_path, prediction)
+
+            while len(pending_writes) > max_pending_writes:
+                _wait_for_write(pending_writes, writes_by_path)
+
+        while pending_writes:
+            _wait_for_write(pending_writes, writes_by_path)
+
+
+def _wait_for_write(pending_writes, writes_by_path):
+    """
+    Block on the oldest pending write and forget it once done
+    """
+    output_path, future = pending_writes.popleft()
+    future.result()
+    if writes_by_path.get(output_path) is future:
+        del writes_by_path[output_path]
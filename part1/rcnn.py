@@ -1,20 +1,113 @@
+import os
 import cv2
+import json
+import hashlib
+import numpy as np
 import torch
+import torchvision
 from torchvision.models.detection import fasterrcnn_resnet50_fpn
 from torchvision.transforms import functional as F
-from utils import get_label_from_id
+from settings import BACKENDS, DEFAULT_ARTIFACT_DIR, get_label_from_id
+
+
+# Number of COCO category ids predicted by the model
+NUM_CLASSES = 91
 
 
 class RCNNDetector:
-    def __init__(self, device='cpu', conf_thresh=0.5):
+    def __init__(self, device='cpu', conf_thresh=0.5, classes=None, min_size=800, max_size=1333,
+                 backend='eager', artifact_dir=DEFAULT_ARTIFACT_DIR, pretrained=True):
         """
         Initialize the Faster R-CNN
+        Args:
+            device (str): Device for PyTorch.
+            conf_thresh (float): Minimum score of a kept detection.
+            classes (list[str], optional): Only keep detections with these labels.
+            min_size (int): Length the shorter image side is resized to before inference.
+            max_size (int): Upper bound of the longer image side after resizing.
+            backend (str): One of BACKENDS:
+                'eager' runs the plain PyTorch model,
+                'script' runs a TorchScript graph,
+                'compile' runs the model through torch.compile,
+                'quantized' runs a TorchScript graph with int8 dynamically quantized linear layers (CPU only).
+            artifact_dir (str): Folder caching converted models between runs.
+            pretrained (bool): Load COCO weights, or keep random weights for offline benchmarks.
         """
+        if backend not in BACKENDS:
+            raise ValueError(f"Unknown backend {backend}, expected one of {BACKENDS}")
         self.device = torch.device(device)
+        if backend == 'quantized' and self.device.type != 'cpu':
+            raise ValueError("The quantized backend only runs on CPU")
         self.conf_thresh = conf_thresh
-        self.model = fasterrcnn_resnet50_fpn(pretrained=True)
-        self.model.to(self.device)
-        self.model.eval()
+        self.min_size = min_size
+        self.max_size = max_size
+        self.backend = backend
+        self.artifact_dir = artifact_dir
+        self.pretrained = pretrained
+        self.model = self.load_model()
+
+        # Label names and the class allow-list are looked up by label id in one shot
+        self.label_names = np.array([get_label_from_id(i) for i in range(NUM_CLASSES)], dtype=object)
+        self.classes = list(classes) if classes is not None else None
+        self.allowed_labels = None
+        if self.classes is not None:
+            unknown = set(self.classes) - set(self.label_names)
+            if unknown:
+                raise ValueError(f"Unknown classes: {sorted(unknown)}")
+            allowed = np.isin(self.label_names, self.classes)
+            self.allowed_labels = torch.from_numpy(allowed).to(self.device)
+
+    def config(self):
+        """
+        Describe the settings that affect detection results
+        """
+        return {"model": "fasterrcnn_resnet50_fpn", "conf_thresh": self.conf_thresh, "classes": self.classes,
+                "min_size": self.min_size, "max_size": self.max_size, "backend": self.backend,
+                "pretrained": self.pretrained}
+
+    def build_eager_model(self):
+        """
+        Build the pre-trained eager mode model
+        """
+        # The model scales boxes back to the original image size after inference
+        model = fasterrcnn_resnet50_fpn(pretrained=self.pretrained, pretrained_backbone=self.pretrained,
+                                        min_size=self.min_size, max_size=self.max_size)
+        return model.eval()
+
+    def load_model(self):
+        """
+        Load the model for the selected backend.
+        Scripted and quantized graphs are converted once and then loaded from artifact_dir.
+        """
+        if self.backend == 'eager':
+            return self.build_eager_model().to(self.device)
+        if self.backend == 'compile':
+            # Inductor keeps its compiled kernels on disk, next to the other artifacts
+            os.environ.setdefault("TORCHINDUCTOR_CACHE_DIR", os.path.join(self.artifact_dir, "inductor"))
+            return torch.compile(self.build_eager_model().to(self.device))
+
+        artifact_path = self.artifact_path()
+        if os.path.exists(artifact_path):
+            return torch.jit.load(artifact_path, map_location=self.device).eval()
+
+        model = self.build_eager_model()
+        if self.backend == 'quantized':
+            model = torch.ao.quantization.quantize_dynamic(model, {torch.nn.Linear}, dtype=torch.qint8)
+        scripted = torch.jit.script(model)
+        os.makedirs(self.artifact_dir, exist_ok=True)
+        tmp_path = f"{artifact_path}.{os.getpid()}.tmp"
+        torch.jit.save(scripted, tmp_path)
+        os.replace(tmp_path, artifact_path)  # Concurrent workers never load a partial file
+        return scripted.to(self.device)
+
+    def artifact_path(self):
+        """
+        Path of the converted model, specific to the backend, input size and library versions
+        """
+        key = json.dumps([self.backend, self.min_size, self.max_size, self.pretrained,
+                          torch.__version__, torchvision.__version__])
+        digest = hashlib.sha256(key.encode()).hexdigest()[:16]
+        return os.path.join(self.artifact_dir, f"fasterrcnn_resnet50_fpn-{self.backend}-{digest}.pt")
 
     def preprocess(self, image):
         """
@@ -23,25 +116,59 @@ class RCNNDetector:
         image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)  # Convert to RGB
         return F.to_tensor(image).to(self.device)
 
-    def postprocess(self, outputs):
+    def postprocess(self, outputs, raw=False):
         """
-        Filter predictions by confidence
+        Filter predictions of a whole batch by confidence and class.
+        Filtering runs on the device and the kept detections are copied to the host once.
+        Returns per image either a list of detection dicts or, with raw=True, a dict of
+        "boxes" (N, 4), "scores" (N,) and "labels" (N,) label id arrays.
         """
+        if not outputs:
+            return []
+        sizes = torch.tensor([len(output['scores']) for output in outputs], device=self.device)
+        boxes = torch.cat([output['boxes'] for output in outputs])
+        scores = torch.cat([output['scores'] for output in outputs])
+        labels = torch.cat([output['labels'] for output in outputs])
+        image_ids = torch.repeat_interleave(torch.arange(len(outputs), device=self.device), sizes)
+
+        keep = scores >= self.conf_thresh
+        if self.allowed_labels is not None:
+            keep &= self.allowed_labels[labels]
+        packed = torch.cat([
+            boxes[keep],
+            scores[keep, None],
+            labels[keep, None].to(scores.dtype),
+            image_ids[keep, None].to(scores.dtype),
+        ], dim=1).cpu().numpy()
+
+        counts = np.bincount(packed[:, 6].astype(np.int64), minlength=len(outputs))
         results = []
-        for box, score, label in zip(outputs['boxes'], outputs['scores'], outputs['labels']):
-            if score >= self.conf_thresh:
-                results.append({
-                    "bbox": box.cpu().numpy().tolist(),
-                    "score": float(score.cpu().numpy()),
-                    "label": get_label_from_id(int(label.cpu().numpy()))
-                })
+        for chunk in np.split(packed, np.cumsum(counts)[:-1]):
+            chunk_boxes, chunk_scores = chunk[:, :4], chunk[:, 4]
+            chunk_labels = chunk[:, 5].astype(np.int64)
+            if raw:
+                results.append({"boxes": chunk_boxes, "scores": chunk_scores, "labels": chunk_labels})
+                continue
+            results.append([
+                {"bbox": bbox, "score": score, "label": label}
+                for bbox, score, label in zip(chunk_boxes.tolist(), chunk_scores.tolist(),
+                                              self.label_names[chunk_labels].tolist())
+            ])
         return results
 
-    def predict(self, images):
+    def forward(self, tensors):
         """
-        Predict bounding boxes for images
+        Run the model on preprocessed images
         """
-        tensors = [self.preprocess(image) for image in images]
         with torch.no_grad():
             outputs = self.model(tensors)
-        return [self.postprocess(output) for output in outputs]
+        if isinstance(outputs, tuple):  # TorchScript detection models return (losses, detections)
+            outputs = outputs[1]
+        return outputs
+
+    def predict(self, images, raw=False):
+        """
+        Predict bounding boxes for images
+        """
+        tensors = [self.preprocess(image) for image in images]
+        return self.postprocess(self.forward(tensors), raw=raw)
@@ -0,0 +1,164 @@
+import os
+import json
+import socket
+import struct
+import logging
+import threading
+import numpy as np
+
+
+logger = logging.getLogger("part1")
+
+DEFAULT_SOCKET_PATH = os.environ.get("PART1_DETECTOR_SOCKET", "/tmp/part1-detector.sock")
+
+# Settings that must be equal on the daemon for its detections to match an in-process detector
+MATCHING_CONFIG_KEYS = ["model", "min_size", "max_size", "backend", "pretrained"]
+
+_HEADER = struct.Struct("!II")  # JSON header length, binary payload length
+
+
+def send_message(sock, header, payload=b""):
+    """
+    Send a JSON header followed by a binary payload
+    """
+    data = json.dumps(header).encode()
+    sock.sendall(_HEADER.pack(len(data), len(payload)) + data)
+    if payload:
+        sock.sendall(payload)
+
+
+def recv_message(sock):
+    """
+    Receive a message sent by send_message, or (None, None) when the peer closed the connection.
+    Raises ConnectionError when the connection closes in the middle of a message.
+    """
+    prefix = _recv_exactly(sock, _HEADER.size)
+    if prefix is None:
+        return None, None
+    header_size, payload_size = _HEADER.unpack(prefix)
+    data = _recv_exactly(sock, header_size)
+    payload = _recv_exactly(sock, payload_size) if payload_size else b""
+    if data is None or payload is None:
+        raise ConnectionError("Connection closed in the middle of a message")
+    return json.loads(data), payload
+
+
+def _recv_exactly(sock, size):
+    """
+    Receive size bytes, or None when the connection closes before they all arrive
+    """
+    buffer = bytearray(size)
+    view = memoryview(buffer)
+    received = 0
+    while received < size:
+        count = sock.recv_into(view[received:])
+        if count == 0:
+            return None
+        received += count
+    return bytes(buffer)
+
+
+def encode_images(images):
+    """
+    Pack decoded images into a header describing them and one raw payload
+    """
+    arrays = [np.ascontiguousarray(image) for image in images]
+    descriptions = [{"shape": list(array.shape), "dtype": str(array.dtype)} for array in arrays]
+    return descriptions, b"".join(array.tobytes() for array in arrays)
+
+
+def decode_images(descriptions, payload):
+    """
+    Rebuild the images packed by encode_images
+    """
+    images, offset = [], 0
+    for description in descriptions:
+        dtype = np.dtype(description["dtype"])
+        count = int(np.prod(description["shape"]))
+        image = np.frombuffer(payload, dtype=dtype, count=count, offset=offset).reshape(description["shape"])
+        images.append(image)
+        offset += count * dtype.itemsize
+    return images
+
+
+class RemoteDetector:
+    """
+    Detector that forwards images to a running detector daemon over a Unix socket.
+    It mirrors the predict/config interface of RCNNDetector without importing torch.
+    """
+
+    def __init__(self, sock, daemon_config, conf_thresh, classes=None):
+        self.sock = sock
+        self.daemon_config = daemon_config
+        self.conf_thresh = conf_thresh
+        self.classes = list(classes) if classes is not None else None
+        self._lock = threading.Lock()
+
+    @classmethod
+    def connect(cls, socket_path, detector_kwargs, timeout=1.0):
+        """
+        Connect to the daemon if it runs with settings matching detector_kwargs.
+        Returns None when there is no daemon or it cannot serve these settings.
+        """
+        if not os.path.exists(socket_path):
+            return None
+        sock = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+        try:
+            sock.settimeout(timeout)
+            sock.connect(socket_path)
+            send_message(sock, {"op": "config"})
+            header, _ = recv_message(sock)
+            sock.settimeout(None)
+            if header is None:
+                raise ConnectionError("Connection closed during the handshake")
+        except OSError as e:
+            logger.warning(f"Detector daemon at {socket_path} is not reachable: {e}")
+            sock.close()
+            return None
+
+        daemon_config = header["config"]
+        reason = cls.incompatibility(daemon_config, detector_kwargs)
+        if reason:
+            logger.warning(f"Not using detector daemon at {socket_path}: {reason}")
+            sock.close()
+            return None
+        return cls(sock, daemon_config, detector_kwargs.get("conf_thresh", 0.5), detector_kwargs.get("classes"))
+
+    @staticmethod
+    def incompatibility(daemon_config, detector_kwargs):
+        """
+        Explain why the daemon cannot produce the detections asked for, or return None
+        """
+        for key in MATCHING_CONFIG_KEYS:
+            if key in detector_kwargs and detector_kwargs[key] != daemon_config.get(key):
+                return f"{key} is {daemon_config.get(key)}, expected {detector_kwargs[key]}"
+        if detector_kwargs.get("conf_thresh", 0.5) < daemon_config["conf_thresh"]:
+            return f"its confidence threshold {daemon_config['conf_thresh']} is higher than requested"
+        classes = detector_kwargs.get("classes")
+        if daemon_config["classes"] is not None and (classes is None or set(classes) - set(daemon_config["classes"])):
+            return f"it only detects {daemon_config['classes']}"
+        return None
+
+    def config(self):
+        """
+        Describe the settings that affect detection results, as RCNNDetector.config does
+        """
+        return {**self.daemon_config, "conf_thresh": self.conf_thresh, "classes": self.classes}
+
+    def predict(self, images):
+        """
+        Predict bounding boxes for images on the daemon
+        """
+        descriptions, payload = encode_images(images)
+        request = {"op": "predict", "images": descriptions, "conf_thresh": self.conf_thresh, "classes": self.classes}
+        with self._lock:
+            send_message(self.sock, request, payload)
+            header, _ = recv_message(self.sock)
+        if header is None:
+            raise ConnectionError("Detector daemon closed the connection")
+        if "error" in header:
+            raise RuntimeError(f"Detector daemon failed: {header['error']}")
+        return header["predictions"]
+
+    def close(self):
+        self.sock.close()
@@ -1,5 +1,8 @@
+import os
 import json
 import logging
+import numpy as np
+
 
 def setup_logger(name, level=logging.INFO):
     """Set up a logger with a given name and level."""
@@ -18,26 +21,123 @@ def save_to_json(data, filepath):
         json.dump(data, f, indent=4)
 
 
-def get_label_from_id(category_id):
-    """
-    Convert a category number to its corresponding label.
-    """
-    category_names = {
-        0: "bicycle", 1: "person", 2: "car", 3: "motorcycle", 4: "airplane", 5: "bus",
-        6: "truck", 7: "train", 8: "boat", 9: "traffic light", 10: "fire hydrant",
-        11: "stop sign", 12: "parking meter", 13: "bench", 14: "bird", 15: "cat",
-        16: "dog", 17: "horse", 18: "sheep", 19: "cow", 20: "elephant", 21: "bear",
-        22: "zebra", 23: "giraffe", 24: "backpack", 25: "umbrella", 26: "handbag",
-        27: "tie", 28: "suitcase", 29: "frisbee", 30: "skis", 31: "snowboard",
-        32: "sports ball", 33: "kite", 34: "baseball bat", 35: "baseball glove",
-        36: "skateboard", 37: "surfboard", 38: "tennis racket", 39: "bottle",
-        40: "wine glass", 41: "cup", 42: "sandwich", 43: "knife", 44: "spoon", 45: "bowl",
-        46: "banana", 47: "apple", 48: "fork", 49: "orange", 50: "broccoli",
-        51: "carrot", 52: "hot dog", 53: "pizza", 54: "donut", 55: "cake", 56: "chair",
-        57: "couch", 58: "potted plant", 59: "bed", 60: "dining table", 61: "toilet",
-        62: "tv", 63: "laptop", 64: "mouse", 65: "remote", 66: "keyboard",
-        67: "cell phone", 68: "microwave", 69: "oven", 70: "toaster", 71: "sink",
-        72: "refrigerator", 73: "book", 74: "clock", 75: "vase", 76: "scissors",
-        77: "teddy bear", 78: "hair drier", 79: "toothbrush"
+class JsonResultWriter:
+    """
+    Collect detections of all images and save them to one JSON file on close.
+    """
+    def __init__(self, filepath):
+        self.filepath = filepath
+        self.records = []
+
+    def write(self, image_path, detections):
+        self.records.append({"image": image_path, "detections": detections})
+
+    def close(self):
+        save_to_json(self.records, self.filepath)
+
+
+class JsonlResultWriter:
+    """
+    Append one compact JSON record per image to a JSON Lines file.
+    Records are flushed every flush_every images, so an interrupted job keeps its finished images.
+    """
+    def __init__(self, filepath, flush_every=100):
+        self.filepath = filepath
+        self.flush_every = flush_every
+        self.file = open(filepath, 'w')
+        self.pending = 0
+
+    def write(self, image_path, detections):
+        record = {"image": image_path, "detections": detections}
+        self.file.write(json.dumps(record, separators=(',', ':')) + "\n")
+        self.pending += 1
+        if self.pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        self.file.flush()
+        self.pending = 0
+
+    def close(self):
+        self.file.close()
+
+
+class ColumnarResultWriter:
+    """
+    Append detections as flat binary columns for analytics over many detections.
+    The directory holds boxes.f32 (N x 4), scores.f32, labels.u16 and image_ids.u32,
+    plus images.txt and labels.json mapping the ids back to paths and label names.
+    Columns are little-endian and can be read back with load_columnar_results.
+    """
+    def __init__(self, dirpath, flush_every=100):
+        self.filepath = dirpath
+        self.flush_every = flush_every
+        os.makedirs(dirpath, exist_ok=True)
+        self.files = {name: open(os.path.join(dirpath, name), 'wb') for name in COLUMN_DTYPES}
+        self.images = open(os.path.join(dirpath, "images.txt"), 'w')
+        self.label_ids = {}
+        self.image_count = 0
+        self.pending = 0
+
+    def write(self, image_path, detections):
+        for detection in detections:
+            if detection["label"] not in self.label_ids:
+                self.label_ids[detection["label"]] = len(self.label_ids)
+        columns = {
+            "boxes.f32": [detection["bbox"] for detection in detections],
+            "scores.f32": [detection["score"] for detection in detections],
+            "labels.u16": [self.label_ids[detection["label"]] for detection in detections],
+            "image_ids.u32": [self.image_count] * len(detections),
+        }
+        for name, values in columns.items():
+            self.files[name].write(np.asarray(values, dtype=COLUMN_DTYPES[name]).tobytes())
+        self.images.write(image_path + "\n")
+        self.image_count += 1
+        self.pending += 1
+        if self.pending >= self.flush_every:
+            self.flush()
+
+    def flush(self):
+        for f in self.files.values():
+            f.flush()
+        self.images.flush()
+        with open(os.path.join(self.filepath, "labels.json"), 'w') as f:
+            json.dump(list(self.label_ids), f)
+        self.pending = 0
+
+    def close(self):
+        self.flush()
+        for f in self.files.values():
+            f.close()
+        self.images.close()
+
+
+COLUMN_DTYPES = {
+    "boxes.f32": np.dtype('<f4'),
+    "scores.f32": np.dtype('<f4'),
+    "labels.u16": np.dtype('<u2'),
+    "image_ids.u32": np.dtype('<u4'),
+}
+
+
+def load_columnar_results(dirpath):
+    """
+    Load detections written by ColumnarResultWriter as numpy arrays.
+    A trailing partially written detection is dropped.
+    """
+    columns = {name: np.fromfile(os.path.join(dirpath, name), dtype=dtype) for name, dtype in COLUMN_DTYPES.items()}
+    count = min(len(columns["boxes.f32"]) // 4, len(columns["scores.f32"]),
+                len(columns["labels.u16"]), len(columns["image_ids.u32"]))
+    with open(os.path.join(dirpath, "labels.json")) as f:
+        label_names = json.load(f)
+    with open(os.path.join(dirpath, "images.txt")) as f:
+        images = f.read().splitlines()
+    return {
+        "boxes": columns["boxes.f32"][:count * 4].reshape(-1, 4),
+        "scores": columns["scores.f32"][:count],
+        "labels": columns["labels.u16"][:count],
+        "image_ids": columns["image_ids.u32"][:count],
+        "label_names": label_names,
+        "images": images,
     }
-    return category_names.get(category_id, "unknown")
\ No newline at end of file
+
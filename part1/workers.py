@@ -0,0 +1,112 @@
+import os
+import logging
+import multiprocessing
+from collections import deque
+
+from cache import DetectionCache, format_cache_summary
+from pipeline import (detect_images, finish_image, get_bucket_batch_size, get_output_path, get_read_size,
+                      iter_batches, read_image)
+
+
+logger = logging.getLogger("part1")
+
+# Per-process state of a worker, set up once by _init_worker
+_worker = {}
+
+
+def default_threads_per_worker(num_workers):
+    """
+    Split the CPU cores evenly between worker processes
+    """
+    return max(1, (os.cpu_count() or 1) // num_workers)
+
+
+def process_images_parallel(image_files, output_dir, detector_kwargs, result_writers, batch_size,
+                            num_workers, threads_per_worker=None, cache_dir=None, cache_size=None, bucket_window=1):
+    """
+    Process a list of images with several worker processes, each with its own detector.
+    Batches are handed out to whichever worker is free, while results are collected in
+    input order, so result writers see the same sequence as in the single-process mode.
+    Args:
+        image_files (Iterable[str]): Image file paths, consumed lazily.
+        output_dir (str): Directory to save outputs.
+        detector_kwargs (dict): Arguments for RCNNDetector in every worker.
+        result_writers (list): Writers receiving the detections of each image in order.
+        batch_size (int): Batch size for processing images.
+        num_workers (int): Number of worker processes.
+        threads_per_worker (int, optional): Torch threads of every worker, cores / workers by default.
+        cache_dir (str, optional): Folder of the detection cache shared by the workers.
+        cache_size (int, optional): Size limit of the detection cache in bytes.
+        bucket_window (int): Number of batches regrouped by image shape before inference.
+    """
+    threads_per_worker = threads_per_worker or default_threads_per_worker(num_workers)
+    logger.info(f"Starting {num_workers} worker process(es) with {threads_per_worker} thread(s) each.")
+
+    read_size = get_read_size(batch_size, bucket_window)
+    batches = iter_batches(image_files, read_size)
+    max_in_flight = 2 * num_workers
+    hits = misses = 0
+
+    # Spawn, as forking a process that already initialized torch threads can deadlock
+    context = multiprocessing.get_context("spawn")
+    initargs = (detector_kwargs, output_dir, cache_dir, cache_size, threads_per_worker)
+    with context.Pool(num_workers, initializer=_init_worker, initargs=initargs) as pool:
+        in_flight = deque()
+        for batch_files in batches:
+            task = pool.apply_async(_process_batch, (batch_files, get_bucket_batch_size(batch_size, bucket_window)))
+            in_flight.append((batch_files, task))
+            while len(in_flight) >= max_in_flight:
+                hits, misses = _collect_batch(in_flight, result_writers, hits, misses)
+        while in_flight:
+            hits, misses = _collect_batch(in_flight, result_writers, hits, misses)
+
+    if cache_dir:
+        logger.info(format_cache_summary(hits, misses))
+
+
+def _collect_batch(in_flight, result_writers, hits, misses):
+    """
+    Wait for the oldest batch and pass its detections to the result writers
+    """
+    batch_files, result = in_flight.popleft()
+    predictions, batch_hits, batch_misses = result.get()
+    for image_path, prediction in zip(batch_files, predictions):
+        if prediction is None:
+            continue
+        logger.info(f"Processing {image_path}...")
+        for writer in result_writers:
+            writer.write(image_path, prediction)
+    return hits + batch_hits, misses + batch_misses
+
+
+def _init_worker(detector_kwargs, output_dir, cache_dir, cache_size, num_threads):
+    """
+    Load the detector and cache of a worker process
+    """
+    import torch
+    from rcnn import RCNNDetector
+
+    torch.set_num_threads(num_threads)
+    detector = RCNNDetector(**detector_kwargs)
+    _worker["detector"] = detector
+    _worker["output_dir"] = output_dir
+    _worker["cache"] = DetectionCache(cache_dir, detector.config(), max_bytes=cache_size) if cache_dir else None
+
+
+def _process_batch(batch_files, bucket_batch_size=None):
+    """
+    Detect, annotate and write one batch inside a worker process.
+    Returns the predictions, None for unreadable images, with the cache hits and misses of the batch.
+    """
+    detector, output_dir, cache = _worker["detector"], _worker["output_dir"], _worker["cache"]
+    batch_images, cache_keys, cached_detections = zip(*[read_image(file, output_dir, cache) for file in batch_files])
+    predictions = detect_images(detector, batch_images, cached_detections, bucket_batch_size)
+    for image_path, image, prediction, cache_key, cached in zip(
+            batch_files, batch_images, predictions, cache_keys, cached_detections):
+        if prediction is None:
+            continue
+        finish_image(image, prediction, get_output_path(image_path, output_dir), cache, cache_key, cached is not None)
+
+    hits = sum(cached is not None for cached in cached_detections) if cache else 0
+    misses = sum(prediction is not None for prediction in predictions) - hits if cache else 0
+    return predictions, hits, misses
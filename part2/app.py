@@ -1,5 +1,10 @@
 from flask import Flask
 from routes import products_bp
+from bulk import bulk_bp
+from detection import DEFAULT_DETECTION_CONFIG, detection_bp
+from store import DEFAULT_STORE_CONFIG, create_product_store
+from responses import DEFAULT_CACHE_CONFIG, ResponseCache
+from metrics import DEFAULT_METRICS_CONFIG, init_metrics
 
 
 def register_blueprints(app: Flask):
@@ -7,14 +12,25 @@ def register_blueprints(app: Flask):
     Register all blueprints to Flask
     """
     app.register_blueprint(products_bp, url_prefix="/products")
+    app.register_blueprint(bulk_bp, url_prefix="/products")
+    app.register_blueprint(detection_bp, url_prefix="/detections")
 
 
-def create_app():
+def create_app(config=None):
     """
     Initialize Flask application
     """
     app = Flask(__name__)
+    app.config.update(DEFAULT_DETECTION_CONFIG)
+    app.config.update(DEFAULT_STORE_CONFIG)
+    app.config.update(DEFAULT_CACHE_CONFIG)
+    app.config.update(DEFAULT_METRICS_CONFIG)
+    if config:
+        app.config.update(config)
+    app.extensions["product_store"] = create_product_store(app.config)
+    app.extensions["response_cache"] = ResponseCache(app.config["RESPONSE_CACHE_SIZE"])
     register_blueprints(app)
+    init_metrics(app)
     return app
 
 if __name__ == "__main__":
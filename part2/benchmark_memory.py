@@ -0,0 +1,94 @@
+import gc
+import json
+import time
+import uuid
+import random
+import argparse
+import platform
+import tracemalloc
+from itertools import islice
+
+from models import CATEGORIES
+from store import MemoryProductStore
+from utils import setup_logger
+
+
+logger = setup_logger("part2_benchmark")
+
+LAYOUTS = ["dict", "store", "store-search"]
+
+
+def main():
+    # Parse Arguments
+    parser = argparse.ArgumentParser(description="Part 2: memory used per product by the in-memory storage layouts")
+    parser.add_argument('--items', type=int, default=1000000, help="Products to store")
+    parser.add_argument('--layouts', nargs='+', choices=LAYOUTS, default=LAYOUTS,
+                        help="'dict' is the original dict of model_dump() dicts, 'store' the MemoryProductStore with its "
+                             "indexes, 'store-search' the same with the full-text search index")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic products")
+    parser.add_argument('--output', '-o', default="benchmark_memory.json", help="JSON file for the results")
+    args = parser.parse_args()
+
+    results = []
+    for layout in args.layouts:
+        result = measure_layout(layout, args.items, args.seed)
+        logger.info(f"{layout}: {result['bytes_per_product']:.0f} bytes/product, "
+                    f"{result['total_bytes'] / 2 ** 20:.0f} MiB for {args.items} products, built in {result['seconds']:.1f}s")
+        results.append(result)
+
+    report = {"environment": {"python": platform.python_version(), "platform": platform.platform()}, "results": results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=4)
+    logger.info(f"Benchmark results saved to {args.output}")
+
+
+def make_products(count, seed=0):
+    """
+    Yield synthetic products shaped like Product.model_dump()
+    """
+    rng = random.Random(seed)
+    for i in range(count):
+        yield {
+            "id": uuid.UUID(int=rng.getrandbits(128), version=4),
+            "name": f"Product {i:07d}",
+            "description": f"Synthetic product number {i}",
+            "price": round(rng.uniform(1, 1000), 2),
+            "quantity": rng.randint(1, 10),
+            "category": rng.choice(CATEGORIES),
+        }
+
+
+def build_layout(layout, products):
+    """
+    Store products in a layout and return it
+    """
+    if layout == "dict":
+        return {str(product["id"]): product for product in products}
+    store = MemoryProductStore(search=layout == "store-search")
+    while True:
+        chunk = list(islice(products, 10000))
+        if not chunk:
+            return store
+        store.create_many(chunk)
+
+
+def measure_layout(layout, count, seed=0):
+    """
+    Measure the memory a layout keeps allocated for count products with tracemalloc
+    """
+    gc.collect()
+    tracemalloc.start()
+    start = time.perf_counter()
+    before = tracemalloc.get_traced_memory()[0]
+    stored = build_layout(layout, make_products(count, seed))
+    gc.collect()
+    total = tracemalloc.get_traced_memory()[0] - before
+    seconds = time.perf_counter() - start
+    tracemalloc.stop()
+    del stored
+    return {"layout": layout, "items": count, "total_bytes": total, "bytes_per_product": total / count,
+            "seconds": seconds}
+
+
+if __name__ == "__main__":
+    main()
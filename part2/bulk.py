@@ -0,0 +1,248 @@
+import json
+import logging
+from uuid import UUID
+from collections import Counter
+from itertools import islice
+
+from flask import Blueprint, Response, current_app, jsonify, request, stream_with_context
+from models import Product, ProductUpdate
+from pydantic import TypeAdapter, ValidationError
+from metrics import timed
+from routes import format_response
+from store import get_product_store
+
+# Initialize Blueprint
+bulk_bp = Blueprint("bulk", __name__)
+logger = logging.getLogger("part2_api")
+
+NDJSON_MIMETYPE = "application/x-ndjson"
+CHUNK_SIZE = 1000  # Items validated together and applied under one store lock acquisition
+
+_product_adapter = TypeAdapter(list[Product])
+_update_adapter = TypeAdapter(list[ProductUpdate])
+
+
+def read_bulk_items():
+    """
+    Return an iterator over the items of a JSON array body, or of an NDJSON body read
+    line by line as it streams in. Returns an error message for other bodies.
+    """
+    if request.mimetype == NDJSON_MIMETYPE:
+        return _iter_ndjson(request.stream)
+    data = request.get_json(silent=True)
+    if not isinstance(data, list):
+        return f"Expected a JSON array, or an {NDJSON_MIMETYPE} body with one item per line"
+    return iter(data)
+
+
+def _iter_ndjson(stream):
+    for line in _iter_lines(stream):
+        if not line.strip():
+            continue
+        try:
+            yield json.loads(line)
+        except ValueError as e:
+            yield ValueError(f"Invalid JSON: {e}")
+
+
+def _iter_lines(stream, block_size=1 << 16):
+    # Iterating request streams directly reads them one byte at a time
+    rest = b""
+    while True:
+        block = stream.read(block_size)
+        if not block:
+            break
+        lines = (rest + block).split(b"\n")
+        rest = lines.pop()
+        yield from lines
+    if rest:
+        yield rest
+
+
+def validate_items(adapter, items):
+    """
+    Validate a chunk of items with one pydantic call.
+    Args:
+        adapter (TypeAdapter): Adapter of a list of models.
+        items (list): Decoded items, or ValueError for lines that were not JSON.
+    Returns:
+        tuple: (models by position of the valid items, error messages by position).
+    """
+    errors = {position: str(item) for position, item in enumerate(items) if isinstance(item, ValueError)}
+    candidates = [position for position in range(len(items)) if position not in errors]
+    try:
+        values = adapter.validate_python([items[position] for position in candidates])
+    except ValidationError as e:
+        messages = {}
+        for error in e.errors():
+            field = ".".join(str(part) for part in error["loc"][1:]) or "item"
+            messages.setdefault(candidates[error["loc"][0]], []).append(f"{field}: {error['msg']}")
+        errors.update((position, "; ".join(message)) for position, message in messages.items())
+        candidates = [position for position in candidates if position not in errors]
+        values = adapter.validate_python([items[position] for position in candidates])
+    return dict(zip(candidates, values)), errors
+
+
+def parse_product_id(item):
+    """
+    Return the product ID of a delete or update item, or None if it is missing or not a UUID
+    """
+    product_id = item.get("id") if isinstance(item, dict) else item
+    try:
+        return str(UUID(product_id))
+    except (TypeError, ValueError, AttributeError):
+        return None
+
+
+def create_chunk(store, items):
+    """
+    Create the valid products of a chunk, returns the status of each item
+    """
+    with timed("validation"):
+        valid, errors = validate_items(_product_adapter, items)
+    products = [product.model_dump() for product in valid.values()]
+    results = {position: {"id": None, "status": 400, "error": error} for position, error in errors.items()}
+    for position, product, created in zip(valid, products, store.create_many(products)):
+        results[position] = {"id": str(product["id"]), "status": 201 if created else 409,
+                             "error": None if created else "Product already exists"}
+    return [results[position] for position in range(len(items))]
+
+
+def update_chunk(store, items):
+    """
+    Apply the valid partial updates of a chunk, returns the status of each item
+    """
+    with timed("validation"):
+        valid, errors = validate_items(_update_adapter, items)
+    results = {position: {"id": parse_product_id(items[position]), "status": 400, "error": error}
+               for position, error in errors.items()}
+    updates = []
+    for position, update in valid.items():
+        product_id = parse_product_id(items[position])
+        if product_id is None:
+            results[position] = {"id": None, "status": 400, "error": "Invalid product ID format"}
+        else:
+            updates.append((position, product_id, update.model_dump(exclude_unset=True, exclude_none=True)))
+    updated = store.update_many([(product_id, fields) for _, product_id, fields in updates])
+    for (position, product_id, _), product in zip(updates, updated):
+        results[position] = {"id": product_id, "status": 200 if product else 404,
+                             "error": None if product else "Product not found"}
+    return [results[position] for position in range(len(items))]
+
+
+def delete_chunk(store, items):
+    """
+    Delete the products of a chunk, returns the status of each item
+    """
+    product_ids = [None if isinstance(item, ValueError) else parse_product_id(item) for item in items]
+    deleted = iter(store.delete_many([product_id for product_id in product_ids if product_id]))
+    results = []
+    for product_id in product_ids:
+        if product_id is None:
+            results.append({"id": None, "status": 400, "error": "Invalid product ID format"})
+        elif next(deleted):
+            results.append({"id": product_id, "status": 200, "error": None})
+        else:
+            results.append({"id": product_id, "status": 404, "error": "Product not found"})
+    return results
+
+
+def iter_results(apply_chunk, store, items):
+    """
+    Apply an operation chunk by chunk and yield the status of every item with its index
+    """
+    offset = 0
+    while True:
+        chunk = list(islice(items, CHUNK_SIZE))
+        if not chunk:
+            return
+        results = apply_chunk(store, chunk)
+        counts = Counter(result["status"] for result in results)
+        logger.info(f"Bulk {apply_chunk.__name__.split('_')[0]} of items {offset}-{offset + len(chunk) - 1}: {dict(counts)}")
+        for index, result in enumerate(results, offset):
+            yield {"index": index, **result}
+        offset += len(chunk)
+
+
+def run_bulk(apply_chunk, message):
+    """
+    Run a bulk operation on the request body. NDJSON requests get an NDJSON response
+    with one status line per item, JSON arrays get all statuses at once.
+    """
+    items = read_bulk_items()
+    if isinstance(items, str):
+        return jsonify(format_response(
+            message="Validation failed",
+            error=items
+        )), 400
+
+    results = iter_results(apply_chunk, get_product_store(), items)
+    if request.mimetype == NDJSON_MIMETYPE:
+        # The body is still applied chunk by chunk as it arrives, but the response only starts
+        # once all of it is read. Streaming it earlier would deadlock a client that sends its
+        # whole body before reading, as soon as both socket buffers are full.
+        body = "".join(json.dumps(result) + "\n" for result in results)
+        return Response(body, mimetype=NDJSON_MIMETYPE)
+
+    results = list(results)
+    return jsonify(format_response(
+        message=message,
+        data={"results": results, "counts": dict(Counter(str(result["status"]) for result in results))},
+        error=None
+    )), 200
+
+
+@bulk_bp.route("/bulk", methods=["POST"])
+def bulk_create_products():
+    """
+    Create many products
+    """
+    return run_bulk(create_chunk, "Bulk create processed")
+
+
+@bulk_bp.route("/bulk", methods=["PUT"])
+def bulk_update_products():
+    """
+    Partially update many products, each item carries its "id"
+    """
+    return run_bulk(update_chunk, "Bulk update processed")
+
+
+@bulk_bp.route("/bulk", methods=["DELETE"])
+def bulk_delete_products():
+    """
+    Delete many products, given as IDs or objects with an "id"
+    """
+    return run_bulk(delete_chunk, "Bulk delete processed")
+
+
+@bulk_bp.route("/export", methods=["GET"])
+def export_products():
+    """
+    Stream all products as NDJSON, reading the store one page at a time
+    """
+    store = get_product_store()
+    provider = current_app.json
+
+    def generate():
+        cursor = None
+        while True:
+            page, cursor = store.query(limit=CHUNK_SIZE, cursor=cursor)
+            for product in page:
+                yield provider.dumps(product) + "\n"
+            if cursor is None:
+                return
+
+    return Response(stream_with_context(generate()), mimetype=NDJSON_MIMETYPE)
+
+
+@bulk_bp.errorhandler(Exception)
+def handle_exception(e):
+    """
+    Handle exceptions and log them.
+    """
+    logger.error(f"Unhandled exception: {str(e)}", exc_info=True)
+    return jsonify(format_response(
+        message="An internal server error occurred",
+        error="Unknown server error"
+    )), 500
@@ -0,0 +1,136 @@
+import os
+import sys
+import logging
+import threading
+from concurrent.futures import TimeoutError
+
+import cv2
+import numpy as np
+from flask import Blueprint, current_app, jsonify, request
+from routes import format_response
+
+# The detector and its batcher are the ones of part1. Its folder goes last on the path,
+# so the modules of part2 win where names overlap.
+PART1_DIR = os.path.join(os.path.dirname(os.path.dirname(os.path.abspath(__file__))), "part1")
+if PART1_DIR not in sys.path:
+    sys.path.append(PART1_DIR)
+
+from batching import BatchingDetector, QueueFullError
+
+# Initialize Blueprint
+detection_bp = Blueprint("detection", __name__)
+logger = logging.getLogger("part2_api")
+
+DEFAULT_DETECTION_CONFIG = {
+    "DETECTION_DEVICE": "cpu",
+    "DETECTION_CONF_THRESH": 0.5,
+    "DETECTION_MAX_BATCH": 8,  # Most images run in one batched predict call
+    "DETECTION_MAX_WAIT_MS": 10,  # Time a request waits for others to join its batch
+    "DETECTION_QUEUE_SIZE": 64,  # Requests waiting for the detector before new ones get 503
+    "DETECTION_TIMEOUT": 30,  # Seconds a request waits for its detections before 504
+}
+
+
+_batcher_lock = threading.Lock()
+
+
+def get_batching_detector(app):
+    """
+    Return the app's shared detector, loading the model on first use
+    """
+    batcher = app.extensions.get("detector")
+    if batcher is None:
+        with _batcher_lock:
+            batcher = app.extensions.get("detector")
+            if batcher is None:
+                from rcnn import RCNNDetector
+
+                config = {**DEFAULT_DETECTION_CONFIG, **app.config}
+                detector = RCNNDetector(device=config["DETECTION_DEVICE"], conf_thresh=config["DETECTION_CONF_THRESH"])
+                batcher = BatchingDetector(detector, max_batch=config["DETECTION_MAX_BATCH"],
+                                           max_wait=config["DETECTION_MAX_WAIT_MS"] / 1000,
+                                           queue_size=config["DETECTION_QUEUE_SIZE"])
+                batcher.start()
+                app.extensions["detector"] = batcher
+    return batcher
+
+
+def read_uploaded_images():
+    """
+    Decode images from multipart "image" fields, or from a raw image body.
+    Returns (names, images), or an error message.
+    """
+    if request.files:
+        uploads = request.files.getlist("image")
+        names = [upload.filename for upload in uploads]
+        blobs = [upload.read() for upload in uploads]
+    else:
+        names = [None]
+        blobs = [request.get_data()]
+    if not blobs or not any(blobs):
+        return "No image uploaded, send multipart 'image' fields or an image body"
+
+    images = []
+    for name, blob in zip(names, blobs):
+        image = cv2.imdecode(np.frombuffer(blob, np.uint8), cv2.IMREAD_COLOR) if blob else None
+        if image is None:
+            return f"Could not decode image {name or ''}".strip()
+        images.append(image)
+    return names, images
+
+
+@detection_bp.route("/", methods=["POST"])
+def detect_objects():
+    """
+    Detect objects on uploaded images
+    """
+    uploaded = read_uploaded_images()
+    if isinstance(uploaded, str):
+        return jsonify(format_response(
+            message="Validation failed",
+            error=uploaded
+        )), 400
+    names, images = uploaded
+
+    batcher = get_batching_detector(current_app)
+    try:
+        future = batcher.submit(images)
+    except QueueFullError:
+        logger.warning("Detection queue is full, rejecting request.")
+        response = jsonify(format_response(
+            message="Service busy",
+            error="Too many detection requests are queued, retry later"
+        ))
+        response.headers["Retry-After"] = "1"
+        return response, 503
+
+    timeout = current_app.config.get("DETECTION_TIMEOUT", DEFAULT_DETECTION_CONFIG["DETECTION_TIMEOUT"])
+    try:
+        predictions = future.result(timeout=timeout)
+    except TimeoutError:
+        # Requests still queued are dropped, the detector only works for callers that wait
+        future.cancel()
+        logger.warning(f"Detection timed out after {timeout} seconds.")
+        return jsonify(format_response(
+            message="Detection timed out",
+            error=f"No detections after {timeout} seconds"
+        )), 504
+
+    return jsonify(format_response(
+        message="Objects detected successfully",
+        data={"results": [{"image": name, "detections": prediction}
+                          for name, prediction in zip(names, predictions)]},
+        error=None
+    )), 200
+
+
+@detection_bp.errorhandler(Exception)
+def handle_exception(e):
+    """
+    Handle exceptions and log them.
+    """
+    logger.error(f"Unhandled exception: {str(e)}", exc_info=True)
+    return jsonify(format_response(
+        message="An internal server error occurred",
+        error="Unknown server error"
+    )), 500
@@ -0,0 +1,208 @@
+import json
+import base64
+import struct
+from array import array
+from uuid import UUID
+from bisect import bisect_left, bisect_right, insort
+
+SORT_FIELDS = ("id", "price", "quantity")
+RANGE_FIELDS = ("price", "quantity")
+MAX_PAGE_SIZE = 1000
+
+_double = struct.Struct(">d")
+_uint64 = struct.Struct(">Q")
+_SIGN = 1 << 63
+_MASK = (1 << 64) - 1
+_MAX_KEY = b"\xff" * 16
+
+
+def encode_number(value):
+    """
+    Encode a number into 8 bytes whose byte order is the numeric order
+    """
+    (bits,) = _uint64.unpack(_double.pack(value))
+    return _uint64.pack(bits ^ _MASK if bits & _SIGN else bits | _SIGN)
+
+
+def encode_numbers(values):
+    """
+    encode_number over a sequence, reinterpreting all doubles at once
+    """
+    bits = array("Q")
+    bits.frombytes(array("d", values).tobytes())
+    return [(value ^ _MASK if value & _SIGN else value | _SIGN).to_bytes(8, "big") for value in bits]
+
+
+def decode_number(data):
+    (bits,) = _uint64.unpack(data)
+    return _double.unpack(_uint64.pack(bits ^ _SIGN if bits & _SIGN else bits ^ _MASK))[0]
+
+
+class ProductIndex:
+    """
+    Secondary indexes over product records, maintained by every write.
+    For each sort field there is a sorted list over all products and one per category, so
+    a filtered and sorted page is found by bisecting to its first entry and scanning forward,
+    instead of visiting the whole catalogue. Entries are bytes compared with memcmp: the
+    16-byte product key for "id", and the order-preserving encoding of the value followed
+    by the key for the other fields, shared between the overall and the category list.
+    """
+
+    def __init__(self):
+        self.entries = {}  # (category code or None, field) -> sorted entries
+
+    def _lists(self, record):
+        entries = [("id", record.key)]
+        entries.extend((field, encode_number(getattr(record, field)) + record.key) for field in RANGE_FIELDS)
+        for field, entry in entries:
+            yield (None, field), entry
+            yield (record.category, field), entry
+
+    def add(self, record):
+        for key, entry in self._lists(record):
+            insort(self.entries.setdefault(key, []), entry)
+
+    def add_many(self, records):
+        """
+        Index a batch of records. The new entries of each list are sorted and merged
+        in with one copy of the list, instead of shifting it once per product.
+        """
+        records = list(records)
+        columns = {"id": [record.key for record in records]}
+        for field in RANGE_FIELDS:
+            columns[field] = [number + record.key for number, record in
+                              zip(encode_numbers([getattr(record, field) for record in records]), records)]
+        positions = {}  # category code -> positions of its records
+        for position, record in enumerate(records):
+            positions.setdefault(record.category, []).append(position)
+        batches = {}
+        for field, column in columns.items():
+            batches[(None, field)] = column
+            for category, category_positions in positions.items():
+                batches[(category, field)] = [column[position] for position in category_positions]
+        for key, batch in batches.items():
+            entries = self.entries.get(key, [])
+            if len(batch) * 16 >= len(entries):
+                # A large batch, such as a whole catalogue at recovery, is cheaper to merge by sorting
+                entries = entries + batch
+                entries.sort()
+                self.entries[key] = entries
+                continue
+            batch.sort()
+            merged, start = [], 0
+            for entry in batch:
+                position = bisect_right(entries, entry, start)
+                merged += entries[start:position]
+                merged.append(entry)
+                start = position
+            merged += entries[start:]
+            self.entries[key] = merged
+
+    def add_sorted(self, field, entries, categories):
+        """
+        Index entries of one field that are already in sort order, such as those kept in a
+        snapshot, without sorting them again. Only for a field with no entries yet.
+        Args:
+            field (str): Sort field of the entries, one of SORT_FIELDS.
+            entries (list): Sorted entries over all products, kept as the overall list.
+            categories (list): Category code of each entry.
+        """
+        lists = {}
+        for entry, category in zip(entries, categories):
+            category_entries = lists.get(category)
+            if category_entries is None:
+                category_entries = lists[category] = []
+            category_entries.append(entry)
+        if entries:
+            self.entries[(None, field)] = entries
+        for category, category_entries in lists.items():
+            self.entries[(category, field)] = category_entries
+
+    def remove(self, record):
+        for key, entry in self._lists(record):
+            entries = self.entries[key]
+            del entries[bisect_left(entries, entry)]
+            if not entries:
+                del self.entries[key]
+
+    def clear(self):
+        self.entries.clear()
+
+    def query(self, records, category=None, ranges=None, sort="id", descending=False, limit=None, cursor=None):
+        """
+        Find a page of products matching the filters, in sort order.
+        Args:
+            records (dict): Product records by key, as indexed.
+            category (int): Only products with this category code.
+            ranges (dict): Inclusive (low, high) bounds by field, either may be None.
+            sort (str): Field to sort by, one of SORT_FIELDS.
+            descending (bool): Sort from the largest value.
+            limit (int): Page size, or None for all matches.
+            cursor (tuple): (value, id) of the last product of the previous page.
+        Returns:
+            tuple: (records of the page, (value, id) cursor of the next page or None).
+        """
+        ranges = ranges or {}
+        entries = self.entries.get((category, sort), [])
+        start, stop = 0, len(entries)
+
+        # The range on the sort field bounds the scan, the other ranges are checked per product
+        low, high = ranges.get(sort, (None, None))
+        if low is not None:
+            start = bisect_left(entries, encode_number(low))
+        if high is not None:
+            stop = bisect_right(entries, encode_number(high) + _MAX_KEY)
+        if cursor is not None:
+            value, product_id = cursor
+            key = UUID(product_id).bytes
+            entry = key if sort == "id" else encode_number(value) + key
+            if descending:
+                stop = min(stop, bisect_left(entries, entry))
+            else:
+                start = max(start, bisect_right(entries, entry))
+        checks = [(field, bounds) for field, bounds in ranges.items() if field != sort]
+
+        page = []
+        positions = range(stop - 1, start - 1, -1) if descending else range(start, stop)
+        for position in positions:
+            record = records[entries[position][-16:]]
+            if all(_in_range(getattr(record, field), bounds) for field, bounds in checks):
+                if limit is not None and len(page) == limit:
+                    last = page[-1]
+                    product_id = str(UUID(bytes=last.key))
+                    return page, (product_id if sort == "id" else getattr(last, sort), product_id)
+                page.append(record)
+        return page, None
+
+
+def _in_range(value, bounds):
+    low, high = bounds
+    return (low is None or value >= low) and (high is None or value <= high)
+
+
+def encode_cursor(sort, entry):
+    """
+    Encode the sort order and last (value, id) of a page into an opaque cursor
+    """
+    return base64.urlsafe_b64encode(json.dumps([sort, *entry]).encode()).decode()
+
+
+def decode_cursor(cursor, sort):
+    """
+    Decode a cursor made by encode_cursor for the same sort order.
+    Raises ValueError for malformed cursors or cursors of another sort order.
+    """
+    try:
+        cursor_sort, value, product_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+    except (TypeError, ValueError) as e:
+        raise ValueError("Malformed cursor") from e
+    if cursor_sort != sort:
+        raise ValueError(f"Cursor was made for sort '{cursor_sort}', not '{sort}'")
+    if not isinstance(product_id, str) or isinstance(value, bool) or \
+            not isinstance(value, str if sort.lstrip("-") == "id" else (int, float)):
+        raise ValueError("Malformed cursor")
+    try:
+        UUID(product_id)
+    except ValueError as e:
+        raise ValueError("Malformed cursor") from e
+    return value, product_id
@@ -0,0 +1,315 @@
+import os
+import sys
+import json
+import time
+import random
+import socket
+import logging
+import argparse
+import platform
+import tempfile
+import threading
+import subprocess
+import http.client
+from itertools import islice
+from contextlib import contextmanager
+
+from benchmark_memory import make_products
+from models import CATEGORIES
+from utils import setup_logger
+
+
+logger = setup_logger("part2_loadtest")
+
+OPERATIONS = ["get", "list", "post", "put", "delete"]
+DEFAULT_MIX = "get=60,list=15,post=10,put=10,delete=5"
+
+
+def main():
+    # Parse Arguments
+    parser = argparse.ArgumentParser(description="Part 2: load test of the product API")
+    parser.add_argument('--mode', choices=['inprocess', 'gunicorn'], default='inprocess',
+                        help="Drive create_app through the Flask test client, or a local gunicorn server over HTTP")
+    parser.add_argument('--store', choices=['memory', 'sqlite'], default='memory', help="PRODUCT_STORE of the app")
+    parser.add_argument('--app-config', type=json.loads, default={}, help="Extra create_app config as a JSON object")
+    parser.add_argument('--workers', nargs='+', type=int, default=[1], help="Gunicorn worker counts")
+    parser.add_argument('--threads', nargs='+', type=int, default=[4], help="Gunicorn threads per worker")
+    parser.add_argument('--concurrency', nargs='+', type=int, default=[1, 8], help="Concurrent client threads")
+    parser.add_argument('--mix', default=DEFAULT_MIX, help="Weights of the operations: get, list, post, put, delete")
+    parser.add_argument('--seed-items', type=int, default=10000, help="Products in the catalogue before a run")
+    parser.add_argument('--duration', type=float, default=10, help="Seconds each concurrency level runs")
+    parser.add_argument('--port', type=int, default=8765, help="Port of the gunicorn server")
+    parser.add_argument('--seed', type=int, default=0, help="Seed of the synthetic products and operations")
+    parser.add_argument('--output', '-o', default="loadtest.json", help="JSON file for the results")
+    args = parser.parse_args()
+
+    mix = parse_mix(args.mix)
+    servers = [(workers, threads) for workers in args.workers for threads in args.threads]
+    if args.mode == 'inprocess':
+        servers = [(None, None)]
+
+    results = []
+    for workers, threads in servers:
+        if args.mode == 'gunicorn' and args.store == 'memory' and workers > 1:
+            logger.warning(f"Skipping {workers} workers: each worker would have its own in-memory catalogue, use --store sqlite")
+            continue
+        with tempfile.TemporaryDirectory() as directory:
+            config = {"PRODUCT_STORE": args.store, "PRODUCT_DB_PATH": os.path.join(directory, "products.db"),
+                      **args.app_config}
+            with start_target(args.mode, config, workers, threads, args.port) as make_transport:
+                pool = ProductPool(seed_catalogue(make_transport(), args.seed_items, args.seed))
+                for concurrency in args.concurrency:
+                    result = run_load(make_transport, pool, mix, concurrency, args.duration, args.seed)
+                    result.update({"mode": args.mode, "store": args.store, "workers": workers, "threads": threads,
+                                   "concurrency": concurrency, "seed_items": args.seed_items, "mix": mix})
+                    logger.info(format_result(result))
+                    results.append(result)
+
+    report = {"environment": {"python": platform.python_version(), "platform": platform.platform(),
+                              "cpus": os.cpu_count()},
+              "results": results}
+    with open(args.output, 'w') as f:
+        json.dump(report, f, indent=4)
+    logger.info(f"Load test results saved to {args.output}")
+
+
+def parse_mix(mix):
+    """
+    Parse "get=60,post=10,..." into weights by operation
+    """
+    weights = {}
+    for part in mix.split(","):
+        operation, weight = part.split("=")
+        if operation not in OPERATIONS:
+            raise ValueError(f"Unknown operation {operation!r}, expected one of {', '.join(OPERATIONS)}")
+        weights[operation] = float(weight)
+    return weights
+
+
+class TestClientTransport:
+    """
+    Send requests to an app in this process through the Flask test client
+    """
+
+    def __init__(self, app):
+        self.client = app.test_client()
+
+    def request(self, method, path, body=None):
+        response = self.client.open(path, method=method, json=body)
+        response.get_data()
+        return response.status_code
+
+
+class HTTPTransport:
+    """
+    Send requests over a kept-alive HTTP connection, reconnecting after errors
+    """
+
+    def __init__(self, host, port):
+        self.host = host
+        self.port = port
+        self.connection = None
+
+    def request(self, method, path, body=None):
+        if self.connection is None:
+            self.connection = http.client.HTTPConnection(self.host, self.port, timeout=30)
+        headers = {"Content-Type": "application/json"} if body is not None else {}
+        try:
+            self.connection.request(method, path, body=json.dumps(body) if body is not None else None, headers=headers)
+            response = self.connection.getresponse()
+            response.read()
+            return response.status
+        except (OSError, http.client.HTTPException):
+            self.connection.close()
+            self.connection = None
+            raise
+
+
+@contextmanager
+def start_target(mode, config, workers, threads, port):
+    """
+    Start the app under test and yield a factory of transports to it
+    """
+    if mode == 'inprocess':
+        from app import create_app
+
+        # Missing products after concurrent deletes are expected, keep their warnings out of the output
+        logging.getLogger("part2_api").setLevel(logging.ERROR)
+        app = create_app(config)
+        yield lambda: TestClientTransport(app)
+        return
+
+    spec = f"app:create_app({json.dumps(config)})"
+    process = subprocess.Popen([sys.executable, "-m", "gunicorn", "-w", str(workers), "--threads", str(threads),
+                                "-b", f"127.0.0.1:{port}", "--log-level", "warning", spec],
+                               cwd=os.path.dirname(os.path.abspath(__file__)))
+    try:
+        wait_for_port("127.0.0.1", port, process)
+        yield lambda: HTTPTransport("127.0.0.1", port)
+    finally:
+        process.terminate()
+        process.wait()
+
+
+def wait_for_port(host, port, process, timeout=30):
+    """
+    Wait until a server accepts connections on a port
+    """
+    deadline = time.monotonic() + timeout
+    while time.monotonic() < deadline:
+        if process.poll() is not None:
+            raise RuntimeError(f"Server exited with code {process.returncode}")
+        try:
+            socket.create_connection((host, port), timeout=1).close()
+            return
+        except OSError:
+            time.sleep(0.1)
+    raise TimeoutError(f"Server did not listen on {host}:{port} within {timeout} seconds")
+
+
+def seed_catalogue(transport, count, seed=0, chunk_size=1000):
+    """
+    Create count products through the bulk endpoint and return their IDs
+    """
+    product_ids = []
+    products = make_products(count, seed)
+    while True:
+        chunk = [{**product, "id": str(product["id"])} for product in islice(products, chunk_size)]
+        if not chunk:
+            break
+        status = transport.request("POST", "/products/bulk", chunk)
+        if status != 200:
+            raise RuntimeError(f"Seeding the catalogue failed with status {status}")
+        product_ids.extend(product["id"] for product in chunk)
+    logger.info(f"Seeded {len(product_ids)} products")
+    return product_ids
+
+
+class ProductPool:
+    """
+    IDs of products that exist, shared by the client threads
+    """
+
+    def __init__(self, product_ids):
+        self.product_ids = list(product_ids)
+        self.lock = threading.Lock()
+
+    def pick(self, rng):
+        with self.lock:
+            return rng.choice(self.product_ids) if self.product_ids else None
+
+    def take(self, rng):
+        with self.lock:
+            if not self.product_ids:
+                return None
+            position = rng.randrange(len(self.product_ids))
+            self.product_ids[position], self.product_ids[-1] = self.product_ids[-1], self.product_ids[position]
+            return self.product_ids.pop()
+
+    def add(self, product_id):
+        with self.lock:
+            self.product_ids.append(product_id)
+
+
+def make_request(operation, pool, rng):
+    """
+    Return (method, path, body) of one operation, or None if there is no product to use
+    """
+    if operation == "post":
+        product = next(make_products(1, rng.getrandbits(64)))
+        return "POST", "/products/", {**product, "id": str(product["id"])}
+    if operation == "list":
+        return "GET", f"/products/?category={rng.choice(CATEGORIES).replace(' ', '+')}&sort=price&limit=50", None
+    product_id = pool.take(rng) if operation == "delete" else pool.pick(rng)
+    if product_id is None:
+        return None
+    if operation == "get":
+        return "GET", f"/products/{product_id}", None
+    if operation == "put":
+        return "PUT", f"/products/{product_id}", {"price": round(rng.uniform(1, 1000), 2)}
+    return "DELETE", f"/products/{product_id}", None
+
+
+def run_load(make_transport, pool, mix, concurrency, duration, seed=0):
+    """
+    Drive the operation mix from concurrency client threads for duration seconds.
+    Returns throughput and latency percentiles overall and per operation.
+    """
+    operations, weights = list(mix), list(mix.values())
+    samples = {operation: [] for operation in operations}  # operation -> [(latency, status)]
+    errors = {operation: 0 for operation in operations}
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client(index):
+        rng = random.Random(f"{seed}:{concurrency}:{index}")
+        transport = make_transport()
+        local = {operation: [] for operation in operations}
+        local_errors = {operation: 0 for operation in operations}
+        while time.monotonic() < deadline:
+            operation = rng.choices(operations, weights)[0]
+            request = make_request(operation, pool, rng)
+            if request is None:
+                continue
+            method, path, body = request
+            start = time.perf_counter()
+            try:
+                status = transport.request(method, path, body)
+            except Exception:
+                local_errors[operation] += 1
+                continue
+            local[operation].append((time.perf_counter() - start, status))
+            if operation == "post" and status == 201:
+                pool.add(body["id"])
+        with lock:
+            for operation in operations:
+                samples[operation].extend(local[operation])
+                errors[operation] += local_errors[operation]
+
+    threads = [threading.Thread(target=client, args=(index,)) for index in range(concurrency)]
+    start = time.perf_counter()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.perf_counter() - start
+
+    result = {"seconds": elapsed, "operations": {}}
+    for operation in operations:
+        result["operations"][operation] = summarize(samples[operation], errors[operation], elapsed)
+    result["total"] = summarize([sample for operation in operations for sample in samples[operation]],
+                                sum(errors.values()), elapsed)
+    return result
+
+
+def summarize(samples, errors, elapsed):
+    """
+    Count, throughput, status codes and latency percentiles in milliseconds of samples
+    """
+    latencies = sorted(latency for latency, _ in samples)
+    statuses = {}
+    for _, status in samples:
+        statuses[str(status)] = statuses.get(str(status), 0) + 1
+    summary = {"requests": len(samples), "errors": errors, "requests_per_second": len(samples) / elapsed,
+               "statuses": statuses}
+    for name, quantile in (("p50_ms", 0.5), ("p90_ms", 0.9), ("p99_ms", 0.99)):
+        summary[name] = latencies[int(quantile * (len(latencies) - 1))] * 1000 if latencies else None
+    summary["mean_ms"] = sum(latencies) / len(latencies) * 1000 if latencies else None
+    return summary
+
+
+def format_result(result):
+    """
+    One log line describing a load test run
+    """
+    total = result["total"]
+    target = "in-process" if result["mode"] == "inprocess" else f"{result['workers']}x{result['threads']} gunicorn"
+    line = (f"{target}, {result['store']} store, concurrency {result['concurrency']}: "
+            f"{total['requests_per_second']:.0f} req/s")
+    if total["requests"]:
+        line += f", p50 {total['p50_ms']:.2f} ms, p99 {total['p99_ms']:.2f} ms"
+    return line + f", {total['errors']} errors"
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,276 @@
+import os
+import sys
+import time
+import threading
+from bisect import bisect_left
+from collections import Counter
+from contextlib import contextmanager
+
+from flask import Blueprint, Response, current_app, g, has_app_context, request
+from flask.json.provider import DefaultJSONProvider
+
+# Initialize Blueprint
+metrics_bp = Blueprint("metrics", __name__)
+
+DEFAULT_METRICS_CONFIG = {
+    "METRICS_ENABLED": True,  # Collect request, lock and stage timings and serve them at /metrics
+    "METRICS_PROFILER": False,  # Serve /metrics/profile, which samples the stacks of all threads on demand
+    "METRICS_PROFILER_INTERVAL_MS": 5,  # Time between stack samples of the profiler
+}
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+LATENCY_BUCKETS = (0.0001, 0.00025, 0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+MAX_PROFILE_SECONDS = 60
+
+
+class Metric:
+    """
+    Base of the labelled metrics, rendered in the Prometheus text exposition format
+    """
+
+    kind = None
+
+    def __init__(self, name, help, labels=()):
+        self.name = name
+        self.help = help
+        self.labels = labels
+        self.values = {}  # label values -> value
+        self.lock = threading.Lock()
+
+    def _label_text(self, values, extra=None):
+        pairs = list(zip(self.labels, values))
+        if extra:
+            pairs.append(extra)
+        if not pairs:
+            return ""
+        return "{" + ",".join(f'{label}="{_escape(value)}"' for label, value in pairs) + "}"
+
+    def _copy(self, value):
+        return value
+
+    def render(self):
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        with self.lock:
+            values = [(label_values, self._copy(value)) for label_values, value in self.values.items()]
+        for label_values, value in sorted(values):
+            lines.extend(self._render_value(label_values, value))
+        return lines
+
+
+class CounterMetric(Metric):
+    kind = "counter"
+
+    def inc(self, *label_values, amount=1):
+        with self.lock:
+            self.values[label_values] = self.values.get(label_values, 0) + amount
+
+    def _render_value(self, label_values, value):
+        return [f"{self.name}{self._label_text(label_values)} {value}"]
+
+
+class GaugeMetric(Metric):
+    """
+    Gauge whose value is read from a callback when the metrics are rendered
+    """
+
+    kind = "gauge"
+
+    def __init__(self, name, help, read):
+        super().__init__(name, help)
+        self.read = read
+
+    def render(self):
+        value = self.read()
+        if value is None:
+            return []
+        return [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}", f"{self.name} {value}"]
+
+
+class HistogramMetric(Metric):
+    """
+    Histogram with fixed bucket bounds. An observation costs a bisect and a few additions.
+    """
+
+    kind = "histogram"
+
+    def __init__(self, name, help, labels=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, help, labels)
+        self.buckets = buckets
+
+    def observe(self, value, *label_values):
+        position = bisect_left(self.buckets, value)
+        with self.lock:
+            entry = self.values.get(label_values)
+            if entry is None:
+                entry = self.values[label_values] = [[0] * (len(self.buckets) + 1), 0.0, 0]
+            entry[0][position] += 1
+            entry[1] += value
+            entry[2] += 1
+
+    def _copy(self, value):
+        return value[0][:], value[1], value[2]
+
+    def _render_value(self, label_values, value):
+        counts, total, count = value
+        lines, cumulative = [], 0
+        for bound, bucket_count in zip(self.buckets, counts):
+            cumulative += bucket_count
+            lines.append(f"{self.name}_bucket{self._label_text(label_values, ('le', bound))} {cumulative}")
+        lines.append(f"{self.name}_bucket{self._label_text(label_values, ('le', '+Inf'))} {count}")
+        lines.append(f"{self.name}_sum{self._label_text(label_values)} {total}")
+        lines.append(f"{self.name}_count{self._label_text(label_values)} {count}")
+        return lines
+
+
+def _escape(value):
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+class Metrics:
+    """
+    Instrumentation of one app: request counts and latencies per route, wait and hold
+    times of the store lock, time spent in validation and serialization, and the store size.
+    Metrics live in the process, so each gunicorn worker reports its own.
+    """
+
+    def __init__(self, store, cache=None):
+        self.requests = CounterMetric("part2_http_requests_total", "Requests handled, by route, method and status",
+                                      ("method", "route", "status"))
+        self.latency = HistogramMetric("part2_http_request_duration_seconds", "Time to build a response, by route",
+                                       ("method", "route"))
+        self.lock_wait = HistogramMetric("part2_store_lock_wait_seconds",
+                                         "Time spent waiting for the product store lock", ("mode",))
+        self.lock_hold = HistogramMetric("part2_store_lock_hold_seconds",
+                                         "Time the product store lock was held", ("mode",))
+        self.stages = HistogramMetric("part2_stage_duration_seconds",
+                                      "Time spent in validation and serialization", ("stage",))
+        self.store_size = GaugeMetric("part2_store_products", "Products in the store", store.count)
+        self.cache_size = GaugeMetric("part2_response_cache_entries", "Serialized responses in the cache",
+                                      lambda: len(cache.entries) if cache is not None else None)
+        # Only the in-memory store has a lock of its own, SQLite does its locking in the database
+        lock = getattr(store, "lock", None)
+        if lock is not None:
+            lock.observe = self.observe_lock
+
+    def observe_lock(self, mode, wait, hold):
+        self.lock_wait.observe(wait, mode)
+        self.lock_hold.observe(hold, mode)
+
+    def render(self):
+        lines = []
+        for metric in (self.requests, self.latency, self.lock_wait, self.lock_hold, self.stages, self.store_size,
+                       self.cache_size):
+            lines.extend(metric.render())
+        return "\n".join(lines) + "\n"
+
+
+@contextmanager
+def timed(stage):
+    """
+    Record the time spent in the block as a stage of the current app's metrics
+    """
+    start = time.perf_counter()
+    try:
+        yield
+    finally:
+        metrics = current_app.extensions.get("metrics") if has_app_context() else None
+        if metrics is not None:
+            metrics.stages.observe(time.perf_counter() - start, stage)
+
+
+class TimedJSONProvider(DefaultJSONProvider):
+    """
+    Flask's JSON provider, recording the time jsonify spends serializing
+    """
+
+    def response(self, *args, **kwargs):
+        with timed("serialization"):
+            return super().response(*args, **kwargs)
+
+
+def _before_request():
+    g.metrics_start = time.perf_counter()
+
+
+def _after_request(response):
+    start = g.pop("metrics_start", None)
+    if start is not None:
+        metrics = current_app.extensions["metrics"]
+        route = request.url_rule.rule if request.url_rule is not None else "unmatched"
+        metrics.latency.observe(time.perf_counter() - start, request.method, route)
+        metrics.requests.inc(request.method, route, response.status_code)
+    return response
+
+
+def init_metrics(app):
+    """
+    Instrument an app whose store and response cache are set up, and register /metrics
+    """
+    config = {**DEFAULT_METRICS_CONFIG, **app.config}
+    if not config["METRICS_ENABLED"]:
+        return
+    app.extensions["metrics"] = Metrics(app.extensions["product_store"], app.extensions.get("response_cache"))
+    app.json = TimedJSONProvider(app)
+    app.before_request(_before_request)
+    app.after_request(_after_request)
+    app.register_blueprint(metrics_bp, url_prefix="/metrics")
+
+
+@metrics_bp.route("", methods=["GET"])
+def get_metrics():
+    """
+    Return the metrics in the Prometheus text format
+    """
+    return Response(current_app.extensions["metrics"].render(), content_type=CONTENT_TYPE)
+
+
+class SamplingProfiler:
+    """
+    Statistical profiler: samples the Python stacks of all other threads at a fixed interval
+    and counts them in the folded format of flame graph tools ("outer;inner count" per line).
+    Only runs while a profile is requested, so it costs nothing otherwise.
+    """
+
+    def __init__(self, interval=0.005):
+        self.interval = interval
+
+    def run(self, seconds):
+        samples = Counter()
+        own = threading.get_ident()
+        deadline = time.monotonic() + seconds
+        while time.monotonic() < deadline:
+            for ident, frame in sys._current_frames().items():
+                if ident != own:
+                    samples[self._fold(frame)] += 1
+            time.sleep(self.interval)
+        return samples
+
+    @staticmethod
+    def _fold(frame):
+        names = []
+        while frame is not None:
+            code = frame.f_code
+            names.append(f"{os.path.basename(code.co_filename)}:{code.co_name}")
+            frame = frame.f_back
+        return ";".join(reversed(names))
+
+
+@metrics_bp.route("/profile", methods=["GET"])
+def get_profile():
+    """
+    Sample the stacks of all threads for ?seconds= (default 10) and return them folded,
+    ready for flamegraph.pl or speedscope. Disabled unless METRICS_PROFILER is set.
+    """
+    config = {**DEFAULT_METRICS_CONFIG, **current_app.config}
+    if not config["METRICS_PROFILER"]:
+        return Response("Profiler is disabled, set METRICS_PROFILER\n", status=404, mimetype="text/plain")
+    try:
+        seconds = float(request.args.get("seconds", 10))
+    except ValueError:
+        return Response("seconds must be a number\n", status=400, mimetype="text/plain")
+    if not 0 < seconds <= MAX_PROFILE_SECONDS:
+        return Response(f"seconds must be between 0 and {MAX_PROFILE_SECONDS}\n", status=400, mimetype="text/plain")
+
+    samples = SamplingProfiler(config["METRICS_PROFILER_INTERVAL_MS"] / 1000).run(seconds)
+    body = "".join(f"{stack} {count}\n" for stack, count in samples.most_common())
+    return Response(body, mimetype="text/plain")
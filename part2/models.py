@@ -1,11 +1,11 @@
-from threading import Lock
 from pydantic import BaseModel, Field, UUID4
-from typing import Literal, Optional
+from typing import Literal, Optional, get_args
 
-CATEGORIES = [
+Category = Literal[
     "Electronics", "Home Appliances", "Books", "Fashion", "Toys",
     "Furniture", "Groceries", "Fitness", "Beauty", "Automotive"
 ]
+CATEGORIES = list(get_args(Category))
 
 class Product(BaseModel):
     id: UUID4  # Validate as a UUID
@@ -13,10 +13,7 @@ class Product(BaseModel):
     description: str
     price: float = Field(gt=0, description="Price must be greater than 0")
     quantity: int = Field(ge=1, le=10, description="Quantity must be between 1 and 10")
-    category: Literal[
-        "Electronics", "Home Appliances", "Books", "Fashion", "Toys",
-        "Furniture", "Groceries", "Fitness", "Beauty", "Automotive"
-    ]
+    category: Category
 
 
 class ProductUpdate(BaseModel):
@@ -24,13 +21,9 @@ class ProductUpdate(BaseModel):
     description: Optional[str] = None
     price: Optional[float] = Field(None, gt=0)
     quantity: Optional[int] = Field(None, ge=1, le=10)
-    category: Optional[str] = None
+    category: Optional[Category] = None
 
 
 def validate_product_update(data):
     return ProductUpdate(**data)
 
-
-# Shared in-memory data structure. In the future can be expanded to interact with Database or Redis for processing parallelism as opposed to threading
-products = {}
-product_lock = Lock()
@@ -0,0 +1,428 @@
+import gc
+import os
+import re
+import json
+import time
+import zlib
+import struct
+import logging
+import threading
+from array import array
+from bisect import bisect_left
+from itertools import compress
+
+from indexes import RANGE_FIELDS
+from records import ProductRecord, category_code, category_names, product_key
+
+logger = logging.getLogger("part2_api")
+
+_RECORD_HEADER = struct.Struct("<II")  # Payload length, CRC32 of the payload
+_SNAPSHOT_MAGIC = b"PRODSNP1"
+_SECTION = struct.Struct("<Q")
+_FILE_NAME = re.compile(r"^(wal|snapshot)-(\d{8})\.(log|bin)$")
+
+
+def encode_record(operation):
+    """
+    Frame one operation of the log with its length and checksum
+    """
+    payload = json.dumps(operation, separators=(",", ":")).encode()
+    return _RECORD_HEADER.pack(len(payload), zlib.crc32(payload)) + payload
+
+
+def read_records(data):
+    """
+    Decode the operations of a log segment.
+    Returns (operations, length of the valid prefix); a torn or corrupt record ends the valid prefix.
+    """
+    operations, offset = [], 0
+    while offset + _RECORD_HEADER.size <= len(data):
+        size, checksum = _RECORD_HEADER.unpack_from(data, offset)
+        start, end = offset + _RECORD_HEADER.size, offset + _RECORD_HEADER.size + size
+        if end > len(data) or zlib.crc32(data[start:end]) != checksum:
+            break
+        operations.append(json.loads(data[start:end]))
+        offset = end
+    return operations, offset
+
+
+class WriteAheadLog:
+    """
+    Append-only log file of store operations with group commit.
+    Writers append under the store lock, which fixes the order of the log, and then wait
+    for durability outside of it. A background thread writes everything appended since
+    its last flush with one write and one fsync, so concurrent writers share an fsync.
+    """
+
+    def __init__(self, path, fsync=True):
+        self.path = path
+        self.fsync = fsync
+        self.file = open(path, "ab")
+        if fsync:
+            sync_directory(path)
+        self.condition = threading.Condition()
+        self.pending = []
+        self.appended = 0  # Sequence number of the last append
+        self.durable = 0  # Sequence number of the last append on disk
+        self.error = None
+        self.closed = False
+        self.thread = threading.Thread(target=self._run, name="wal-writer", daemon=True)
+        self.thread.start()
+
+    def append(self, operations):
+        """
+        Queue operations for the log, returns the sequence number to wait for
+        """
+        data = b"".join(encode_record(operation) for operation in operations)
+        with self.condition:
+            if self.error is not None:
+                raise OSError(f"Write-ahead log {self.path} failed") from self.error
+            self.pending.append(data)
+            self.appended += 1
+            self.condition.notify_all()
+            return self.appended
+
+    def wait(self, sequence):
+        """
+        Block until the append with this sequence number is on disk
+        """
+        with self.condition:
+            while self.durable < sequence and self.error is None:
+                self.condition.wait()
+            if self.durable < sequence:
+                raise OSError(f"Write-ahead log {self.path} failed") from self.error
+
+    def close(self):
+        """
+        Flush everything appended and close the file
+        """
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+        self.thread.join()
+        self.file.close()
+
+    def _run(self):
+        while True:
+            with self.condition:
+                while not self.pending and not self.closed:
+                    self.condition.wait()
+                if not self.pending:
+                    return
+                batch, self.pending = self.pending, []
+                sequence = self.appended
+            try:
+                self.file.write(b"".join(batch))
+                self.file.flush()
+                if self.fsync:
+                    os.fsync(self.file.fileno())
+            except OSError as e:
+                logger.error(f"Writing the write-ahead log {self.path} failed: {e}")
+                with self.condition:
+                    self.error = e
+                    self.condition.notify_all()
+                return
+            with self.condition:
+                self.durable = sequence
+                self.condition.notify_all()
+
+
+def write_snapshot(path, rows, categories, entries, search=None, fsync=True):
+    """
+    Write product rows (key, name, description, price, quantity, category code) in key
+    order to a compact columnar snapshot, with the sorted index entries of each of
+    RANGE_FIELDS and their category codes, and the columns of a search index if given,
+    so recovery does not build the indexes again.
+    The file is written aside and renamed into place, so a crash never leaves a partial snapshot.
+    """
+    keys = b"".join(row[0] for row in rows)
+    prices = array("d", (row[3] for row in rows))
+    quantities = array("q", (row[4] for row in rows))
+    codes = array("H", (row[5] for row in rows))
+    texts = json.dumps([row[1] for row in rows] + [row[2] for row in rows], separators=(",", ":")).encode()
+    header = json.dumps({"count": len(rows), "categories": categories, "indexes": list(entries),
+                         "search": search is not None}).encode()
+    sections = [header, keys, prices.tobytes(), quantities.tobytes(), codes.tobytes(), texts]
+    positions = {row[0]: position for position, row in enumerate(rows)}
+    for field_entries in entries.values():
+        sections.append(b"".join(field_entries))
+        sections.append(array("H", [codes[positions[entry[-16:]]] for entry in field_entries]).tobytes())
+    if search is not None:
+        terms, counts, product_positions, weights = search.columns(positions)
+        sections.append(json.dumps(terms, separators=(",", ":")).encode())
+        sections.extend((counts.tobytes(), product_positions.tobytes(), weights.tobytes()))
+
+    data = bytearray(_SNAPSHOT_MAGIC)
+    for section in sections:
+        data += _SECTION.pack(len(section)) + section
+    data += struct.pack("<I", zlib.crc32(data))
+
+    temporary = path + ".tmp"
+    with open(temporary, "wb") as f:
+        f.write(data)
+        f.flush()
+        if fsync:
+            os.fsync(f.fileno())
+    os.replace(temporary, path)
+    if fsync:
+        sync_directory(path)
+
+
+def sync_directory(path):
+    """
+    Make the creation or renaming of a file durable by syncing its folder
+    """
+    descriptor = os.open(os.path.dirname(os.path.abspath(path)), os.O_RDONLY)
+    try:
+        os.fsync(descriptor)
+    finally:
+        os.close(descriptor)
+
+
+def read_snapshot(path):
+    """
+    Read a snapshot written by write_snapshot.
+    Returns:
+        tuple: (records, {sort field: (sorted index entries, category code of each)},
+            columns of the search index or None). Snapshots of older versions store no indexes.
+    """
+    with open(path, "rb") as f:
+        data = f.read()
+    if not data.startswith(_SNAPSHOT_MAGIC) or struct.unpack("<I", data[-4:])[0] != zlib.crc32(data[:-4]):
+        raise ValueError(f"Snapshot {path} is corrupt")
+
+    sections, offset = [], len(_SNAPSHOT_MAGIC)
+    while offset < len(data) - 4:
+        (size,) = _SECTION.unpack_from(data, offset)
+        offset += _SECTION.size
+        sections.append(data[offset:offset + size])
+        offset += size
+    header, keys, price_data, quantity_data, code_data, texts, *index_sections = sections
+    header = json.loads(header)
+    count = header["count"]
+    prices, quantities, codes = array("d"), array("q"), array("H")
+    prices.frombytes(price_data)
+    quantities.frombytes(quantity_data)
+    codes.frombytes(code_data)
+    texts = json.loads(texts)
+
+    # Category codes of the snapshot are mapped to the codes of this process
+    categories = [category_code(name) for name in header["categories"]]
+    keys = [keys[i:i + 16] for i in range(0, 16 * count, 16)]
+    codes = [categories[code] for code in codes]
+    records = list(map(ProductRecord, keys, texts[:count], texts[count:], prices, quantities, codes))
+
+    entries, search = {}, None
+    if "indexes" in header:
+        # Rows are in key order, so the keys are the "id" entries
+        entries["id"] = (keys, codes)
+        for number, field in enumerate(header["indexes"]):
+            data, field_codes = index_sections[2 * number], array("H")
+            field_codes.frombytes(index_sections[2 * number + 1])
+            # Each entry is the 8-byte encoded value followed by the 16-byte key
+            entries[field] = ([data[i:i + 24] for i in range(0, len(data), 24)],
+                              [categories[code] for code in field_codes])
+    if header.get("search"):
+        terms, *columns = index_sections[2 * len(header["indexes"]):]
+        search = [json.loads(terms)]
+        for column in columns:
+            search.append(array("I"))
+            search[-1].frombytes(column)
+    return records, entries, search
+
+
+class ProductPersistence:
+    """
+    Durability of a MemoryProductStore: a write-ahead log of its operations split in
+    numbered segments, plus snapshots. Snapshot N holds the state before log segment N,
+    so recovery loads the latest snapshot and replays the segments from its number on.
+    """
+
+    def __init__(self, directory, snapshot_interval=300, fsync=True):
+        self.directory = directory
+        self.snapshot_interval = snapshot_interval
+        self.fsync = fsync
+        self.segment = 0
+        self.wal = None
+        self.snapshot_lock = threading.Lock()
+        self.snapshot_version = None
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, kind, number):
+        return os.path.join(self.directory, f"{kind}-{number:08d}.{'log' if kind == 'wal' else 'bin'}")
+
+    def _files(self, kind):
+        numbers = []
+        for name in os.listdir(self.directory):
+            match = _FILE_NAME.match(name)
+            if match and match.group(1) == kind:
+                numbers.append(int(match.group(2)))
+        return sorted(numbers)
+
+    def recover(self, store):
+        """
+        Load the latest snapshot and replay the log after it into an empty store.
+        A torn record at the end of the last segment, left by a crash during a write,
+        is cut off, since that write was never acknowledged.
+        """
+        # Recovery creates millions of objects that all stay alive, so garbage collections
+        # along the way would only scan them again and again
+        collecting = gc.isenabled()
+        gc.disable()
+        try:
+            start, segments, replayed = self._load(store)
+        finally:
+            if collecting:
+                gc.enable()
+        self.segment = max([start] + segments) + 1
+        self.wal = WriteAheadLog(self._path("wal", self.segment), self.fsync)
+        self.snapshot_version = store.version() if not replayed else None
+        logger.info(f"Recovered {len(store.products)} products from snapshot {start} and {replayed} logged operations")
+
+    def _load(self, store):
+        """
+        Fill the store from the latest snapshot and the log segments after it.
+        Returns (snapshot number, log segment numbers, number of replayed operations).
+        """
+        snapshots = self._files("snapshot")
+        start = snapshots[-1] if snapshots else 0
+        records, entries, search = read_snapshot(self._path("snapshot", start)) if snapshots else ([], {}, None)
+        products = store.products
+        for record in records:
+            products[record.key] = record
+
+        segments = [number for number in self._files("wal") if number >= start]
+        replayed, touched = 0, set()
+        for number in segments:
+            path = self._path("wal", number)
+            with open(path, "rb") as f:
+                data = f.read()
+            operations, valid = read_records(data)
+            if valid < len(data):
+                if number != segments[-1]:
+                    raise ValueError(f"Write-ahead log {path} is corrupt at byte {valid}")
+                logger.warning(f"Cutting off {len(data) - valid} bytes of an incomplete write at the end of {path}")
+                with open(path, "r+b") as f:
+                    f.truncate(valid)
+            for operation in operations:
+                touched.add(apply_operation(products, operation))
+            replayed += len(operations)
+
+        # The stored indexes hold the snapshot version of the products the log changed,
+        # which is taken out of them before the current version is indexed
+        changed = [products[key] for key in touched if key in products]
+        originals = []
+        if entries:
+            keys = entries["id"][0]
+            for key in touched:
+                position = bisect_left(keys, key)
+                if position < len(keys) and keys[position] == key:
+                    originals.append(records[position])
+            stale = {record.key for record in originals}
+            for field, (field_entries, categories) in entries.items():
+                if stale:
+                    kept = [entry[-16:] not in stale for entry in field_entries]
+                    field_entries, categories = list(compress(field_entries, kept)), list(compress(categories, kept))
+                store.index.add_sorted(field, field_entries, categories)
+            store.index.add_many(changed)
+        else:
+            store.index.add_many(products.values())
+        if store.search_index is not None:
+            if search is not None:
+                store.search_index.load_columns(entries["id"][0], *search)
+                store.search_index.remove_many(originals)
+                store.search_index.add_many(changed)
+            else:
+                store.search_index.add_many(products.values())
+        return start, segments, replayed
+
+    def log(self, operations):
+        """
+        Append operations to the log, called under the store's write lock.
+        Returns a ticket for wait.
+        """
+        return self.wal, self.wal.append(operations)
+
+    @staticmethod
+    def wait(ticket):
+        wal, sequence = ticket
+        wal.wait(sequence)
+
+    @staticmethod
+    def durable(ticket):
+        """
+        Return whether the operations of a ticket are on disk
+        """
+        wal, sequence = ticket
+        return wal.durable >= sequence
+
+    def snapshot(self, store):
+        """
+        Write a snapshot of the store and drop the log segments and snapshots it replaces.
+        Writes wait while the products are copied; the file is written after the lock is released.
+        """
+        with self.snapshot_lock:
+            with store.lock.read():
+                if store.version() == self.snapshot_version:
+                    return
+                # No write can append while the read lock is held, so the old segment ends here
+                self.wal.close()
+                self.segment += 1
+                self.wal = WriteAheadLog(self._path("wal", self.segment), self.fsync)
+                index = store.index.entries
+                rows = [(record.key, record.name, record.description, record.price, record.quantity, record.category)
+                        for record in map(store.products.__getitem__, index.get((None, "id"), []))]
+                entries = {field: list(index.get((None, field), [])) for field in RANGE_FIELDS}
+                search = store.search_index.copy() if store.search_index is not None else None
+                categories = category_names()
+                version = store.version()
+
+            write_snapshot(self._path("snapshot", self.segment), rows, categories, entries, search, self.fsync)
+            for number in self._files("snapshot"):
+                if number < self.segment:
+                    os.remove(self._path("snapshot", number))
+            for number in self._files("wal"):
+                if number < self.segment:
+                    os.remove(self._path("wal", number))
+            self.snapshot_version = version
+            logger.info(f"Wrote snapshot {self.segment} of {len(rows)} products")
+
+    def start(self, store):
+        """
+        Take snapshots every snapshot_interval seconds in a background thread
+        """
+        if not self.snapshot_interval:
+            return
+
+        def run():
+            while True:
+                time.sleep(self.snapshot_interval)
+                try:
+                    self.snapshot(store)
+                except Exception as e:
+                    logger.error(f"Snapshot failed: {str(e)}", exc_info=True)
+
+        threading.Thread(target=run, name="snapshots", daemon=True).start()
+
+
+def apply_operation(products, operation):
+    """
+    Replay one logged operation on a dict of records, returns the key of its product
+    """
+    kind = operation[0]
+    if kind == "c":
+        record = ProductRecord.from_product(operation[1])
+        products[record.key] = record
+        return record.key
+    key = product_key(operation[1])
+    if kind == "u":
+        record = products.get(key)
+        changes = record.changes(operation[2]) if record is not None else None
+        if changes:
+            # A changed copy replaces the record, which stays as the snapshot loaded it
+            record = products[key] = ProductRecord(*(getattr(record, field) for field in ProductRecord.__slots__))
+            for field, value in changes.items():
+                setattr(record, field, value)
+    elif kind == "d":
+        products.pop(key, None)
+    return key
@@ -0,0 +1,96 @@
+import threading
+from uuid import UUID
+
+from models import CATEGORIES
+
+PRODUCT_FIELDS = ("id", "name", "description", "price", "quantity", "category")
+
+# Category names by code, the predefined CATEGORIES first. Other names, e.g. from snapshots of older
+# versions that accepted any category in updates, are appended.
+_category_names = list(CATEGORIES)
+_category_codes = {name: code for code, name in enumerate(_category_names)}
+_category_lock = threading.Lock()
+
+
+def category_code(name, create=True):
+    """
+    Return the small integer a category name is stored as, or None for unknown
+    names when create is False
+    """
+    code = _category_codes.get(name)
+    if code is None and create:
+        with _category_lock:
+            code = _category_codes.get(name)
+            if code is None:
+                _category_names.append(name)
+                code = _category_codes[name] = len(_category_names) - 1
+    return code
+
+
+def category_names():
+    """
+    Return a copy of the category table, names by code
+    """
+    with _category_lock:
+        return list(_category_names)
+
+
+def product_key(product_id):
+    """
+    Return the 16-byte key of a product ID, or None if it is not a UUID in canonical form
+    """
+    if isinstance(product_id, UUID):
+        return product_id.bytes
+    try:
+        key = UUID(product_id)
+    except (TypeError, ValueError, AttributeError):
+        return None
+    return key.bytes if str(key) == product_id else None
+
+
+class ProductRecord:
+    """
+    Compact in-memory product. Slots instead of a dict, the UUID as 16 bytes and the
+    category as a code of the shared category table. Turned back into the JSON shape
+    of Product only when a response needs it.
+    """
+
+    __slots__ = ("key", "name", "description", "price", "quantity", "category")
+
+    def __init__(self, key, name, description, price, quantity, category):
+        self.key = key
+        self.name = name
+        self.description = description
+        self.price = price
+        self.quantity = quantity
+        self.category = category
+
+    @classmethod
+    def from_product(cls, product):
+        """
+        Build a record from a validated product dict
+        """
+        return cls(product_key(product["id"]), product["name"], product["description"], product["price"],
+                   product["quantity"], category_code(product["category"]))
+
+    def changes(self, fields):
+        """
+        Return the stored values of the given fields that differ from the record
+        """
+        changes = {}
+        for field, value in fields.items():
+            if field == "category":
+                value = category_code(value)
+            if field in self.__slots__ and field != "key" and getattr(self, field) != value:
+                changes[field] = value
+        return changes
+
+    def to_dict(self):
+        return {
+            "id": str(UUID(bytes=self.key)),
+            "name": self.name,
+            "description": self.description,
+            "price": self.price,
+            "quantity": self.quantity,
+            "category": _category_names[self.category],
+        }
@@ -0,0 +1,90 @@
+import hashlib
+import threading
+from collections import OrderedDict
+from urllib.parse import urlencode
+
+from flask import current_app, request
+from metrics import timed
+
+try:
+    import orjson  # Optional, serializes large product lists several times faster
+except ImportError:
+    orjson = None
+
+DEFAULT_CACHE_CONFIG = {
+    "RESPONSE_CACHE_SIZE": 1024,  # Serialized GET responses kept, 0 disables the cache
+}
+
+
+def dumps(payload):
+    """
+    Serialize a response payload to JSON bytes, as jsonify would
+    """
+    with timed("serialization"):
+        if orjson is not None:
+            return orjson.dumps(payload, option=orjson.OPT_SORT_KEYS) + b"\n"
+        return (current_app.json.dumps(payload, separators=(",", ":")) + "\n").encode()
+
+
+class ResponseCache:
+    """
+    Serialized JSON responses of GET requests, valid for one version of the product store.
+    Any write bumps the store version, which invalidates every entry made before it.
+    The least recently used entries are dropped beyond max_entries.
+    """
+
+    def __init__(self, max_entries=1024):
+        self.max_entries = max_entries
+        self.entries = OrderedDict()  # key -> (store version, status, body, etag)
+        self.lock = threading.Lock()
+
+    def get(self, key, version):
+        with self.lock:
+            entry = self.entries.get(key)
+            if entry is None:
+                return None
+            if entry[0] != version:
+                del self.entries[key]
+                return None
+            self.entries.move_to_end(key)
+            return entry
+
+    def put(self, key, entry):
+        if self.max_entries <= 0:
+            return
+        with self.lock:
+            self.entries[key] = entry
+            self.entries.move_to_end(key)
+            while len(self.entries) > self.max_entries:
+                self.entries.popitem(last=False)
+
+
+def cached_json_response(store, build):
+    """
+    Answer a GET request from the response cache, building it on a miss.
+    The ETag is a hash of the body, so polls whose If-None-Match still matches get an
+    empty 304 Not Modified.
+    Args:
+        store: Product store whose version the cached response depends on.
+        build (callable): Returns (payload, status) of the response.
+    Returns:
+        Response: JSON response with an ETag, or 304.
+    """
+    cache = current_app.extensions["response_cache"]
+    key = request.path + "?" + urlencode(sorted(request.args.items(multi=True)))
+    # The version is read before building, so a concurrent write can only make the entry fresher than its version
+    version = store.version()
+    entry = cache.get(key, version)
+    if entry is None:
+        payload, status = build()
+        body = dumps(payload)
+        entry = (version, status, body, hashlib.blake2b(body, digest_size=8).hexdigest())
+        if status == 200:
+            cache.put(key, entry)
+
+    _, status, body, etag = entry
+    response = current_app.response_class(body, status=status, mimetype="application/json")
+    if status == 200:
+        response.set_etag(etag)
+        response = response.make_conditional(request)
+    return response
@@ -1,6 +1,10 @@
 from flask import Blueprint, jsonify, request
-from models import products, product_lock, validate_product_update
-from utils import validate_product_data
+from models import validate_product_update
+from store import get_product_store
+from responses import cached_json_response
+from indexes import encode_cursor
+from metrics import timed
+from utils import parse_product_query, parse_search_query, validate_product_data
 from pydantic import ValidationError
 from uuid import UUID
 import logging
@@ -27,7 +31,8 @@ def create_product():
     Create a new product
     """
     data = request.json
-    validation_result = validate_product_data(data)
+    with timed("validation"):
+        validation_result = validate_product_data(data)
     if isinstance(validation_result, str):
         return jsonify(format_response(
             message="Validation failed",
@@ -35,13 +40,11 @@ def create_product():
         )), 400
 
     product = validation_result.model_dump()
-    with product_lock:
-        if str(product["id"]) in products:
-            return jsonify(format_response(
-                message="Conflict",
-                error=f"Product with ID {product['id']} already exists"
-            )), 409
-        products[str(product["id"])] = product
+    if not get_product_store().create(product):
+        return jsonify(format_response(
+            message="Conflict",
+            error=f"Product with ID {product['id']} already exists"
+        )), 409
     logger.info(f"Product {product['id']} created successfully.")
     return jsonify(format_response(
         message="Product created successfully",
@@ -53,15 +56,57 @@ def create_product():
 @products_bp.route("/", methods=["GET"])
 def get_all_products():
     """
-    Retrieve all products
+    Retrieve products, optionally filtered, sorted and paginated
     """
-    with product_lock:
-        all_products = list(products.values())
-    return jsonify(format_response(
-        message="Retrieved all products successfully",
-        data={"products": all_products},
-        error=None
-    )), 200
+    query = parse_product_query(request.args)
+    if isinstance(query, str):
+        return jsonify(format_response(
+            message="Validation failed",
+            error=query
+        )), 400
+
+    store = get_product_store()
+
+    def build():
+        page, next_entry = store.query(**query)
+        next_cursor = encode_cursor(request.args.get("sort", "id"), next_entry) if next_entry else None
+        return format_response(
+            message="Retrieved all products successfully",
+            data={"products": page, "next_cursor": next_cursor},
+            error=None
+        ), 200
+
+    return cached_json_response(store, build)
+
+
+@products_bp.route("/search", methods=["GET"])
+def search_products():
+    """
+    Full-text search over product names and descriptions, optionally within a category
+    """
+    query = parse_search_query(request.args)
+    if isinstance(query, str):
+        return jsonify(format_response(
+            message="Validation failed",
+            error=query
+        )), 400
+
+    store = get_product_store()
+    if not store.searchable:
+        return jsonify(format_response(
+            message="Search is disabled",
+            error="Full-text search is disabled, set PRODUCT_SEARCH"
+        )), 404
+
+    def build():
+        page, total = store.search(**query)
+        return format_response(
+            message="Search completed successfully",
+            data={"products": page, "total": total},
+            error=None
+        ), 200
+
+    return cached_json_response(store, build)
 
 
 @products_bp.route("/<product_id>", methods=["GET"])
@@ -70,19 +115,23 @@ def get_product(product_id):
     """
     Retrieve a specific product by ID
     """
-    with product_lock:
-        product = products.get(product_id)
-    if not product:
-        logger.warning(f"Product ID {product_id} not found.")
-        return jsonify(format_response(
-            message="Product not found",
-            error=f"No product found with ID {product_id}"
-        )), 404
-    return jsonify(format_response(
-        message="Product retrieved successfully",
-        data=product,
-        error=None
-    )), 200
+    store = get_product_store()
+
+    def build():
+        product = store.get(product_id)
+        if not product:
+            logger.warning(f"Product ID {product_id} not found.")
+            return format_response(
+                message="Product not found",
+                error=f"No product found with ID {product_id}"
+            ), 404
+        return format_response(
+            message="Product retrieved successfully",
+            data=product,
+            error=None
+        ), 200
+
+    return cached_json_response(store, build)
 
 
 @products_bp.route("/<product_id>", methods=["PUT"])
@@ -104,7 +153,8 @@ def update_product(product_id):
     # Parse and validate the JSON payload
     data = request.json
     try:
-        validation_result = validate_product_update(data)  # Use partial update schema
+        with timed("validation"):
+            validation_result = validate_product_update(data)  # Use partial update schema
     except ValidationError as e:
         logger.warning(f"Validation error for product update: {str(e)}")
         return jsonify(format_response(
@@ -112,24 +162,21 @@ def update_product(product_id):
             error=str(e)
         )), 400
 
-    product_updates = validation_result.dict(exclude_unset=True)  # Allow partial updates
+    product_updates = validation_result.dict(exclude_unset=True, exclude_none=True)  # Allow partial updates, null leaves a field unchanged
 
-    # Lock and update the product
-    with product_lock:
-        if product_id not in products:
-            logger.warning(f"Product ID {product_id} not found.")
-            return jsonify(format_response(
-                message="Product not found",
-                error=f"No product found with ID {product_id}"
-            )), 404
-
-        # Update only the provided fields
-        products[product_id].update(product_updates)
+    # Update only the provided fields
+    product = get_product_store().update(product_id, product_updates)
+    if product is None:
+        logger.warning(f"Product ID {product_id} not found.")
+        return jsonify(format_response(
+            message="Product not found",
+            error=f"No product found with ID {product_id}"
+        )), 404
 
     logger.info(f"Product {product_id} updated successfully.")
     return jsonify(format_response(
         message="Product updated successfully",
-        data=products[product_id],
+        data=product,
         error=None
     )), 200
 
@@ -140,14 +187,12 @@ def delete_product(product_id):
     """
     Delete a specific product
     """
-    with product_lock:
-        if product_id not in products:
-            logger.warning(f"Product ID {product_id} not found.")
-            return jsonify(format_response(
-                message="Product not found",
-                error=f"No product found with ID {product_id}"
-            )), 404
-        del products[product_id]
+    if not get_product_store().delete(product_id):
+        logger.warning(f"Product ID {product_id} not found.")
+        return jsonify(format_response(
+            message="Product not found",
+            error=f"No product found with ID {product_id}"
+        )), 404
     logger.info(f"Product {product_id} deleted successfully.")
     return jsonify(format_response(
         message="Product deleted successfully",
@@ -0,0 +1,244 @@
+import re
+import math
+import heapq
+from array import array
+from itertools import compress
+from bisect import bisect_left, insort
+
+FIELD_WEIGHTS = {"name": 2, "description": 1}  # A term in the name counts twice as much as one in the description
+PREFIX_WEIGHT = 0.5  # Score of a term that only starts with a query term, relative to an exact match
+MAX_QUERY_TERMS = 8
+
+_TOKEN = re.compile(r"\w+")
+
+
+def tokenize(text):
+    """
+    Split text into lowercase word terms
+    """
+    return _TOKEN.findall(text.lower())
+
+
+class SearchIndex:
+    """
+    Inverted index over the name and description of product records.
+    Each term maps to the keys of the products containing it and a field-weighted count,
+    and a sorted list of all terms finds every term starting with a query term. A search
+    only visits the postings of the terms it matches, not the catalogue.
+    Most terms, such as numbers, occur in a single product; their posting is kept as a
+    (key, weight) tuple instead of a dict, which takes a fraction of the memory.
+    """
+
+    def __init__(self):
+        self.postings = {}  # term -> {16-byte key: weight}, or (key, weight) for a single product
+        self.terms = []  # Sorted vocabulary, for prefix matching
+
+    @staticmethod
+    def _weights(record):
+        weights = {}
+        for field, weight in FIELD_WEIGHTS.items():
+            for term in _TOKEN.findall(getattr(record, field).lower()):
+                weights[term] = weights.get(term, 0) + weight
+        return weights
+
+    def add(self, record):
+        self.add_many([record])
+
+    def add_many(self, records):
+        """
+        Index a batch of records, adding their new terms to the vocabulary in one merge
+        """
+        new_terms = []
+        all_postings, weights_of = self.postings, self._weights
+        for record in records:
+            key = record.key
+            for term, weight in weights_of(record).items():
+                postings = all_postings.get(term)
+                if postings is None:
+                    all_postings[term] = (key, weight)
+                    new_terms.append(term)
+                elif type(postings) is tuple:
+                    all_postings[term] = {postings[0]: postings[1], key: weight}
+                else:
+                    postings[key] = weight
+        if len(new_terms) <= 2:
+            for term in new_terms:
+                insort(self.terms, term)
+            return
+        # Many new terms are merged in with one copy of the vocabulary, instead of shifting it once per term
+        new_terms.sort()
+        merged, start = [], 0
+        for term in new_terms:
+            position = bisect_left(self.terms, term, start)
+            merged += self.terms[start:position]
+            merged.append(term)
+            start = position
+        merged += self.terms[start:]
+        self.terms = merged
+
+    def remove(self, record):
+        for term in self._weights(record):
+            postings = self.postings[term]
+            if type(postings) is tuple:
+                del self.postings[term]
+                del self.terms[bisect_left(self.terms, term)]
+                continue
+            del postings[record.key]
+            if len(postings) == 1:
+                self.postings[term] = next(iter(postings.items()))
+
+    def remove_many(self, records):
+        """
+        Remove a batch of records, dropping their unused terms from the vocabulary in one pass
+        """
+        dropped = set()
+        for record in records:
+            for term in self._weights(record):
+                postings = self.postings[term]
+                if type(postings) is tuple:
+                    del self.postings[term]
+                    dropped.add(term)
+                    continue
+                del postings[record.key]
+                if len(postings) == 1:
+                    self.postings[term] = next(iter(postings.items()))
+        if dropped:
+            self.terms = [term for term in self.terms if term not in dropped]
+
+    def clear(self):
+        self.postings.clear()
+        self.terms.clear()
+
+    def copy(self):
+        """
+        Return a copy that later writes to this index leave unchanged, e.g. to write a snapshot from
+        """
+        index = SearchIndex()
+        index.postings = dict(self.postings)
+        for term, postings in index.postings.items():
+            if type(postings) is dict:
+                index.postings[term] = postings.copy()
+        index.terms = list(self.terms)
+        return index
+
+    def columns(self, positions):
+        """
+        Flatten the index into columns for a snapshot. The postings of single-product terms
+        come first, so load_columns can rebuild them without a loop per term.
+        Args:
+            positions (dict): Position of each product key in the snapshot.
+        Returns:
+            tuple: (sorted terms, number of products of each term, product positions, weights).
+        """
+        counts, product_positions, weights = array("I"), array("I"), array("I")
+        for term in self.terms:
+            postings = self.postings[term]
+            if type(postings) is tuple:
+                counts.append(1)
+                product_positions.append(positions[postings[0]])
+                weights.append(postings[1])
+            else:
+                counts.append(len(postings))
+        for term in self.terms:
+            postings = self.postings[term]
+            if type(postings) is not tuple:
+                product_positions.extend(map(positions.__getitem__, postings))
+                weights.extend(postings.values())
+        return self.terms, counts, product_positions, weights
+
+    def load_columns(self, keys, terms, counts, positions, weights):
+        """
+        Fill an empty index from the columns made by columns().
+        Args:
+            keys (list): Product key at each position of the snapshot.
+        """
+        single = [count == 1 for count in counts]
+        start = sum(single)
+        self.postings = dict(zip(compress(terms, single),
+                                 zip(map(keys.__getitem__, positions[:start]), weights[:start])))
+        for term, count in zip(terms, counts):
+            if count > 1:
+                self.postings[term] = dict(zip(map(keys.__getitem__, positions[start:start + count]),
+                                               weights[start:start + count]))
+                start += count
+        self.terms = terms
+
+    def _entries(self, term):
+        """
+        Return the postings of a term as a dict of weights by key
+        """
+        postings = self.postings[term]
+        return dict((postings,)) if type(postings) is tuple else postings
+
+    def _expand(self, term):
+        """
+        Return the terms of the vocabulary starting with term
+        """
+        position = bisect_left(self.terms, term)
+        matches = []
+        while position < len(self.terms) and self.terms[position].startswith(term):
+            matches.append(self.terms[position])
+            position += 1
+        return matches
+
+    def search(self, records, text, category=None, limit=20, offset=0):
+        """
+        Find the products matching every term of a query, best first.
+        Each query term matches the terms it is a prefix of; a product scores the weight of
+        its best matching term times its inverse document frequency, halved for prefix-only
+        matches, summed over the query terms.
+        Args:
+            records (dict): Product records by key, as indexed.
+            text (str): Query text.
+            category (int): Only products with this category code.
+            limit (int): Page size.
+            offset (int): Matches to skip.
+        Returns:
+            tuple: (records of the page, number of matches).
+        """
+        query = list(dict.fromkeys(tokenize(text)))[:MAX_QUERY_TERMS]
+        if not query:
+            return [], 0
+        expansions = []
+        for term in query:
+            matches = [(match, self._entries(match)) for match in self._expand(term)]
+            if not matches:
+                return [], 0
+            expansions.append((sum(len(postings) for _, postings in matches), term, matches))
+        # The rarest query term gives the candidates, the others are looked up per candidate when that is cheaper
+        expansions.sort()
+        count = len(records) or 1
+
+        scores = None
+        for size, term, matches in expansions:
+            weighted = [(postings, math.log(1 + count / len(postings)) * (1.0 if match == term else PREFIX_WEIGHT))
+                        for match, postings in matches]
+            if scores is None:
+                scores = self._score(weighted)
+                if category is not None:
+                    scores = {key: score for key, score in scores.items() if records[key].category == category}
+            elif len(scores) * len(weighted) < size:
+                probed = {}
+                for key, score in scores.items():
+                    best = max((postings.get(key, 0) * factor for postings, factor in weighted), default=0)
+                    if best:
+                        probed[key] = score + best
+                scores = probed
+            else:
+                term_scores = self._score(weighted)
+                scores = {key: score + term_scores[key] for key, score in scores.items() if key in term_scores}
+            if not scores:
+                return [], 0
+
+        page = heapq.nsmallest(offset + limit, scores.items(), key=lambda item: (-item[1], item[0]))[offset:]
+        return [records[key] for key, _ in page], len(scores)
+
+    @staticmethod
+    def _score(weighted):
+        scores = {}
+        for postings, factor in weighted:
+            for key, weight in postings.items():
+                score = weight * factor
+                if score > scores.get(key, 0):
+                    scores[key] = score
+        return scores
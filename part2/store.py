@@ -0,0 +1,557 @@
+import os
+import time
+import sqlite3
+import threading
+from contextlib import contextmanager
+
+from flask import current_app
+from indexes import ProductIndex
+from persistence import ProductPersistence
+from records import PRODUCT_FIELDS, ProductRecord, category_code, product_key
+from search import MAX_QUERY_TERMS, FIELD_WEIGHTS, SearchIndex, tokenize
+
+DEFAULT_STORE_CONFIG = {
+    "PRODUCT_STORE": "memory",  # "memory" for one process, "sqlite" to share products between gunicorn workers
+    "PRODUCT_DB_PATH": "products.db",  # SQLite database file of the "sqlite" store
+    "PRODUCT_DATA_DIR": None,  # Folder of the write-ahead log and snapshots of the "memory" store, None keeps it in memory only
+    "PRODUCT_SNAPSHOT_INTERVAL": 300,  # Seconds between snapshots of the "memory" store, 0 disables them
+    "PRODUCT_FSYNC": True,  # fsync the write-ahead log before acknowledging writes
+    "PRODUCT_SEARCH": False,  # Keep a full-text search index in the "memory" store, about 430 bytes more per product
+}
+
+INDEXED_FIELDS = ("price", "quantity", "category")
+SEARCHED_FIELDS = ("name", "description")
+
+
+class RWLock:
+    """
+    Reader-writer lock: any number of readers, or a single writer.
+    Writers are preferred, new readers wait while a writer is waiting so writes are not starved.
+    """
+
+    def __init__(self):
+        self._condition = threading.Condition(threading.Lock())
+        self._readers = 0
+        self._writer = False
+        self._waiting_writers = 0
+        self.observe = None  # Optional callback(mode, wait seconds, hold seconds), set by metrics
+
+    @contextmanager
+    def read(self):
+        observe = self.observe
+        start = time.perf_counter() if observe else 0
+        with self._condition:
+            while self._writer or self._waiting_writers:
+                self._condition.wait()
+            self._readers += 1
+        acquired = time.perf_counter() if observe else 0
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._readers -= 1
+                if not self._readers:
+                    self._condition.notify_all()
+            if observe:
+                observe("read", acquired - start, time.perf_counter() - acquired)
+
+    @contextmanager
+    def write(self):
+        observe = self.observe
+        start = time.perf_counter() if observe else 0
+        with self._condition:
+            self._waiting_writers += 1
+            while self._writer or self._readers:
+                self._condition.wait()
+            self._waiting_writers -= 1
+            self._writer = True
+        acquired = time.perf_counter() if observe else 0
+        try:
+            yield
+        finally:
+            with self._condition:
+                self._writer = False
+                self._condition.notify_all()
+            if observe:
+                observe("write", acquired - start, time.perf_counter() - acquired)
+
+
+class MemoryProductStore:
+    """
+    Products kept as compact records in a dict of this process, with their secondary indexes
+    and a full-text search index.
+    Records are keyed by the 16 bytes of their UUID and only turned into product dicts
+    when read. Reads share a reader-writer lock and do not block each other, writes are
+    exclusive. Every method returns dicts built under the lock, so a response reflects
+    one consistent state of the store even if a write follows right after.
+    With persistence, the store is recovered from disk on creation, and writes are
+    logged under the lock and acknowledged once their log records are on disk. Writes are
+    visible to reads from the moment the lock is released, while their records are still
+    being flushed. If the log fails, every write that is not on disk yet is rolled back.
+    The search index is optional, as it takes more memory than the records themselves.
+    """
+
+    def __init__(self, persistence=None, search=False):
+        self.products = {}  # 16-byte key -> ProductRecord
+        self.index = ProductIndex()
+        self.search_index = SearchIndex() if search else None
+        self.searchable = search
+        self.lock = RWLock()
+        self._version = 0
+        self.persistence = persistence
+        self._pending = {}  # Ticket -> undo steps of the writes not known to be on disk, in log order
+        self._pending_lock = threading.Lock()
+        if persistence is not None:
+            persistence.recover(self)
+            persistence.start(self)
+
+    def _log(self, operations, undo):
+        """
+        Log the operations of a write, called under the write lock. undo lists the steps
+        reverting the write, run if the log fails before the write is on disk.
+        """
+        if self.persistence is None or not operations:
+            return None
+        try:
+            ticket = self.persistence.log(operations)
+        except OSError:
+            self._undo(undo)
+            raise
+        with self._pending_lock:
+            self._pending[ticket] = undo
+        return ticket
+
+    def _wait(self, ticket):
+        if ticket is None:
+            return
+        try:
+            self.persistence.wait(ticket)
+        except OSError:
+            self._roll_back()
+            raise
+        with self._pending_lock:
+            self._pending.pop(ticket, None)
+
+    def _roll_back(self):
+        """
+        Revert the writes whose log records never reached the disk, newest first
+        """
+        with self.lock.write():
+            with self._pending_lock:
+                failed = [ticket for ticket in self._pending if not self.persistence.durable(ticket)]
+                undos = [self._pending.pop(ticket) for ticket in failed]
+            for undo in reversed(undos):
+                self._undo(undo)
+            if undos:
+                self._version += 1
+
+    def _undo(self, undo):
+        """
+        Apply the undo steps of a write in reverse, called under the write lock
+        """
+        search_index = self.search_index
+        for step in reversed(undo):
+            record = step[1]
+            if step[0] != "insert":
+                self.index.remove(record)
+                if search_index is not None:
+                    search_index.remove(record)
+            if step[0] == "remove":
+                del self.products[record.key]
+                continue
+            if step[0] == "insert":
+                self.products[record.key] = record
+            else:
+                for field, value in step[2].items():
+                    setattr(record, field, value)
+            self.index.add(record)
+            if search_index is not None:
+                search_index.add(record)
+
+    def version(self):
+        """
+        Return a counter that every write changing products increases
+        """
+        return self._version
+
+    def count(self):
+        """
+        Return the number of products
+        """
+        return len(self.products)
+
+    def create(self, product):
+        """
+        Add a product, returns False if its ID already exists
+        """
+        return self.create_many([product])[0]
+
+    def create_many(self, products):
+        """
+        Add products under one write lock, returns for each whether it was added
+        """
+        records = [ProductRecord.from_product(product) for product in products]
+        created, added = [], []
+        with self.lock.write():
+            for record in records:
+                created.append(record.key not in self.products)
+                if created[-1]:
+                    self.products[record.key] = record
+                    added.append(record)
+            self.index.add_many(added)
+            if self.search_index is not None:
+                self.search_index.add_many(added)
+            if added:
+                self._version += 1
+            ticket = self._log([["c", record.to_dict()] for record in added], [("remove", record) for record in added])
+        self._wait(ticket)
+        return created
+
+    def get(self, product_id):
+        """
+        Return a product, or None if it does not exist
+        """
+        with self.lock.read():
+            record = self.products.get(product_key(product_id))
+            return record.to_dict() if record else None
+
+    def update(self, product_id, updates):
+        """
+        Update only the given fields of a product.
+        Returns the updated product, or None if it does not exist.
+        """
+        return self.update_many([(product_id, updates)])[0]
+
+    def update_many(self, updates):
+        """
+        Apply (product ID, fields) updates under one write lock.
+        Returns the updated products, None for IDs that do not exist.
+        """
+        updated, operations, undo = [], [], []
+        with self.lock.write():
+            for product_id, fields in updates:
+                record = self.products.get(product_key(product_id))
+                if record is None:
+                    updated.append(None)
+                    continue
+                changes = record.changes(fields)
+                if changes:
+                    operations.append(["u", product_id, {field: fields[field] for field in changes}])
+                    undo.append(("set", record, {field: getattr(record, field) for field in changes}))
+                reindex = any(field in changes for field in INDEXED_FIELDS)
+                research = self.search_index is not None and any(field in changes for field in SEARCHED_FIELDS)
+                if reindex:
+                    self.index.remove(record)
+                if research:
+                    self.search_index.remove(record)
+                for field, value in changes.items():
+                    setattr(record, field, value)
+                if reindex:
+                    self.index.add(record)
+                if research:
+                    self.search_index.add(record)
+                if changes:
+                    self._version += 1
+                updated.append(record.to_dict())
+            ticket = self._log(operations, undo)
+        self._wait(ticket)
+        return updated
+
+    def delete(self, product_id):
+        """
+        Delete a product, returns False if it does not exist
+        """
+        return self.delete_many([product_id])[0]
+
+    def delete_many(self, product_ids):
+        """
+        Delete products under one write lock, returns for each whether it existed
+        """
+        deleted, undo = [], []
+        with self.lock.write():
+            for product_id in product_ids:
+                record = self.products.pop(product_key(product_id), None)
+                deleted.append(record is not None)
+                if record is not None:
+                    self.index.remove(record)
+                    if self.search_index is not None:
+                        self.search_index.remove(record)
+                    undo.append(("insert", record))
+            if any(deleted):
+                self._version += 1
+            operations = [["d", product_id] for product_id, existed in zip(product_ids, deleted) if existed]
+            ticket = self._log(operations, undo)
+        self._wait(ticket)
+        return deleted
+
+    def query(self, category=None, **query):
+        """
+        Return a page of products and the (value, id) cursor of the next one, see ProductIndex.query
+        """
+        code = category_code(category, create=False) if category is not None else None
+        if category is not None and code is None:
+            return [], None
+        with self.lock.read():
+            page, next_entry = self.index.query(self.products, category=code, **query)
+            return [record.to_dict() for record in page], next_entry
+
+    def search(self, text, category=None, limit=20, offset=0):
+        """
+        Return a page of the products matching a full-text query, best first, and the number of matches.
+        Only for stores created with search.
+        """
+        code = category_code(category, create=False) if category is not None else None
+        if category is not None and code is None:
+            return [], 0
+        with self.lock.read():
+            page, total = self.search_index.search(self.products, text, category=code, limit=limit, offset=offset)
+            return [record.to_dict() for record in page], total
+
+
+class SQLiteProductStore:
+    """
+    Products kept in a SQLite database in WAL mode, shared by every process that opens the file.
+    WAL lets readers run alongside the single writer, so gunicorn can run several worker
+    processes on one catalogue. Each thread of each process has its own connection, and
+    filters, sorting and pagination run on indexes of the table. Full-text search runs on
+    an FTS5 index of name and description that triggers keep in step with the table.
+    """
+
+    searchable = True
+
+    def __init__(self, path):
+        self.path = path
+        self._local = threading.local()
+        self._pid = os.getpid()
+        with self._connection() as connection:
+            connection.executescript("""
+                CREATE TABLE IF NOT EXISTS products (
+                    id TEXT PRIMARY KEY,
+                    name TEXT NOT NULL,
+                    description TEXT NOT NULL,
+                    price REAL NOT NULL,
+                    quantity INTEGER NOT NULL,
+                    category TEXT NOT NULL
+                );
+                CREATE INDEX IF NOT EXISTS products_price ON products (price, id);
+                CREATE INDEX IF NOT EXISTS products_quantity ON products (quantity, id);
+                CREATE INDEX IF NOT EXISTS products_category_id ON products (category, id);
+                CREATE INDEX IF NOT EXISTS products_category_price ON products (category, price, id);
+                CREATE INDEX IF NOT EXISTS products_category_quantity ON products (category, quantity, id);
+                CREATE TABLE IF NOT EXISTS meta (key TEXT PRIMARY KEY, value INTEGER NOT NULL);
+                INSERT OR IGNORE INTO meta VALUES ('version', 0);
+            """)
+            indexed = connection.execute("SELECT 1 FROM sqlite_master WHERE name = 'products_fts'").fetchone()
+            connection.executescript("""
+                CREATE VIRTUAL TABLE IF NOT EXISTS products_fts USING fts5(
+                    name, description, content='products', content_rowid='rowid', prefix='2 3'
+                );
+                CREATE TRIGGER IF NOT EXISTS products_fts_insert AFTER INSERT ON products BEGIN
+                    INSERT INTO products_fts (rowid, name, description) VALUES (new.rowid, new.name, new.description);
+                END;
+                CREATE TRIGGER IF NOT EXISTS products_fts_delete AFTER DELETE ON products BEGIN
+                    INSERT INTO products_fts (products_fts, rowid, name, description)
+                    VALUES ('delete', old.rowid, old.name, old.description);
+                END;
+                CREATE TRIGGER IF NOT EXISTS products_fts_update AFTER UPDATE OF name, description ON products BEGIN
+                    INSERT INTO products_fts (products_fts, rowid, name, description)
+                    VALUES ('delete', old.rowid, old.name, old.description);
+                    INSERT INTO products_fts (rowid, name, description) VALUES (new.rowid, new.name, new.description);
+                END;
+            """)
+            # The index refers to products by rowid, which only a VACUUM would renumber and then needs a 'rebuild'
+            if not indexed:
+                # Databases created before search get their existing products indexed once
+                connection.execute("INSERT INTO products_fts (products_fts) VALUES ('rebuild')")
+
+    def _connection(self):
+        """
+        Return the connection of the calling thread, opening it on first use.
+        Connections inherited from a parent process are never reused after a fork.
+        """
+        if self._pid != os.getpid():
+            self._local = threading.local()
+            self._pid = os.getpid()
+        connection = getattr(self._local, "connection", None)
+        if connection is None:
+            connection = sqlite3.connect(self.path, timeout=30)
+            connection.row_factory = _product_from_row
+            connection.execute("PRAGMA journal_mode=WAL")
+            connection.execute("PRAGMA synchronous=NORMAL")
+            self._local.connection = connection
+        return connection
+
+    def version(self):
+        """
+        Return a counter that every write transaction changing products increases, in any process
+        """
+        cursor = self._connection().cursor()
+        cursor.row_factory = None
+        return cursor.execute("SELECT value FROM meta WHERE key = 'version'").fetchone()[0]
+
+    def count(self):
+        """
+        Return the number of products
+        """
+        cursor = self._connection().cursor()
+        cursor.row_factory = None
+        return cursor.execute("SELECT COUNT(*) FROM products").fetchone()[0]
+
+    def _bump_version(self, connection, changed):
+        if changed:
+            connection.execute("UPDATE meta SET value = value + 1 WHERE key = 'version'")
+
+    def create(self, product):
+        """
+        Add a product, returns False if its ID already exists
+        """
+        return self.create_many([product])[0]
+
+    def create_many(self, products):
+        """
+        Add products in one transaction, returns for each whether it was added
+        """
+        with self._connection() as connection:
+            created = [connection.execute("INSERT INTO products VALUES (?, ?, ?, ?, ?, ?) ON CONFLICT (id) DO NOTHING",
+                                          [str(product["id"])] + [product[field] for field in PRODUCT_FIELDS[1:]]
+                                          ).rowcount > 0
+                       for product in products]
+            self._bump_version(connection, any(created))
+        return created
+
+    def get(self, product_id):
+        """
+        Return a product, or None if it does not exist
+        """
+        return self._connection().execute("SELECT * FROM products WHERE id = ?", (product_id,)).fetchone()
+
+    def update(self, product_id, updates):
+        """
+        Update only the given fields of a product.
+        Returns the updated product, or None if it does not exist.
+        """
+        return self.update_many([(product_id, updates)])[0]
+
+    def update_many(self, updates):
+        """
+        Apply (product ID, fields) updates in one transaction.
+        Returns the updated products, None for IDs that do not exist.
+        """
+        updated = []
+        # Updates and the reads of their results are one transaction, no other write comes in between
+        with self._connection() as connection:
+            for product_id, fields in updates:
+                columns = [field for field in PRODUCT_FIELDS[1:] if field in fields]
+                if columns:
+                    assignments = ", ".join(f"{column} = ?" for column in columns)
+                    # Rows whose values do not change are left alone and do not bump the version
+                    changes = " OR ".join(f"{column} IS NOT ?" for column in columns)
+                    values = [fields[column] for column in columns]
+                    cursor = connection.execute(f"UPDATE products SET {assignments} WHERE id = ? AND ({changes})",
+                                                values + [product_id] + values)
+                    self._bump_version(connection, cursor.rowcount > 0)
+                updated.append(connection.execute("SELECT * FROM products WHERE id = ?", (product_id,)).fetchone())
+        return updated
+
+    def delete(self, product_id):
+        """
+        Delete a product, returns False if it does not exist
+        """
+        return self.delete_many([product_id])[0]
+
+    def delete_many(self, product_ids):
+        """
+        Delete products in one transaction, returns for each whether it existed
+        """
+        with self._connection() as connection:
+            deleted = [connection.execute("DELETE FROM products WHERE id = ?", (product_id,)).rowcount > 0
+                       for product_id in product_ids]
+            self._bump_version(connection, any(deleted))
+        return deleted
+
+    def query(self, category=None, ranges=None, sort="id", descending=False, limit=None, cursor=None):
+        """
+        Return a page of products and the (value, id) cursor of the next one, see ProductIndex.query
+        """
+        conditions, parameters = [], []
+        if category is not None:
+            conditions.append("category = ?")
+            parameters.append(category)
+        for field, (low, high) in (ranges or {}).items():
+            if low is not None:
+                conditions.append(f"{field} >= ?")
+                parameters.append(low)
+            if high is not None:
+                conditions.append(f"{field} <= ?")
+                parameters.append(high)
+        if cursor is not None:
+            conditions.append(f"({sort}, id) {'<' if descending else '>'} (?, ?)")
+            parameters.extend(cursor)
+
+        order = "DESC" if descending else "ASC"
+        statement = "SELECT * FROM products"
+        if conditions:
+            statement += " WHERE " + " AND ".join(conditions)
+        statement += f" ORDER BY {sort} {order}, id {order}"
+        if limit is not None:
+            # One more row tells whether there is a next page
+            statement += " LIMIT ?"
+            parameters.append(limit + 1)
+
+        page = self._connection().execute(statement, parameters).fetchall()
+        if limit is None or len(page) <= limit:
+            return page, None
+        page = page[:limit]
+        return page, (page[-1][sort], page[-1]["id"])
+
+    def search(self, text, category=None, limit=20, offset=0):
+        """
+        Return a page of the products matching a full-text query, best first by BM25, and the number of matches
+        """
+        terms = list(dict.fromkeys(tokenize(text)))[:MAX_QUERY_TERMS]
+        if not terms:
+            return [], 0
+        # Every term is quoted and matches as a prefix, so query text cannot inject FTS5 syntax
+        conditions, parameters = ["products_fts MATCH ?"], [" ".join(f'"{term}"*' for term in terms)]
+        if category is not None:
+            conditions.append("p.category = ?")
+            parameters.append(category)
+        where = " AND ".join(conditions)
+        weights = ", ".join(str(float(weight)) for weight in FIELD_WEIGHTS.values())
+
+        connection = self._connection()
+        page = connection.execute(f"SELECT p.* FROM products_fts JOIN products p ON p.rowid = products_fts.rowid "
+                                  f"WHERE {where} ORDER BY bm25(products_fts, {weights}), p.id LIMIT ? OFFSET ?",
+                                  parameters + [limit, offset]).fetchall()
+        cursor = connection.cursor()
+        cursor.row_factory = None
+        total = cursor.execute(f"SELECT COUNT(*) FROM products_fts JOIN products p ON p.rowid = products_fts.rowid "
+                               f"WHERE {where}", parameters).fetchone()[0]
+        return page, total
+
+
+def _product_from_row(cursor, row):
+    return dict(zip(PRODUCT_FIELDS, row))
+
+
+def create_product_store(config):
+    """
+    Create the product store selected by PRODUCT_STORE in an app config
+    """
+    config = {**DEFAULT_STORE_CONFIG, **config}
+    if config["PRODUCT_STORE"] == "memory":
+        persistence = None
+        if config["PRODUCT_DATA_DIR"]:
+            persistence = ProductPersistence(config["PRODUCT_DATA_DIR"], config["PRODUCT_SNAPSHOT_INTERVAL"],
+                                             config["PRODUCT_FSYNC"])
+        return MemoryProductStore(persistence, config["PRODUCT_SEARCH"])
+    if config["PRODUCT_STORE"] == "sqlite":
+        return SQLiteProductStore(config["PRODUCT_DB_PATH"])
+    raise ValueError(f"Unknown PRODUCT_STORE {config['PRODUCT_STORE']!r}, expected 'memory' or 'sqlite'")
+
+
+def get_product_store():
+    """
+    Return the product store of the current app
+    """
+    return current_app.extensions["product_store"]
@@ -1,8 +1,11 @@
 import logging
 
 from models import Product
+from indexes import MAX_PAGE_SIZE, SORT_FIELDS, decode_cursor
 from pydantic import ValidationError
 
+DEFAULT_SEARCH_LIMIT = 20
+
 
 def setup_logger(name, level=logging.INFO):
     """Set up a logger."""
@@ -29,3 +32,70 @@ def validate_product_data(data):
         return Product(**data)
     except ValidationError as e:
         return str(e)
+
+
+def parse_product_query(args):
+    """
+    Parse the filter, sort and pagination parameters of GET /products.
+    Args:
+        args (MultiDict): Query string arguments.
+    Returns:
+        dict: Keyword arguments of ProductIndex.query, or an error message.
+    """
+    query = {"category": args.get("category") or None, "ranges": {}}
+    for field, cast in (("price", float), ("quantity", int)):
+        bounds = []
+        for name in (f"min_{field}", f"max_{field}"):
+            value = args.get(name)
+            try:
+                bounds.append(cast(value) if value is not None else None)
+            except ValueError:
+                return f"{name} must be a {'number' if cast is float else 'whole number'}"
+        if bounds != [None, None]:
+            query["ranges"][field] = tuple(bounds)
+
+    sort = args.get("sort", "id")
+    query["sort"] = sort.lstrip("-")
+    query["descending"] = sort.startswith("-")
+    if query["sort"] not in SORT_FIELDS:
+        return f"sort must be one of {', '.join(SORT_FIELDS)}, optionally prefixed with '-'"
+
+    limit = args.get("limit")
+    if limit is not None:
+        try:
+            query["limit"] = int(limit)
+        except ValueError:
+            return "limit must be a whole number"
+        if not 1 <= query["limit"] <= MAX_PAGE_SIZE:
+            return f"limit must be between 1 and {MAX_PAGE_SIZE}"
+
+    cursor = args.get("cursor")
+    if cursor:
+        try:
+            query["cursor"] = decode_cursor(cursor, sort)
+        except ValueError as e:
+            return str(e)
+    return query
+
+
+def parse_search_query(args):
+    """
+    Parse the parameters of GET /products/search.
+    Args:
+        args (MultiDict): Query string arguments.
+    Returns:
+        dict: Keyword arguments of the store's search, or an error message.
+    """
+    text = args.get("q", "").strip()
+    if not text:
+        return "q is required"
+    query = {"text": text, "category": args.get("category") or None}
+    for name, default, low, high in (("limit", DEFAULT_SEARCH_LIMIT, 1, MAX_PAGE_SIZE), ("offset", 0, 0, None)):
+        value = args.get(name)
+        try:
+            query[name] = int(value) if value is not None else default
+        except ValueError:
+            return f"{name} must be a whole number"
+        if query[name] < low or (high is not None and query[name] > high):
+            return f"{name} must be between {low} and {high}" if high is not None else f"{name} must be at least {low}"
+    return query
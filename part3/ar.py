@@ -1,21 +1,18 @@
-from drawing import draw_bounding_box, highlight_object
+from drawing import OverlayCompositor
+
+# Labels rendered by the AR overlay, also used as the detector's class allow-list
+TARGET_LABELS = ['person', 'train', 'fork']
+
+# Overlay buffers are reused from frame to frame
+compositor = OverlayCompositor()
 
 
 def process_frame(frame, detections):
     """
     Process a single frame with object detection results.
     """
-    for detection in detections:
-        bbox = detection["bbox"]
-        label = detection["label"]  # Already resolved by `get_label_from_id`
-        if not label in ['person', 'train', 'fork']: continue
-        confidence = detection["score"]
-
-        # Highlight detected object
-        highlight_object(frame, bbox)
-
-        # Draw bounding box and label
-        draw_bounding_box(frame, bbox, label, confidence)
+    # Labels are already resolved by `get_label_from_id`
+    detections = [detection for detection in detections if detection["label"] in TARGET_LABELS]
 
-    # Apply background blur
-    return frame
+    # Highlight detected objects, then draw bounding boxes and labels
+    return compositor.render(frame, detections)
@@ -1,4 +1,5 @@
 import cv2
+import numpy as np
 from utils import get_color_for_category, scale_font_size
 
 
@@ -35,3 +36,67 @@ def highlight_object(image, bbox, alpha=0.4):
 
     cv2.rectangle(overlay, (x1, y1), (x2, y2), color, -1)
     cv2.addWeighted(overlay, alpha, image, 1 - alpha, 0, image)
+
+
+class OverlayCompositor:
+    """
+    Render all detections of a frame with one highlight blend per pixel.
+    The union of the boxes is cut along the box edges into cells covered by the same
+    boxes, and every cell is blended once with the combined opacity of its overlapping
+    highlights, 1 - (1 - alpha) ** overlaps, which is what blending them one after
+    another gives. Pixels outside the boxes are not touched. The overlay color buffer
+    is kept between frames and only reallocated when the frame size changes.
+    """
+
+    def __init__(self, alpha=0.4):
+        self.alpha = alpha
+        self.overlay = None
+
+    def render(self, image, detections):
+        """
+        Highlight every detection, then draw all boxes and labels on top
+        """
+        if not detections:
+            return image
+        height, width = image.shape[:2]
+        color = get_color_for_category("highlight")
+        if self.overlay is None or self.overlay.shape != image.shape:
+            self.overlay = np.empty_like(image)
+            self.overlay[:] = color
+
+        # Boxes as half-open pixel ranges, clipped to the frame like cv2.rectangle does
+        boxes = []
+        for detection in detections:
+            x1, y1, x2, y2 = map(int, detection["bbox"])
+            x1, x2 = sorted((x1, x2))
+            y1, y2 = sorted((y1, y2))
+            x1, y1, x2, y2 = max(x1, 0), max(y1, 0), min(x2 + 1, width), min(y2 + 1, height)
+            if x1 < x2 and y1 < y2:
+                boxes.append((x1, y1, x2, y2))
+
+        if boxes:
+            xs = np.unique([coordinate for box in boxes for coordinate in (box[0], box[2])])
+            ys = np.unique([coordinate for box in boxes for coordinate in (box[1], box[3])])
+            overlaps = np.zeros((len(ys) - 1, len(xs) - 1), dtype=np.int32)
+            for x1, y1, x2, y2 in boxes:
+                overlaps[ys.searchsorted(y1):ys.searchsorted(y2), xs.searchsorted(x1):xs.searchsorted(x2)] += 1
+
+            for row, (top, bottom) in enumerate(zip(ys[:-1], ys[1:])):
+                column = 0
+                while column < len(xs) - 1:
+                    count = overlaps[row, column]
+                    end = column + 1
+                    # Neighbouring cells with the same overlap count are blended together
+                    while end < len(xs) - 1 and overlaps[row, end] == count:
+                        end += 1
+                    if count:
+                        left, right = xs[column], xs[end]
+                        opacity = 1 - (1 - self.alpha) ** count
+                        region = image[top:bottom, left:right]
+                        cv2.addWeighted(self.overlay[top:bottom, left:right], opacity,
+                                        region, 1 - opacity, 0, region)
+                    column = end
+
+        for detection in detections:
+            draw_bounding_box(image, detection["bbox"], detection["label"], detection["score"])
+        return image
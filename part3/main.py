@@ -1,35 +1,142 @@
 import cv2
+import json
+import time
+import logging
+import argparse
 from rcnn import RCNNDetector
-from ar import process_frame
+from ar import TARGET_LABELS, process_frame
+from tracking import ObjectTracker
+from pipeline import (DROP_POLICIES, ConcurrentPipeline, HeadlessPipeline, LatencyStats, VideoSink, format_summary,
+                      open_source)
+
+logger = logging.getLogger("part3")
+
+WINDOW_NAME = "AR Object Detection"
 
 
 def main():
+    # Parse Arguments
+    parser = argparse.ArgumentParser(description="Part 3: real-time object detection in AR")
+    parser.add_argument('--camera', type=int, default=0, help="Index of the camera to open")
+    parser.add_argument('--input', '-i',
+                        help="Video file, image folder, image glob or printf pattern (frames/%%05d.png) to process headless")
+    parser.add_argument('--output', '-o', help="Video file for the annotated frames in headless mode, omit to discard them")
+    parser.add_argument('--output-fps', type=float, help="Frame rate of the output video, that of the input by default")
+    parser.add_argument('--max-frames', type=int, help="Stop after this many frames in headless mode")
+    parser.add_argument('--stats-json', help="JSON file for the rates and stage timings of a headless run")
+    parser.add_argument('--device', '-d', choices=['cpu', 'cuda'], default='cuda', help="Device for PyTorch")
+    parser.add_argument('--conf-thresh', '-c', type=float, default=0.54, help="Confidence threshold for R-CNN")
+    parser.add_argument('--detect-every', type=int, default=1,
+                        help="Run the detector every N frames and track objects with optical flow in between")
+    parser.add_argument('--scene-change', type=float, default=0.1,
+                        help="Mean frame difference from the last detected frame (0-1) that runs the detector early, 0 for never")
+    parser.add_argument('--concurrent', action='store_true',
+                        help="Capture, detect and display on separate threads, displaying at the camera rate")
+    parser.add_argument('--drop-policy', choices=DROP_POLICIES, default='latest',
+                        help="Frames waiting for the detector in concurrent mode: keep only the latest, "
+                             "queue and drop the oldest, or queue and block the capture")
+    parser.add_argument('--queue-size', type=int, default=4,
+                        help="Queued frames of the drop-oldest and block policies, and between headless stages")
+    parser.add_argument('--report-every', type=float, default=5, help="Seconds between rate and latency reports, 0 for none")
+    args = parser.parse_args()
+    if args.concurrent and args.detect_every > 1 and args.drop_policy != 'block':
+        # The tracker needs consecutive frames, the other policies skip the frames the detector has no time for
+        parser.error("--detect-every above 1 with --concurrent needs --drop-policy block")
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(name)s - %(levelname)s - %(message)s')
+
     # Initialize R-CNN
-    detector = RCNNDetector(device='cuda', conf_thresh=0.54)
+    detector = RCNNDetector(device=args.device, conf_thresh=args.conf_thresh, classes=TARGET_LABELS)
+    if args.detect_every > 1:
+        detector = ObjectTracker(detector, detect_every=args.detect_every, scene_change=args.scene_change)
+
+    if args.input:
+        run_headless(args, detector)
+        return
 
     # Open the camera
-    cap = cv2.VideoCapture(0)
+    cap = cv2.VideoCapture(args.camera)
+
+    if args.concurrent:
+        pipeline = ConcurrentPipeline(cap, detector, process_frame, drop_policy=args.drop_policy,
+                                      queue_size=args.queue_size, report_every=args.report_every)
+        summary = pipeline.run(show)
+        logger.info(f"Finished: {format_summary(summary)}; dropped {summary['dropped']}")
+    else:
+        summary = run_sequential(cap, detector, args.report_every)
+        logger.info(f"Finished: {format_summary(summary)}")
+
+    cap.release()
+    cv2.destroyAllWindows()
+
 
+def run_headless(args, detector):
+    """
+    Process a recorded input without a display and report the timing of every stage
+    """
+    source = open_source(args.input)
+    sink = None
+    if args.output:
+        fps = args.output_fps or (source.get(cv2.CAP_PROP_FPS) if hasattr(source, "get") else 0) or 30
+        sink = VideoSink(args.output, fps)
+    pipeline = HeadlessPipeline(source, detector, process_frame, sink=sink, queue_size=args.queue_size,
+                                max_frames=args.max_frames, report_every=args.report_every)
+    summary = pipeline.run()
+    source.release()
+
+    frames = summary["rates"].get("frames", 0) * summary["seconds"]
+    logger.info(f"Processed {frames:.0f} frames in {summary['seconds']:.1f}s, "
+                f"{summary['rates'].get('frames', 0):.2f} FPS sustained")
+    for stage in ("capture", "predict", "draw", "encode", "end_to_end"):
+        values = summary["latency_ms"].get(stage)
+        if values:
+            logger.info(f"{stage:>10}: mean {values['mean']:7.1f} ms, p50 {values['p50']:7.1f} ms, "
+                        f"p90 {values['p90']:7.1f} ms, p99 {values['p99']:7.1f} ms")
+    if args.stats_json:
+        with open(args.stats_json, 'w') as f:
+            json.dump({"config": vars(args), **summary}, f, indent=4)
+        logger.info(f"Stats saved to {args.stats_json}")
+
+
+def show(image):
+    """
+    Display a frame, returns False once 'q' is pressed
+    """
+    cv2.imshow(WINDOW_NAME, image)
+    return cv2.waitKey(1) & 0xFF != ord('q')
+
+
+def run_sequential(cap, detector, report_every=5):
+    """
+    Read, detect and display one frame after another on this thread.
+    Returns the LatencyStats summary of the run.
+    """
+    stats = LatencyStats()
+    last_report = time.perf_counter()
     while cap.isOpened():
         ret, frame = cap.read()
         if not ret:
             break
+        captured = time.perf_counter()
 
         # Do object detection
         detections = detector.predict([frame])[0]
+        stats.add("predict", time.perf_counter() - captured)
 
         # Process the frame with detections
         processed_frame = process_frame(frame, detections)
 
-        # Display the frame
-        cv2.imshow("AR Object Detection", processed_frame)
-
-        # Exit on pressing 'q'
-        if cv2.waitKey(1) & 0xFF == ord('q'):
+        # Display the frame, exit on pressing 'q'
+        keep_going = show(processed_frame)
+        shown = time.perf_counter()
+        stats.count("display")
+        stats.add("end_to_end", shown - captured)
+        if report_every and shown - last_report >= report_every:
+            logger.info(format_summary(stats.summary()))
+            last_report = shown
+        if not keep_going:
             break
+    return stats.summary()
 
-    cap.release()
-    cv2.destroyAllWindows()
 
 if __name__ == "__main__":
     main()
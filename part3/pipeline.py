@@ -0,0 +1,421 @@
+import os
+import glob
+import time
+import logging
+import threading
+from collections import deque
+
+import cv2
+import numpy as np
+
+logger = logging.getLogger("part3")
+
+DROP_POLICIES = ("latest", "drop-oldest", "block")
+IMAGE_EXTENSIONS = (".jpg", ".jpeg", ".png", ".bmp", ".tif", ".tiff", ".webp")
+
+
+class Frame:
+    """
+    A captured image with its position in the stream and the time it was read
+    """
+
+    __slots__ = ("index", "image", "captured")
+
+    def __init__(self, index, image, captured):
+        self.index = index
+        self.image = image
+        self.captured = captured
+
+
+class Detections:
+    """
+    Detections of one frame, with the capture time of that frame
+    """
+
+    __slots__ = ("index", "captured", "detections")
+
+    def __init__(self, index, captured, detections):
+        self.index = index
+        self.captured = captured
+        self.detections = detections
+
+
+class FrameBuffer:
+    """
+    Hands frames from a producer thread to a consumer thread under a frame-drop policy:
+    - "latest": only the newest frame is kept, so the consumer always gets the freshest
+      one and frames it had no time for are dropped.
+    - "drop-oldest": up to size frames are queued, the oldest is dropped when full.
+    - "block": up to size frames are queued and the producer waits, nothing is dropped.
+    """
+
+    def __init__(self, policy="latest", size=1):
+        if policy not in DROP_POLICIES:
+            raise ValueError(f"Unknown drop policy {policy!r}, expected one of {', '.join(DROP_POLICIES)}")
+        self.policy = policy
+        self.size = 1 if policy == "latest" else max(1, size)
+        self.frames = deque()
+        self.condition = threading.Condition()
+        self.closed = False
+        self.dropped = 0
+
+    def put(self, frame):
+        with self.condition:
+            if self.policy == "block":
+                while len(self.frames) >= self.size and not self.closed:
+                    self.condition.wait()
+            elif len(self.frames) >= self.size:
+                self.frames.popleft()
+                self.dropped += 1
+            if self.closed:
+                return
+            self.frames.append(frame)
+            self.condition.notify_all()
+
+    def get(self):
+        """
+        Return the next frame, or None once the buffer is closed and empty
+        """
+        with self.condition:
+            while not self.frames and not self.closed:
+                self.condition.wait()
+            if not self.frames:
+                return None
+            frame = self.frames.popleft()
+            self.condition.notify_all()
+            return frame
+
+    def close(self):
+        with self.condition:
+            self.closed = True
+            self.condition.notify_all()
+
+
+class LatencyStats:
+    """
+    Recent samples of named latencies and counters of events, reported as rates and percentiles
+    """
+
+    def __init__(self, window=1000):
+        self.samples = {}  # name -> recent values in seconds
+        self.counts = {}  # name -> events since start
+        self.window = window
+        self.lock = threading.Lock()
+        self.started = time.perf_counter()
+
+    def add(self, name, value):
+        with self.lock:
+            if name not in self.samples:
+                self.samples[name] = deque(maxlen=self.window)
+            self.samples[name].append(value)
+
+    def count(self, name, amount=1):
+        with self.lock:
+            self.counts[name] = self.counts.get(name, 0) + amount
+
+    def summary(self):
+        """
+        Return events per second and the mean and p50/p90/p99 in milliseconds of every latency
+        """
+        elapsed = time.perf_counter() - self.started
+        with self.lock:
+            samples = {name: np.array(values) for name, values in self.samples.items() if values}
+            counts = dict(self.counts)
+        summary = {"seconds": elapsed, "rates": {name: count / elapsed for name, count in counts.items()},
+                   "latency_ms": {}}
+        for name, values in samples.items():
+            p50, p90, p99 = np.percentile(values, [50, 90, 99]) * 1000
+            summary["latency_ms"][name] = {"mean": values.mean() * 1000, "p50": p50, "p90": p90, "p99": p99}
+        return summary
+
+
+def format_summary(summary):
+    """
+    One log line of a LatencyStats summary
+    """
+    rates = ", ".join(f"{name} {rate:.1f}/s" for name, rate in summary["rates"].items())
+    latencies = ", ".join(f"{name} p50 {values['p50']:.0f} ms p99 {values['p99']:.0f} ms"
+                          for name, values in summary["latency_ms"].items())
+    return f"{rates}; {latencies}"
+
+
+class ConcurrentPipeline:
+    """
+    Capture, inference and rendering on separate threads, so the display runs at the
+    camera rate instead of the detector's. The capture thread reads frames as fast as the
+    camera delivers them, which also keeps the driver buffer from filling with stale ones.
+    The inference worker takes frames from a FrameBuffer under the drop policy, and the
+    render loop draws the newest frame with the most recent detections available.
+    """
+
+    def __init__(self, capture, detector, render, drop_policy="latest", queue_size=4, report_every=5.0):
+        """
+        Args:
+            capture: Source with read() -> (ok, image), such as cv2.VideoCapture.
+            detector (RCNNDetector): Detector run by the inference worker.
+            render (callable): Draws detections on an image and returns it, such as ar.process_frame.
+            drop_policy (str): FrameBuffer policy of the frames waiting for inference.
+            queue_size (int): Frames queued for inference by "drop-oldest" and "block".
+            report_every (float): Seconds between log lines with rates and latencies, 0 for none.
+        """
+        self.capture = capture
+        self.detector = detector
+        self.render = render
+        self.report_every = report_every
+        self.inference_frames = FrameBuffer(drop_policy, queue_size)
+        self.display_frames = FrameBuffer("latest")
+        self.detections = Detections(-1, None, [])
+        self.stats = LatencyStats()
+        self.stopped = threading.Event()
+        self.error = None
+
+    def _capture_loop(self):
+        index = 0
+        try:
+            while not self.stopped.is_set():
+                ok, image = self.capture.read()
+                if not ok:
+                    break
+                frame = Frame(index, image, time.perf_counter())
+                self.stats.count("capture")
+                self.inference_frames.put(frame)
+                self.display_frames.put(frame)
+                index += 1
+        finally:
+            self.inference_frames.close()
+            self.display_frames.close()
+
+    def _inference_loop(self):
+        try:
+            while True:
+                frame = self.inference_frames.get()
+                if frame is None:
+                    return
+                start = time.perf_counter()
+                detections = self.detector.predict([frame.image])[0]
+                self.stats.add("predict", time.perf_counter() - start)
+                self.stats.count("inference")
+                # Replacing the reference is atomic, the render loop reads whichever result is current
+                self.detections = Detections(frame.index, frame.captured, detections)
+        except Exception as e:
+            # Stop the other stages instead of leaving them blocked on full buffers
+            self.error = e
+            self.stopped.set()
+            self.inference_frames.close()
+            self.display_frames.close()
+
+    def run(self, show):
+        """
+        Run until the capture ends or show returns False, rendering on the calling thread.
+        Args:
+            show (callable): Displays a rendered image, returns False to stop.
+        Returns:
+            dict: LatencyStats summary of the run.
+        Raises the exception of the detector if it failed.
+        """
+        threads = [threading.Thread(target=self._capture_loop, name="capture", daemon=True),
+                   threading.Thread(target=self._inference_loop, name="inference", daemon=True)]
+        for thread in threads:
+            thread.start()
+        last_report = time.perf_counter()
+        try:
+            while True:
+                frame = self.display_frames.get()
+                if frame is None:
+                    break
+                detections = self.detections
+                # The inference worker may still be reading this frame, so the overlay is drawn on a copy
+                image = self.render(frame.image.copy(), detections.detections)
+                keep_going = show(image)
+                shown = time.perf_counter()
+                self.stats.count("display")
+                self.stats.add("end_to_end", shown - frame.captured)
+                if detections.captured is not None:
+                    self.stats.add("detection_age", shown - detections.captured)
+                if self.report_every and shown - last_report >= self.report_every:
+                    logger.info(format_summary(self.stats.summary()))
+                    last_report = shown
+                if not keep_going:
+                    break
+        finally:
+            self.stopped.set()
+            self.inference_frames.close()
+            self.display_frames.close()
+            for thread in threads:
+                thread.join()
+        if self.error is not None:
+            raise self.error
+        summary = self.stats.summary()
+        summary["dropped"] = {"inference": self.inference_frames.dropped, "display": self.display_frames.dropped}
+        return summary
+
+
+class ImageSequence:
+    """
+    Frames read from a list of image files, with the read() interface of cv2.VideoCapture
+    """
+
+    def __init__(self, paths):
+        self.paths = list(paths)
+        self.position = 0
+
+    def isOpened(self):
+        return self.position < len(self.paths)
+
+    def read(self):
+        while self.position < len(self.paths):
+            image = cv2.imread(self.paths[self.position])
+            self.position += 1
+            if image is not None:
+                return True, image
+            logger.warning(f"Skipping unreadable image {self.paths[self.position - 1]}")
+        return False, None
+
+    def release(self):
+        pass
+
+
+def open_source(path):
+    """
+    Open a video file, an image folder, a glob of images, or a printf-style image
+    sequence such as frames/%05d.png
+    """
+    if os.path.isdir(path):
+        return ImageSequence(sorted(os.path.join(path, name) for name in os.listdir(path)
+                                    if name.lower().endswith(IMAGE_EXTENSIONS)))
+    if glob.has_magic(path):
+        return ImageSequence(sorted(glob.glob(path)))
+    capture = cv2.VideoCapture(path)
+    if not capture.isOpened():
+        raise ValueError(f"Cannot open {path}")
+    return capture
+
+
+class VideoSink:
+    """
+    Encode frames into a video file, opened with the size of the first frame
+    """
+
+    def __init__(self, path, fps=30):
+        self.path = path
+        self.fps = fps
+        self.writer = None
+
+    def write(self, image):
+        if self.writer is None:
+            codec = "MJPG" if self.path.lower().endswith(".avi") else "mp4v"
+            height, width = image.shape[:2]
+            self.writer = cv2.VideoWriter(self.path, cv2.VideoWriter_fourcc(*codec), self.fps, (width, height))
+            if not self.writer.isOpened():
+                raise ValueError(f"Cannot write video {self.path}")
+        self.writer.write(image)
+
+    def release(self):
+        if self.writer is not None:
+            self.writer.release()
+
+
+class HeadlessPipeline:
+    """
+    Process every frame of a recorded source without a display, for servers and benchmarks.
+    A reader thread decodes frames ahead, the calling thread only runs the detector, and a
+    writer thread draws the detections and encodes the output. The stages are connected by
+    blocking FrameBuffers, so no frame is dropped and the output keeps the input order.
+    Every stage is timed per frame: capture (decode), predict, draw and encode.
+    """
+
+    def __init__(self, source, detector, render, sink=None, queue_size=8, max_frames=None, report_every=5.0):
+        """
+        Args:
+            source: Source with read() -> (ok, image), see open_source.
+            detector (RCNNDetector): Detector, or an ObjectTracker wrapping one.
+            render (callable): Draws detections on an image and returns it, such as ar.process_frame.
+            sink (VideoSink): Output of the annotated frames, None discards them.
+            queue_size (int): Frames buffered between the stages.
+            max_frames (int): Stop after this many frames, None for the whole source.
+            report_every (float): Seconds between log lines with rates and latencies, 0 for none.
+        """
+        self.source = source
+        self.detector = detector
+        self.render = render
+        self.sink = sink
+        self.max_frames = max_frames
+        self.report_every = report_every
+        self.decoded = FrameBuffer("block", queue_size)
+        self.detected = FrameBuffer("block", queue_size)
+        self.stats = LatencyStats(window=None)
+        self.stopped = threading.Event()
+        self.error = None
+
+    def _read_loop(self):
+        index = 0
+        try:
+            while not self.stopped.is_set() and (self.max_frames is None or index < self.max_frames):
+                start = time.perf_counter()
+                ok, image = self.source.read()
+                if not ok:
+                    break
+                captured = time.perf_counter()
+                self.stats.add("capture", captured - start)
+                self.decoded.put(Frame(index, image, start))
+                index += 1
+        finally:
+            self.decoded.close()
+
+    def _write_loop(self):
+        try:
+            while True:
+                item = self.detected.get()
+                if item is None:
+                    return
+                frame, detections = item
+                start = time.perf_counter()
+                image = self.render(frame.image, detections)
+                drawn = time.perf_counter()
+                self.stats.add("draw", drawn - start)
+                if self.sink is not None:
+                    self.sink.write(image)
+                    self.stats.add("encode", time.perf_counter() - drawn)
+                self.stats.count("frames")
+                self.stats.add("end_to_end", time.perf_counter() - frame.captured)
+        except Exception as e:
+            # Stop the other stages instead of leaving them blocked on full buffers
+            self.error = e
+            self.stopped.set()
+            self.decoded.close()
+            self.detected.close()
+
+    def run(self):
+        """
+        Process the source to its end and return the LatencyStats summary of the run.
+        End-to-end latency of a frame runs from the start of its decode until it is encoded.
+        """
+        threads = [threading.Thread(target=self._read_loop, name="reader", daemon=True),
+                   threading.Thread(target=self._write_loop, name="writer", daemon=True)]
+        for thread in threads:
+            thread.start()
+        last_report = time.perf_counter()
+        try:
+            while True:
+                frame = self.decoded.get()
+                if frame is None:
+                    break
+                start = time.perf_counter()
+                detections = self.detector.predict([frame.image])[0]
+                now = time.perf_counter()
+                self.stats.add("predict", now - start)
+                self.detected.put((frame, detections))
+                if self.report_every and now - last_report >= self.report_every:
+                    logger.info(format_summary(self.stats.summary()))
+                    last_report = now
+        finally:
+            self.stopped.set()
+            self.decoded.close()
+            self.detected.close()
+            for thread in threads:
+                thread.join()
+            if self.sink is not None:
+                self.sink.release()
+        if self.error is not None:
+            raise self.error
+        return self.stats.summary()
@@ -1,4 +1,5 @@
 import cv2
+import numpy as np
 import torch
 from torchvision.models.detection import fasterrcnn_resnet50_fpn
 from torchvision.transforms import functional as F
@@ -12,9 +13,13 @@ def get_label_from_id(category_id):
     return category_names.get(category_id, "unknown")
 
 class RCNNDetector:
-    def __init__(self, device='cpu', conf_thresh=0.5):
+    def __init__(self, device='cpu', conf_thresh=0.5, classes=None):
         """
         Initialize the Faster R-CNN
+        Args:
+            device (str): Device for PyTorch.
+            conf_thresh (float): Minimum score of a kept detection.
+            classes (list[str], optional): Only keep detections with these labels.
         """
         self.device = torch.device(device)
         self.conf_thresh = conf_thresh
@@ -22,6 +27,18 @@ class RCNNDetector:
         self.model.to(self.device)
         self.model.eval()
 
+        # Label names and the class allow-list are looked up by label id in one shot
+        num_classes = self.model.roi_heads.box_predictor.cls_score.out_features
+        self.label_names = np.array([get_label_from_id(i) for i in range(num_classes)], dtype=object)
+        self.classes = list(classes) if classes is not None else None
+        self.allowed_labels = None
+        if self.classes is not None:
+            unknown = set(self.classes) - set(self.label_names)
+            if unknown:
+                raise ValueError(f"Unknown classes: {sorted(unknown)}")
+            allowed = np.isin(self.label_names, self.classes)
+            self.allowed_labels = torch.from_numpy(allowed).to(self.device)
+
     def preprocess(self, image):
         """
         Preprocess an image for the model
@@ -29,25 +46,51 @@ class RCNNDetector:
         image = cv2.cvtColor(image, cv2.COLOR_BGR2RGB)  # Convert to RGB
         return F.to_tensor(image).to(self.device)
 
-    def postprocess(self, outputs):
+    def postprocess(self, outputs, raw=False):
         """
-        Filter predictions by confidence
+        Filter predictions of a whole batch by confidence and class.
+        Filtering runs on the device and the kept detections are copied to the host once.
+        Returns per image either a list of detection dicts or, with raw=True, a dict of
+        "boxes" (N, 4), "scores" (N,) and "labels" (N,) label id arrays.
         """
+        if not outputs:
+            return []
+        sizes = torch.tensor([len(output['scores']) for output in outputs], device=self.device)
+        boxes = torch.cat([output['boxes'] for output in outputs])
+        scores = torch.cat([output['scores'] for output in outputs])
+        labels = torch.cat([output['labels'] for output in outputs])
+        image_ids = torch.repeat_interleave(torch.arange(len(outputs), device=self.device), sizes)
+
+        keep = scores >= self.conf_thresh
+        if self.allowed_labels is not None:
+            keep &= self.allowed_labels[labels]
+        packed = torch.cat([
+            boxes[keep],
+            scores[keep, None],
+            labels[keep, None].to(scores.dtype),
+            image_ids[keep, None].to(scores.dtype),
+        ], dim=1).cpu().numpy()
+
+        counts = np.bincount(packed[:, 6].astype(np.int64), minlength=len(outputs))
         results = []
-        for box, score, label in zip(outputs['boxes'], outputs['scores'], outputs['labels']):
-            if score >= self.conf_thresh:
-                results.append({
-                    "bbox": box.cpu().numpy().tolist(),
-                    "score": float(score.cpu().numpy()),
-                    "label": get_label_from_id(int(label.cpu().numpy()))
-                })
+        for chunk in np.split(packed, np.cumsum(counts)[:-1]):
+            chunk_boxes, chunk_scores = chunk[:, :4], chunk[:, 4]
+            chunk_labels = chunk[:, 5].astype(np.int64)
+            if raw:
+                results.append({"boxes": chunk_boxes, "scores": chunk_scores, "labels": chunk_labels})
+                continue
+            results.append([
+                {"bbox": bbox, "score": score, "label": label}
+                for bbox, score, label in zip(chunk_boxes.tolist(), chunk_scores.tolist(),
+                                              self.label_names[chunk_labels].tolist())
+            ])
         return results
 
-    def predict(self, images):
+    def predict(self, images, raw=False):
         """
         Predict bounding boxes for images
         """
         tensors = [self.preprocess(image) for image in images]
         with torch.no_grad():
             outputs = self.model(tensors)
-        return [self.postprocess(output) for output in outputs]
+        return self.postprocess(outputs, raw=raw)
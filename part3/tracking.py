@@ -0,0 +1,230 @@
+import cv2
+import numpy as np
+
+_THUMBNAIL_SIZE = (64, 48)
+_FLOW_PARAMS = dict(winSize=(21, 21), maxLevel=3,
+                    criteria=(cv2.TERM_CRITERIA_EPS | cv2.TERM_CRITERIA_COUNT, 20, 0.03))
+
+
+def iou_matrix(boxes_a, boxes_b):
+    """
+    Intersection over union of every pair of (x1, y1, x2, y2) boxes, shape (len(a), len(b))
+    """
+    boxes_a = np.asarray(boxes_a, dtype=np.float32).reshape(-1, 4)
+    boxes_b = np.asarray(boxes_b, dtype=np.float32).reshape(-1, 4)
+    top_left = np.maximum(boxes_a[:, None, :2], boxes_b[None, :, :2])
+    bottom_right = np.minimum(boxes_a[:, None, 2:], boxes_b[None, :, 2:])
+    intersection = np.prod(np.clip(bottom_right - top_left, 0, None), axis=2)
+    area_a = np.prod(boxes_a[:, 2:] - boxes_a[:, :2], axis=1)
+    area_b = np.prod(boxes_b[:, 2:] - boxes_b[:, :2], axis=1)
+    union = area_a[:, None] + area_b[None, :] - intersection
+    return np.where(union > 0, intersection / np.maximum(union, 1e-9), 0)
+
+
+class Track:
+    """
+    An object followed from frame to frame, with the feature points its box moves with,
+    or the velocity of its last two detections when it has no points
+    """
+
+    __slots__ = ("track_id", "bbox", "label", "score", "points", "missed", "detection", "detected_at", "velocity")
+
+    def __init__(self, track_id, bbox, label, score, frame):
+        self.track_id = track_id
+        self.bbox = np.asarray(bbox, dtype=np.float32)
+        self.label = label
+        self.score = score
+        self.points = None  # (N, 1, 2) float32 feature points inside the box
+        self.missed = 0  # Detector runs in a row that did not find the object
+        self.detection = self.bbox  # Box of the last detection
+        self.detected_at = frame  # Frame number of the last detection
+        self.velocity = np.zeros(4, dtype=np.float32)  # Change of the box per frame
+
+    def detected(self, bbox, frame):
+        """
+        Move the track to a new detection of its object, updating its velocity
+        """
+        self.bbox = np.asarray(bbox, dtype=np.float32)
+        if frame > self.detected_at:
+            self.velocity = (self.bbox - self.detection) / (frame - self.detected_at)
+        self.detection, self.detected_at = self.bbox, frame
+
+    def to_detection(self):
+        return {"bbox": self.bbox.tolist(), "score": self.score, "label": self.label, "track_id": self.track_id}
+
+
+class ObjectTracker:
+    """
+    Runs the detector only every detect_every frames, and carries the boxes forward with
+    sparse optical flow in between. A box moves by the median motion of the feature points
+    inside it and scales by the median change of their distances. Detections are matched
+    to tracks by IoU, so objects keep their track ID, and scores are smoothed across
+    detector runs. Tracks without feature points, such as small or textureless boxes, move
+    at the velocity of their last two detections. The detector also runs early when the
+    scene changes a lot or a track loses its feature points.
+    Has the predict interface of RCNNDetector, so it can stand in for it; the images
+    given to predict must be consecutive frames of one stream.
+    """
+
+    def __init__(self, detector, detect_every=5, iou_threshold=0.3, max_missed=1, score_smoothing=0.5,
+                 scene_change=0.1, max_points=40):
+        """
+        Args:
+            detector (RCNNDetector): Detector of the keyframes.
+            detect_every (int): Frames per detector run, 1 detects on every frame.
+            iou_threshold (float): Minimum IoU of a detection and the track it continues.
+            max_missed (int): Detector runs a track survives without a matching detection.
+            score_smoothing (float): Weight of the previous score when a detection updates a track.
+            scene_change (float): Mean absolute difference of the frame from the last keyframe,
+                as a fraction of the brightness range, that triggers a detector run. 0 disables it.
+            max_points (int): Feature points followed per track.
+        """
+        self.detector = detector
+        self.detect_every = max(1, detect_every)
+        self.iou_threshold = iou_threshold
+        self.max_missed = max_missed
+        self.score_smoothing = score_smoothing
+        self.scene_change = scene_change
+        self.max_points = max_points
+        self.tracks = []
+        self.next_id = 1
+        self.previous_gray = None
+        self.keyframe = None  # Thumbnail of the frame of the last detector run
+        self.since_detection = 0
+        self.detector_runs = 0
+        self.frames = 0
+
+    def predict(self, images):
+        """
+        Detections of consecutive frames, each with the "track_id" of its object
+        """
+        return [self.track(image) for image in images]
+
+    def track(self, image):
+        """
+        Detections of the next frame of the stream
+        """
+        gray = cv2.cvtColor(image, cv2.COLOR_BGR2GRAY)
+        thumbnail = cv2.resize(gray, _THUMBNAIL_SIZE, interpolation=cv2.INTER_AREA)
+        lost = self._follow(gray) if self.previous_gray is not None and self.detect_every > 1 else False
+        self.since_detection += 1
+        if self._needs_detection(thumbnail, lost):
+            self._detect(image, gray, thumbnail)
+        self.previous_gray = gray
+        self.frames += 1
+        return [track.to_detection() for track in self.tracks]
+
+    def _needs_detection(self, thumbnail, lost):
+        if self.keyframe is None or lost or self.since_detection >= self.detect_every:
+            return True
+        if self.scene_change:
+            difference = cv2.absdiff(thumbnail, self.keyframe).mean() / 255
+            return difference > self.scene_change
+        return False
+
+    def _follow(self, gray):
+        """
+        Move every track with the optical flow of its points from the previous frame, or
+        with its velocity if it has no points.
+        Returns whether a track lost too many of its points to be followed.
+        """
+        tracks = []
+        for track in self.tracks:
+            if track.points is None:
+                track.bbox = track.bbox + track.velocity
+            else:
+                tracks.append(track)
+        if not tracks:
+            return False
+        points = np.concatenate([track.points for track in tracks])
+        moved, status, _ = cv2.calcOpticalFlowPyrLK(self.previous_gray, gray, points, None, **_FLOW_PARAMS)
+        # Points that do not flow back to where they started are unreliable
+        back, back_status, _ = cv2.calcOpticalFlowPyrLK(gray, self.previous_gray, moved, None, **_FLOW_PARAMS)
+        error = np.linalg.norm((back - points).reshape(-1, 2), axis=1)
+        good = (status.ravel() == 1) & (back_status.ravel() == 1) & (error < 1.0)
+
+        lost, offset = False, 0
+        for track in tracks:
+            count = len(track.points)
+            keep = good[offset:offset + count]
+            old, new = track.points[keep].reshape(-1, 2), moved[offset:offset + count][keep].reshape(-1, 2)
+            offset += count
+            if len(new) < 4:
+                track.points = None
+                lost = True
+                continue
+            shift = np.median(new - old, axis=0)
+            scale = 1.0
+            if len(new) >= 6:
+                # Ratio of the distances between point pairs before and after, for the change of size
+                first, second = np.triu_indices(len(new), k=1)
+                before = np.linalg.norm(old[first] - old[second], axis=1)
+                after = np.linalg.norm(new[first] - new[second], axis=1)
+                valid = before > 1
+                if valid.any():
+                    scale = float(np.clip(np.median(after[valid] / before[valid]), 0.8, 1.25))
+            center = (track.bbox[:2] + track.bbox[2:]) / 2 + shift
+            half_size = (track.bbox[2:] - track.bbox[:2]) / 2 * scale
+            track.bbox = np.concatenate([center - half_size, center + half_size]).astype(np.float32)
+            track.points = new.reshape(-1, 1, 2)
+            if len(new) < count // 2:
+                lost = True
+        return lost
+
+    def _detect(self, image, gray, thumbnail):
+        """
+        Run the detector and match its detections to the tracks
+        """
+        detections = self.detector.predict([image])[0]
+        self.detector_runs += 1
+        self.since_detection = 0
+        self.keyframe = thumbnail
+
+        matched_tracks, matched_detections = set(), set()
+        if self.tracks and detections:
+            ious = iou_matrix([track.bbox for track in self.tracks], [detection["bbox"] for detection in detections])
+            for track_index, detection_index in zip(*np.unravel_index(np.argsort(-ious, axis=None), ious.shape)):
+                if ious[track_index, detection_index] < self.iou_threshold:
+                    break
+                track, detection = self.tracks[track_index], detections[detection_index]
+                if (track_index in matched_tracks or detection_index in matched_detections
+                        or track.label != detection["label"]):
+                    continue
+                matched_tracks.add(track_index)
+                matched_detections.add(detection_index)
+                track.detected(detection["bbox"], self.frames)
+                track.score = self.score_smoothing * track.score + (1 - self.score_smoothing) * detection["score"]
+                track.missed = 0
+
+        tracks = []
+        for index, track in enumerate(self.tracks):
+            if index not in matched_tracks:
+                track.missed += 1
+                if track.missed > self.max_missed:
+                    continue
+            tracks.append(track)
+        for index, detection in enumerate(detections):
+            if index not in matched_detections:
+                tracks.append(Track(self.next_id, detection["bbox"], detection["label"], detection["score"],
+                                    self.frames))
+                self.next_id += 1
+        self.tracks = tracks
+        for track in self.tracks:
+            track.points = self._seed_points(gray, track.bbox)
+
+    def _seed_points(self, gray, bbox):
+        """
+        Pick corners inside the inner part of a box, away from the background at its edges
+        """
+        height, width = gray.shape
+        x1, y1, x2, y2 = bbox
+        margin_x, margin_y = (x2 - x1) * 0.1, (y2 - y1) * 0.1
+        left, top = int(max(0, x1 + margin_x)), int(max(0, y1 + margin_y))
+        right, bottom = int(min(width, x2 - margin_x)), int(min(height, y2 - margin_y))
+        if right - left < 8 or bottom - top < 8:
+            return None
+        corners = cv2.goodFeaturesToTrack(gray[top:bottom, left:right], maxCorners=self.max_points,
+                                          qualityLevel=0.01, minDistance=5)
+        if corners is None:
+            return None
+        return (corners + np.array([left, top], dtype=np.float32)).astype(np.float32)